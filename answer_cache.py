@@ -0,0 +1,197 @@
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from byte_lru_cache import estimate_size
+from pipeline_manifest import PipelineManifest, manifest_path
+
+# --- Konfiguration ---
+answer_cache_max_bytes = 32 * 1024 * 1024 # Antworten + Quellen + Query-Vektoren
+answer_cache_ttl = 24 * 3600 # Sekunden, danach wird eine Antwort neu generiert
+# Kosinus-Ähnlichkeit der Query-Embeddings, ab der eine ähnliche Frage die gecachte
+# Antwort wiederverwendet. 1.0 = nur exakt gleiche Fragen (nach Normalisierung).
+answer_cache_similarity_threshold = 0.95
+# --------------------
+
+# Der Cache liegt im Speicher des jeweiligen Prozesses (pro Worker). Jeder Eintrag
+# merkt sich, wann die Paper seiner Quellen zuletzt indiziert wurden ("index"-Stufe
+# im Pipeline-Manifest). Wird eines dieser Paper neu indiziert oder entfernt, ist
+# der Eintrag ungültig. Das Manifest wird nur neu gelesen, wenn sich die Datei ändert.
+# Antworten mit Metadaten-Filter (scope, siehe metadata_filter.scope_key) werden nur
+# für Anfragen mit genau demselben Filter wiederverwendet.
+# Gespeichert und zurückgegeben werden Kopien der Ergebnisse, damit Aufrufer sie
+# verändern können, ohne den Cache-Eintrag mitzuändern.
+
+
+def normalize_query(query):
+    return ' '.join(query.split()).casefold()
+
+
+class IndexVersions:
+    """ source_file -> Zeitpunkt der letzten Indizierung, aus dem Pipeline-Manifest. """
+
+    def __init__(self, path=manifest_path):
+        self.path = path
+        self._mtime = -1
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def current(self):
+        """ Aktuelle Versionen (liest das Manifest nur bei geänderter mtime; das Dict wird nie verändert). """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                versions = {}
+                if mtime is not None:
+                    for entry in PipelineManifest(self.path).stage("index").values():
+                        if entry.get("source_file"):
+                            versions[entry["source_file"]] = entry.get("updated_at")
+                self._versions = versions
+                self._mtime = mtime
+            return self._versions
+
+    def snapshot(self, source_files):
+        versions = self.current()
+        return {source_file: versions.get(source_file) for source_file in source_files}
+
+
+class AnswerCache:
+    """ Thread-sicherer Cache für fertige RAG-Antworten.
+
+    Treffer zuerst über die normalisierte Frage (exakt), sonst über die
+    Kosinus-Ähnlichkeit des Query-Embeddings zu allen gecachten Fragen.
+    Begrenzt nach Bytes (LRU) und Alter (TTL).
+    """
+
+    def __init__(self, max_bytes=answer_cache_max_bytes, ttl=answer_cache_ttl,
+                 threshold=answer_cache_similarity_threshold, index_versions=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.threshold = threshold
+        self.index_versions = index_versions or IndexVersions()
+        self._entries = OrderedDict() # (scope, normalisierte Frage) -> Eintrag
+        self._lock = threading.Lock()
+        self._matrix = None # Zeilen = normierte Query-Vektoren in Reihenfolge von _matrix_keys
+        self._matrix_keys = []
+        self._matrix_scopes = None
+        self.current_bytes = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, query, embed_fn=None, scope=""):
+        """ Sucht eine gecachte Antwort. Gibt (results_data oder None, Ähnlichkeit, Query-Embedding) zurück.
+
+        embed_fn(query) wird nur aufgerufen, wenn es keinen exakten Treffer gibt; das
+        Embedding wird zurückgegeben, damit der Aufrufer es für Retrieval und put() nutzt.
+        """
+        key = (scope, normalize_query(query))
+        versions = self.index_versions.current() # Vor dem Lock: liest ggf. das ganze Manifest
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_valid(key, entry, versions):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return copy.deepcopy(entry["result"]), 1.0, entry["vector"]
+        if embed_fn is None:
+            with self._lock:
+                self.misses += 1
+            return None, None, None
+
+        query_embedding = embed_fn(query) # Außerhalb des Locks: das Modell kann dauern
+        versions = self.index_versions.current()
+        with self._lock:
+            if self.threshold < 1.0:
+                match_key, similarity = self._nearest(query_embedding, scope)
+                if match_key is not None and similarity >= self.threshold:
+                    entry = self._entries[match_key]
+                    if self._is_valid(match_key, entry, versions):
+                        self._entries.move_to_end(match_key)
+                        self.semantic_hits += 1
+                        return copy.deepcopy(entry["result"]), similarity, query_embedding
+            self.misses += 1
+        return None, None, query_embedding
+
+    def put(self, query, query_embedding, result, scope=""):
+        source_files = {source["source_file"] for source in result.get("sources", [])}
+        versions = self.index_versions.snapshot(source_files)
+        vector = None
+        if query_embedding is not None:
+            vector = np.asarray(query_embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        key = (scope, normalize_query(query))
+        result = copy.deepcopy(result)
+        entry = {"result": result, "vector": vector, "versions": versions, "created_at": time.time()}
+        size = estimate_size(result) + estimate_size(vector) + estimate_size(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            entry["size"] = size
+            self._entries[key] = entry
+            self.current_bytes += size
+            self._matrix = None
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- Interna (Aufrufer hält self._lock) ---
+    def _is_valid(self, key, entry, versions):
+        expired = time.time() - entry["created_at"] > self.ttl
+        changed = any(versions.get(source_file) != version for source_file, version in entry["versions"].items())
+        if expired or changed:
+            self._remove(key)
+            self.invalidations += 1
+            return False
+        return True
+
+    def _nearest(self, query_embedding, scope):
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry["vector"] is not None]
+            self._matrix = (np.stack([self._entries[key]["vector"] for key in self._matrix_keys])
+                            if self._matrix_keys else None)
+            self._matrix_scopes = np.array([key[0] for key in self._matrix_keys], dtype=object)
+        if self._matrix is None:
+            return None, None
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        similarities = self._matrix @ (vector / (np.linalg.norm(vector) or 1.0))
+        similarities[self._matrix_scopes != scope] = -np.inf # Nur Antworten mit gleichem Filter
+        best = int(np.argmax(similarities))
+        return self._matrix_keys[best], float(similarities[best])
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry["size"]
+        self._matrix = None
@@ -1,15 +1,24 @@
 # --- Imports ---
-from flask import Flask, render_template, request, url_for
+from flask import Flask, render_template, request, url_for, send_from_directory, abort, jsonify, has_request_context
+from urllib.parse import quote
 import os
-import json
-import chromadb
-from sentence_transformers import SentenceTransformer
+import gc
+import threading
+from contextlib import contextmanager
 # import ollama # <-- Entfernen oder auskommentieren
-import google.generativeai as genai # <-- NEU: Google AI importieren
+# chromadb, sentence_transformers und google.generativeai werden erst in load_components() importiert
 from dotenv import load_dotenv # <-- NEU: Für .env Datei
+from chunk_store import get_chunk_texts, get_default_store, loaded_chunks_cache # Gemeinsamer O(1)-Lookup der Chunk-Texte
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from lexical_index import get_default_index, reciprocal_rank_fusion
+from vector_index import VectorIndex
+from metadata_filter import build_where, scope_key, where_from_payload
+from context_packer import context_token_budget, pack_context
+from micro_batcher import MicroBatcher
+from llm_backends import ContentBlocked, LLMError, build_llm
 import time
 import traceback
-import base64
 
 load_dotenv()
 
@@ -21,8 +30,39 @@ chunks_input_directory = "chunks_output"
 pdfs_input_directory = "pdfs_input"
 GEMINI_MODEL_NAME = "Gemini 2.0 Flash-Lite"
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# LLM-Backends für die Generation (llm_backends.py): "gemini", "ollama", "openai" (OpenAI-kompatibel)
+# oder "stub" (offline, für Tests). Mehrere Einträge bilden eine Failover-Kette, z.B.
+# ["gemini", "ollama"]: ist Gemini ausgelastet oder im Rate-Limit, antwortet das lokale Modell.
+llm_backends = ["gemini"]
 ##ollama_base_url = "http://localhost:11434"
 retrieval_k = 3
+# "chroma": ChromaDB-Sammlung; "numpy": In-Process-Index aus vector_index.py
+# (vorher `python vector_index.py` bzw. `python index_data.py --vector-index` ausführen)
+retrieval_backend = "chroma"
+# Hybrid-Retrieval: Vektor- und BM25-Treffer (lexical_index.py) per Reciprocal Rank Fusion
+# zusammenführen. Findet auch exakte Begriffe (Gen-Namen, Wirkstoff-Codes, Abkürzungen).
+hybrid_retrieval = True
+hybrid_candidates = 20 # Kandidaten pro Verfahren vor der Fusion
+# Optionales Reranking mit einem Cross-Encoder (reranker.py): rerank_candidates Chunks holen,
+# gemeinsam mit der Frage bewerten und nur die besten (retrieval_k bzw. context_candidates) weitergeben.
+rerank_enabled = False
+rerank_candidates = 50
+rerank_latency_budget = 0.3 # Sekunden pro Frage; sonst werden nur die vordersten Kandidaten neu sortiert
+# Kontext-Packing (context_packer.py): context_candidates Treffer holen und gierig in
+# context_token_budget Tokens packen (zu große Chunks nur mit ihren relevantesten Sätzen,
+# Duplikate raus, benachbarte Chunks eines Papers zusammengefügt). Aus: retrieval_k ganze Chunks.
+context_packing = True
+context_candidates = 10
+pdf_cache_max_age = 3600 # Sekunden, die Browser eine PDF ohne Revalidierung cachen dürfen
+# "torch": SentenceTransformer (PyTorch); "onnx": exportiertes int8-Modell über ONNX Runtime
+# (onnx_encoder.py, vorher `python onnx_encoder.py` ausführen) – weniger Speicher, schneller auf CPUs
+encoder_backend = "torch"
+# Gleichzeitige Fragen gemeinsam encodieren (micro_batcher.py; Fenster und Batch-Größe dort)
+query_batching = True
+# "background": beim Import im Hintergrund laden; "preload": create_app() lädt die Modelle
+# vor dem fork der Worker (gunicorn preload_app, siehe gunicorn.conf.py)
+load_mode = os.getenv("RAG_LOAD_MODE", "background")
+retry_after_seconds = 5 # Retry-After-Header für 503-Antworten, solange die Komponenten noch laden
 # ---------------------------------
 
 # --- Flask App Initialisierung ---
@@ -31,209 +71,463 @@ app = Flask(__name__)
 # app.secret_key = 'ein_sehr_geheimer_schluessel'
 # ---------------------------------
 
-# --- RAG Komponenten Laden (Global beim Start) ---
-# HINWEIS: Das Laden großer Modelle hier kann den Start verzögern.
-# In Produktionsumgebungen gibt es bessere Muster (z.B. Application Factories).
-print("Loading RAG components...")
+# --- RAG Komponenten Laden (im Hintergrund) ---
+# Die schweren Imports (chromadb, sentence_transformers, google.generativeai) und das Laden
+# der Modelle passieren erst in load_components(), nicht beim Import dieses Moduls.
+# start_loading() führt das in einem Hintergrund-Thread aus, der HTTP-Server ist also sofort
+# erreichbar: /healthz antwortet immer, /readyz erst dann mit 200, wenn alles geladen ist.
+# Bis dahin beantworten Fragen-Endpunkte Anfragen mit 503 (Retry-After).
 RAG_COMPONENTS_LOADED = False
+RAG_LOAD_ERROR = None # Fehlermeldung, falls das Laden fehlgeschlagen ist
+load_timings = {} # Sekunden pro Schritt (Import bzw. Laden jeder Komponente), siehe /readyz
 rag_collection = None
 rag_embedding_model = None
-rag_gemini_model = None # <-- NEU: Variable für Gemini Modell
-# --- NEU: Prüfe API Key und konfiguriere Gemini ---
-if not GOOGLE_API_KEY:
-    print("FATAL ERROR: GOOGLE_API_KEY not found in environment variables.")
-    print("Please create a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
-else:
+rag_llm = None # Generations-Backend bzw. Failover-Kette (llm_backends.build_llm)
+rag_query_cache = None # Embedding-Cache für Queries (Disk + In-Memory-LRU)
+rag_query_batcher = None # Bündelt gleichzeitige Query-Encodings (nur mit query_batching)
+rag_answer_cache = AnswerCache() # Fertige Antworten (exakte + ähnliche Fragen), pro Prozess
+rag_reranker = None # Nur gesetzt, wenn rerank_enabled und das Modell geladen werden konnte
+_loading_lock = threading.Lock()
+_loading_thread = None
+_loading_finished = threading.Event() # Gesetzt, sobald load_components() fertig ist (auch bei Fehlern)
+
+
+@contextmanager
+def _timed(step):
+    """ Misst die Dauer eines Ladeschritts und legt sie in load_timings ab. """
+    start = time.time()
     try:
-        genai.configure(api_key=GOOGLE_API_KEY) # <-- NEU: Google API konfigurieren
-        print("Google AI SDK configured.")
-
-        # Lade andere Komponenten
-        rag_collection = chromadb.PersistentClient(path=chroma_db_path).get_collection(name=collection_name)
-        rag_embedding_model = SentenceTransformer(embedding_model_name)
-
-        # --- NEU: Initialisiere das Gemini Modell ---
-        rag_gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        print(f"Gemini model '{GEMINI_MODEL_NAME}' loaded.")
-        # ------------------------------------------
+        yield
+    finally:
+        load_timings[step] = round(time.time() - start, 3)
+        print(f"  {step}: {load_timings[step]:.2f}s")
+
+
+def _load_models():
+    """ Der teure Teil: Imports, Modellgewichte und Indizes.
+
+    Enthält keine Verbindungen oder Threads und kann daher vor einem fork() geladen und
+    von den Worker-Prozessen per Copy-on-Write geteilt werden (siehe create_app()).
+    """
+    global rag_collection, rag_embedding_model, rag_reranker
+    if "gemini" in llm_backends:
+        with _timed("import google.generativeai"):
+            import google.generativeai # <-- NEU: Google AI importieren (Client erst in _open_clients())
+    if retrieval_backend == "numpy":
+        with _timed("vector_index"):
+            rag_collection = VectorIndex() # Gleiche query()-Schnittstelle wie die Chroma-Sammlung (mmap, fork-sicher)
+    else:
+        with _timed("import chromadb"):
+            import chromadb
+    if encoder_backend == "onnx":
+        with _timed("embedding_model"):
+            from onnx_encoder import OnnxEncoder
+            rag_embedding_model = OnnxEncoder(embedding_model_name) # Ohne torch; Session erst beim ersten encode()
+    else:
+        with _timed("import sentence_transformers"):
+            from sentence_transformers import SentenceTransformer
+        with _timed("embedding_model"):
+            rag_embedding_model = SentenceTransformer(embedding_model_name)
+    if rerank_enabled:
+        try:
+            with _timed("reranker"):
+                from reranker import Reranker
+                rag_reranker = Reranker()
+            print(f"Reranker '{rag_reranker.model_name}' loaded.")
+        except Exception as e:
+            # Ohne Reranker weiterarbeiten: Retrieval funktioniert auch so
+            print(f"Warning: Could not load reranker, continuing without reranking: {e}")
+    if hybrid_retrieval:
+        with _timed("lexical_index"):
+            get_default_index() # BM25-Index vorab laden statt bei der ersten Frage
+
+
+def _open_clients():
+    """ Der billige Teil: Clients und Verbindungen (ChromaDB, SQLite-Cache, LLM-Backends).
+
+    Diese sind nicht fork-sicher und werden deshalb in jedem Prozess selbst geöffnet.
+    """
+    global rag_collection, rag_query_cache, rag_query_batcher, rag_llm
+    if retrieval_backend != "numpy":
+        import chromadb
+        with _timed("chroma_collection"):
+            rag_collection = chromadb.PersistentClient(path=chroma_db_path).get_collection(name=collection_name)
+    print(f"Retrieval backend: {retrieval_backend}")
+    cache_name = rag_embedding_model.cache_name if encoder_backend == "onnx" else embedding_model_name
+    rag_query_cache = EmbeddingCache(cache_name, rag_embedding_model.get_sentence_embedding_dimension())
+    if query_batching:
+        # Hintergrund-Thread pro Prozess, startet beim ersten Aufruf
+        rag_query_batcher = MicroBatcher(
+            lambda texts: rag_embedding_model.encode(texts, batch_size=len(texts), show_progress_bar=False))
+
+    with _timed("llm_backends"):
+        rag_llm = build_llm(llm_backends, gemini={"model_name": GEMINI_MODEL_NAME, "api_key": GOOGLE_API_KEY,
+                                                  "safety_settings": GEMINI_SAFETY_SETTINGS})
+    print(f"LLM backend '{rag_llm.name}' ready.")
+
+
+def load_components():
+    """ Lädt alle RAG-Komponenten (blockierend) und setzt RAG_COMPONENTS_LOADED bzw. RAG_LOAD_ERROR.
+
+    Wurden die Modelle schon vor dem fork geladen (preload_models()), werden nur noch die
+    Verbindungen geöffnet.
+    """
+    global RAG_COMPONENTS_LOADED, RAG_LOAD_ERROR
+    print("Loading RAG components...")
+    start_loading_time = time.time()
+    try:
+        # --- NEU: Prüfe API Key ---
+        if "gemini" in llm_backends and not GOOGLE_API_KEY:
+            print("FATAL ERROR: GOOGLE_API_KEY not found in environment variables.")
+            print("Please create a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
+            RAG_LOAD_ERROR = "GOOGLE_API_KEY not set"
+            return
+        if rag_embedding_model is None:
+            _load_models()
+        _open_clients()
 
-        print("RAG components loaded successfully.")
         RAG_COMPONENTS_LOADED = True
+        print(f"RAG components loaded successfully in {time.time() - start_loading_time:.2f} seconds.")
 
     except Exception as e:
+        RAG_LOAD_ERROR = str(e)
         print(f"FATAL ERROR: Could not load RAG components: {e}")
         print(traceback.format_exc())
-# --------------------------------------------------
+    finally:
+        load_timings["total"] = round(time.time() - start_loading_time, 3)
+        _loading_finished.set()
 
-# --- Chunk Cache (einfache globale Variable für Flask) ---
-loaded_chunks_cache = {}
-# -------------------------------------------------------
-
-# --- Hilfsfunktion get_chunk_text (angepasst für Flask) ---
-def get_chunk_text(metadata):
-    global loaded_chunks_cache # Zugriff auf globale Cache-Variable
-    document_text = "Error: Could not retrieve text."
-    source_file = metadata.get('source_file')
-    if source_file:
-        json_filename = source_file.replace(".pdf", "_chunks.json")
-        chunks_json_path = os.path.join(chunks_input_directory, json_filename)
-        try:
-            if chunks_json_path not in loaded_chunks_cache:
-                if os.path.exists(chunks_json_path):
-                    with open(chunks_json_path, 'r', encoding='utf-8') as f_json:
-                        loaded_chunks_cache[chunks_json_path] = json.load(f_json)
-                else:
-                    loaded_chunks_cache[chunks_json_path] = None
-
-            chunks_list = loaded_chunks_cache.get(chunks_json_path)
-
-            if chunks_list:
-                p_index = metadata.get('paragraph_index')
-                c_type = metadata.get('chunk_type')
-                # Finde den Chunk (Logik wie zuvor)
-                found_chunk = None
-                for chunk in chunks_list:
-                     chunk_meta = chunk.get('metadata', {})
-                     if chunk_meta.get('paragraph_index') == p_index and chunk_meta.get('chunk_type') == c_type:
-                         found_chunk = chunk
-                         break
-                if not found_chunk:
-                     found_chunk = next((c for c in chunks_list if c.get('metadata') == metadata), None)
-
-                if found_chunk:
-                    document_text = found_chunk.get('text', "Error: Text key missing.")
-                else:
-                    document_text = f"Error: Matching chunk not found."
-            elif loaded_chunks_cache.get(chunks_json_path) is None:
-                 document_text = f"Error: Chunks file '{json_filename}' not found."
-            else:
-                 document_text = f"Error: Chunks file empty or invalid."
-        except Exception as e:
-            document_text = f"Error loading/processing chunks file: {e}"
-            print(f"Warning: Error loading {json_filename}: {e}") # Log zum Terminal
-    else:
-        document_text = "Error: 'source_file' missing."
-    return document_text
-# ----------------------------------------------------------
+
+def preload_models():
+    """ Lädt die Modelle synchron im aktuellen (Master-)Prozess, bevor die Worker geforkt werden.
+
+    Danach schiebt gc.freeze() alle bis dahin erzeugten Objekte in eine permanente Generation:
+    Der Garbage Collector der Worker fasst sie nicht mehr an, die Speicherseiten bleiben geteilt.
+    Schlägt das Laden fehl, versucht es jeder Worker in load_components() erneut.
+    """
+    print("Preloading models before fork...")
+    start_preload = time.time()
+    try:
+        _load_models()
+    except Exception as e:
+        print(f"Warning: Could not preload models, workers will load them on their own: {e}")
+        print(traceback.format_exc())
+    load_timings["preload"] = round(time.time() - start_preload, 3)
+    gc.collect()
+    gc.freeze()
+
+
+def start_loading():
+    """ Startet load_components() einmalig in einem Daemon-Thread und kehrt sofort zurück. """
+    global _loading_thread
+    with _loading_lock:
+        if _loading_thread is None:
+            _loading_thread = threading.Thread(target=load_components, name="rag-loader", daemon=True)
+            _loading_thread.start()
+
+
+def wait_until_loaded(timeout=None):
+    """ Für Skripte (z.B. batch_query.py): startet das Laden falls nötig und wartet darauf.
+
+    Gibt RAG_COMPONENTS_LOADED zurück.
+    """
+    start_loading()
+    _loading_finished.wait(timeout)
+    return RAG_COMPONENTS_LOADED
+
+
+def loading_status():
+    """ "ready", "loading" oder "failed". """
+    if RAG_COMPONENTS_LOADED:
+        return "ready"
+    return "failed" if _loading_finished.is_set() else "loading"
+
+
+def not_ready_message():
+    """ Fehlermeldung für Anfragen, solange die Komponenten nicht bereit sind. """
+    if loading_status() == "loading":
+        return "Das System wird noch geladen. Bitte in einigen Sekunden erneut versuchen."
+    return "System-Initialisierungsfehler. Bitte Logs prüfen."
+
+
+def create_app(preload=None):
+    """ Application Factory für WSGI-Server, z.B. gunicorn -c gunicorn.conf.py ('app:create_app()').
+
+    preload=True (Standard bei RAG_LOAD_MODE=preload): Modelle sofort im aufrufenden Prozess
+    laden, damit sich alle danach geforkten Worker eine Kopie teilen; jeder Worker ruft nach
+    dem fork init_worker() auf. preload=False: Komponenten wie beim Import im Hintergrund laden.
+    """
+    if preload is None:
+        preload = load_mode == "preload"
+    if not preload:
+        start_loading()
+    elif _loading_thread is None and rag_embedding_model is None:
+        preload_models()
+    return app
+
+
+def init_worker(encoder_threads=None):
+    """ Im Worker direkt nach dem fork (gunicorn post_fork): eigene Verbindungen öffnen.
+
+    Die Modelle sind vom Master geerbt, das Laden im Hintergrund dauert daher nur kurz.
+    encoder_threads begrenzt die CPU-Threads des Embedding-Modells pro Worker, damit sich
+    mehrere Worker nicht gegenseitig die Kerne wegnehmen.
+    """
+    if encoder_threads:
+        if encoder_backend == "onnx":
+            if rag_embedding_model is not None:
+                rag_embedding_model.threads = encoder_threads # Die ONNX-Session entsteht erst im Worker
+        else:
+            import torch
+            torch.set_num_threads(encoder_threads)
+    start_loading()
+# --------------------------------------------------
 
 # --- Hilfsfunktion get_pdf_display_link (angepasst für Flask) ---
-# Caching hier nicht so einfach wie mit @st.cache_data, erstmal ohne
+# Liefert nur noch eine URL auf die /pdf-Route statt die ganze PDF als Base64
+# in die Seite einzubetten. Die Seitengröße hängt so nicht mehr von der PDF-Größe ab.
 def get_pdf_display_link(pdf_filename):
     pdf_path = os.path.join(pdfs_input_directory, pdf_filename)
-    if not os.path.exists(pdf_path):
-        return None
-    try:
-        with open(pdf_path, "rb") as f:
-            base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-        return f"data:application/pdf;base64,{base64_pdf}"
-    except Exception as e:
-        print(f"Warning: Could not load/encode PDF '{pdf_filename}': {e}") # Log zum Terminal
+    if not os.path.isfile(pdf_path):
         return None
+    if has_request_context():
+        return url_for('serve_pdf', filename=pdf_filename)
+    return f"/pdf/{quote(pdf_filename)}" # z.B. Streaming-Endpoint (asgi_app.py) ohne Flask-Request
+
 # -------------------------------------------------------------
 
 # --- Haupt-RAG-Logik (angepasst für Flask) ---
-def run_rag_query(query):
-    # Greife auf die global geladenen Komponenten zu
-    if not RAG_COMPONENTS_LOADED:
-         return {"answer": "Fehler: RAG-Komponenten nicht geladen.", "sources": []}
-
-    collection = rag_collection
-    embedding_model = rag_embedding_model
-    gemini_model = rag_gemini_model # <-- Geändert
-
-    results_data = {"answer": "Fehler bei der Verarbeitung.", "sources": []}
-    if not query:
-        results_data["answer"] = "Bitte gib eine Frage ein."
-        return results_data
-
-    try:
-        # 1. Retrieval
-        start_retrieval = time.time()
-        query_embedding = embedding_model.encode(query).tolist()
-        chroma_results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=retrieval_k,
-            include=['metadatas', 'distances']
-        )
-        print(f"Retrieval took {time.time() - start_retrieval:.2f} seconds.")
-
-        if not chroma_results or not chroma_results.get('ids') or not chroma_results['ids'][0]:
-            results_data["answer"] = "Keine relevanten Textabschnitte gefunden."
-            return results_data
-
-        # 2. Kontext aufbereiten & Quelldaten sammeln
+# Sicherheitseinstellungen (Optional, aber empfohlen)
+# Verhindert potenziell unsichere Antworten, kann aber manchmal harmlose Antworten blockieren
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+def embed_query(query):
+    # Wiederholte Fragen kommen aus dem Cache statt erneut durch das Modell; neue Fragen werden
+    # mit gleichzeitig eintreffenden zu einem Batch gebündelt (rag_query_batcher)
+    return rag_query_cache.encode(rag_query_batcher or rag_embedding_model.encode, [query])[0]
+
+
+def embed_queries(queries, batch_size=64):
+    """ Encodiert viele Fragen in einem vektorisierten Durchlauf (über den Query-Cache). """
+    return rag_query_cache.encode(
+        lambda texts: rag_embedding_model.encode(texts, batch_size=batch_size), queries)
+
+
+def retrieve_context(query, query_embedding=None, where=None):
+    """ Schritt 1+2: Retrieval und Kontextaufbereitung.
+
+    Gibt (sources, context_string) zurück; sources ist leer, wenn nichts gefunden wurde.
+    Wird sowohl vom synchronen Flask-Pfad als auch vom Streaming-Endpoint (asgi_app.py) genutzt.
+    where: optionaler Metadaten-Filter (ChromaDB-Syntax, siehe metadata_filter.py).
+    """
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    return retrieve_contexts([query], [query_embedding], where)[0]
+
+
+def _fuse_hybrid(queries, chroma_results, lexical_index, limit, where=None):
+    """ Ersetzt die Chroma-Treffer pro Query durch die RRF-Fusion aus Vektor- und BM25-Ranking.
+
+    Chunks, die nur lexikalisch gefunden wurden, haben keine Distanz (None); ihre
+    Metadaten kommen aus dem Chunk Store.
+    """
+    start_lexical = time.time()
+    fused_ids = []
+    for query, dense_ids in zip(queries, chroma_results['ids']):
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(query, hybrid_candidates, where)]
+        fused_ids.append([chunk_id for chunk_id, _ in
+                          reciprocal_rank_fusion([dense_ids, lexical_ids], limit=limit)])
+    print(f"Lexical retrieval + fusion took {(time.time() - start_lexical) * 1000:.1f} ms.")
+
+    dense_hits = {}
+    for ids, metadatas, distances in zip(chroma_results['ids'], chroma_results['metadatas'],
+                                         chroma_results['distances']):
+        dense_hits.update((chunk_id, (metadata, distance)) for chunk_id, metadata, distance
+                          in zip(ids, metadatas, distances))
+    lexical_only = get_default_store().get_many(
+        [chunk_id for ids in fused_ids for chunk_id in ids if chunk_id not in dense_hits])
+    for chunk_id, (_, metadata) in lexical_only.items():
+        dense_hits[chunk_id] = (metadata, None)
+
+    fused = {'ids': [], 'metadatas': [], 'distances': []}
+    for ids in fused_ids:
+        ids = [chunk_id for chunk_id in ids if chunk_id in dense_hits]
+        fused['ids'].append(ids)
+        fused['metadatas'].append([dense_hits[chunk_id][0] for chunk_id in ids])
+        fused['distances'].append([dense_hits[chunk_id][1] for chunk_id in ids])
+    return fused
+
+
+def _final_k():
+    """ Anzahl Chunks pro Frage nach Retrieval/Reranking (mit Packing entscheidet danach das Token-Budget). """
+    return context_candidates if context_packing else retrieval_k
+
+
+def _rerank(queries, chroma_results, chunk_texts):
+    """ Sortiert die Kandidaten jeder Frage mit dem Cross-Encoder und kürzt auf _final_k().
+
+    Passt nicht alles ins Zeitbudget, werden nur die vordersten Kandidaten neu sortiert; wird das
+    Reranking ganz übersprungen, bleibt die bisherige Reihenfolge.
+    """
+    start_rerank = time.time()
+    reranked = {'ids': [], 'metadatas': [], 'distances': []}
+    for query, ids, metadatas, distances in zip(queries, chroma_results['ids'], chroma_results['metadatas'],
+                                                chroma_results['distances']):
+        order = rag_reranker.rerank(query, [(chunk_id, chunk_texts[chunk_id]) for chunk_id in ids],
+                                    _final_k(), budget_seconds=rerank_latency_budget)
+        indices = [i for i, _ in order] if order is not None else list(range(min(_final_k(), len(ids))))
+        reranked['ids'].append([ids[i] for i in indices])
+        reranked['metadatas'].append([metadatas[i] for i in indices])
+        reranked['distances'].append([distances[i] for i in indices])
+    print(f"Reranking took {(time.time() - start_rerank) * 1000:.1f} ms.")
+    return reranked
+
+
+def retrieve_contexts(queries, query_embeddings, where=None):
+    """ Retrieval für viele Fragen mit einer einzigen Chroma-Abfrage (plus BM25, falls aktiv).
+
+    Chunk-Texte, die in mehreren Ergebnissen vorkommen, werden nur einmal geladen.
+    Mit where wird vor der Suche auf die passenden Chunks eingeschränkt (gilt für alle Fragen).
+    Gibt pro Query (sources, context_string) zurück; mit context_packing enthält sources nur
+    die Chunks, die (ganz oder auszugsweise) im Kontext gelandet sind.
+    """
+    # 1. Retrieval (mit Reranker: mehr Kandidaten holen, danach auf _final_k() kürzen)
+    start_retrieval = time.time()
+    lexical_index = get_default_index() if hybrid_retrieval else None
+    candidate_k = rerank_candidates if rag_reranker else _final_k()
+    chroma_results = rag_collection.query(
+        query_embeddings=[embedding.tolist() for embedding in query_embeddings],
+        n_results=max(candidate_k, hybrid_candidates) if lexical_index else candidate_k,
+        include=['metadatas', 'distances'],
+        where=where
+    )
+    if chroma_results and chroma_results.get('ids') and lexical_index:
+        chroma_results = _fuse_hybrid(queries, chroma_results, lexical_index, candidate_k, where)
+    print(f"Retrieval took {time.time() - start_retrieval:.2f} seconds.")
+
+    if not chroma_results or not chroma_results.get('ids'):
+        return [([], "")] * len(query_embeddings)
+
+    chunk_texts = get_chunk_texts([
+        (chunk_id, metadata)
+        for ids, metadatas in zip(chroma_results['ids'], chroma_results['metadatas'])
+        for chunk_id, metadata in zip(ids, metadatas)
+    ])
+    if rag_reranker:
+        chroma_results = _rerank(queries, chroma_results, chunk_texts)
+
+    # 2. Kontext aufbereiten & Quelldaten sammeln
+    contexts = []
+    for query, ids, metadatas, distances in zip(queries, chroma_results['ids'], chroma_results['metadatas'],
+                                                chroma_results['distances']):
         context_parts = []
+        candidates = [] # Eingabe für pack_context
         source_details = []
-        for i in range(len(chroma_results['ids'][0])):
-            metadata = chroma_results['metadatas'][0][i]
-            distance = chroma_results['distances'][0][i]
-            chunk_text = get_chunk_text(metadata)
+        for i, (chunk_id, metadata, distance) in enumerate(zip(ids, metadatas, distances)):
+            chunk_text = chunk_texts[chunk_id]
             source_file = metadata.get('source_file', 'Unbekannte Quelle')
             pdf_link = get_pdf_display_link(source_file) # Erzeuge PDF Link
 
             source_info = {
                 "rank": i + 1,
-                "distance": distance,
+                "distance": distance, # None: nur über BM25 gefunden
                 "source_file": source_file,
                 "paragraph_index": metadata.get('paragraph_index', 'N/A'),
                 "chunk_type": metadata.get('chunk_type', 'N/A'),
+                "section": metadata.get('section', ''), # Abschnittsüberschrift (chunker.py), leer bei alten Chunks
                 "text": chunk_text,
                 "pdf_link": pdf_link # Füge Link hinzu
             }
             source_details.append(source_info)
 
             # Kontext für LLM
+            location = (f"Section {source_info['section']}" if source_info['section']
+                        else f"Paragraph {source_info['paragraph_index']}")
+            candidates.append({"id": chunk_id, "source_file": source_file, "location": location, "text": chunk_text})
             if not chunk_text.startswith("Error:"):
-                context_parts.append(f"Source: {source_file}, Paragraph {source_info['paragraph_index']}:\n{chunk_text}\n")
+                context_parts.append(f"Source: {source_file}, {location}:\n{chunk_text}\n")
             else:
-                 context_parts.append(f"Source: {source_file}, Paragraph {source_info['paragraph_index']}:\n[Fehler beim Laden des Textes]\n")
+                 context_parts.append(f"Source: {source_file}, {location}:\n[Fehler beim Laden des Textes]\n")
 
-        context_string = "\n---\n".join(context_parts)
-        results_data["sources"] = source_details
+        if context_packing:
+            context_string, used, tokens = pack_context(query, candidates, context_token_budget)
+            print(f"Context: {tokens} tokens from {len(used)} of {len(candidates)} chunks "
+                  f"(budget {context_token_budget}).")
+            source_details = [dict(source_details[i], rank=rank) for rank, i in enumerate(used, start=1)]
+            contexts.append((source_details, context_string))
+        else:
+            contexts.append((source_details, "\n---\n".join(context_parts)))
 
-        # 3. Prompt erstellen (wie zuvor)
-        prompt = f"""Kontext: ...""" # Dein Prompt hier
+    return contexts
 
-        # 4. Generation mit LLM (wie zuvor)
-        # --- 4. Generation mit Gemini (ANGEPASST) ---
-        start_generation = time.time()
-        generated_answer = f"Fehler bei der Antwortgenerierung mit {GEMINI_MODEL_NAME}." # Default Fehler
-        try:
-            # Sicherheitseinstellungen (Optional, aber empfohlen)
-            # Verhindert potenziell unsichere Antworten, kann aber manchmal harmlose Antworten blockieren
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-
-            response = gemini_model.generate_content(
-                prompt,
-                safety_settings=safety_settings
-                # Optional: generation_config = genai.types.GenerationConfig(...)
-            )
-
-            # Antwort extrahieren (mit Fehlerprüfung für blockierte Inhalte)
-            try:
-                 generated_answer = response.text.strip()
-            except ValueError:
-                 # Wahrscheinlich wurde die Antwort wegen Sicherheitseinstellungen blockiert
-                 print(f"Warning: Gemini response blocked. Feedback: {response.prompt_feedback}")
-                 generated_answer = "Die Antwort wurde aufgrund von Sicherheitseinstellungen blockiert."
-                 # Alternativ: Details aus response.candidates prüfen, falls vorhanden
-                 # if response.candidates: generated_answer = f"Blocked: {response.candidates[0].finish_reason} / {response.candidates[0].safety_ratings}"
-
-        except Exception as gen_e:
-             print(f"Error calling Gemini API: {gen_e}")
-             traceback.print_exc()
-             # Behalte den Default-Fehler oder spezifiziere
-             generated_answer = f"Fehler bei der Kommunikation mit der Gemini API: {gen_e}"
-        # ------------------------------------------
-
-        generation_time = time.time() - start_generation
-        print(f"Generation took {generation_time:.2f} seconds.")
-        results_data["answer"] = generated_answer
+
+def build_prompt(query, context_string):
+    """ Schritt 3: Prompt erstellen (gleiche Vorlage wie in rag_generate.py). """
+    return f"""Kontext:
+---
+{context_string}
+---
+Frage: {query}
+
+Anweisung: Beantworte die Frage kurz und nur mit Informationen aus dem obigen Kontext. Wenn die Antwort nicht im Kontext steht, sage "Die Antwort ist nicht im Kontext enthalten.".
+
+Antwort:"""
+
+
+def generate_answer(prompt):
+    """ Schritt 4: Generation über rag_llm (blockierend; Retries und Failover in llm_backends.py).
+
+    Gibt (Antwort, ok) zurück; ok ist False bei blockierten Antworten und API-Fehlern
+    (solche Antworten werden nicht gecacht).
+    """
+    ok = False
+    start_generation = time.time()
+    try:
+        generated_answer = rag_llm.generate(prompt)
+        ok = True
+    except ContentBlocked:
+        generated_answer = "Die Antwort wurde aufgrund von Sicherheitseinstellungen blockiert."
+    except LLMError as gen_e:
+        print(f"Error calling LLM backend '{rag_llm.name}': {gen_e}")
+        generated_answer = f"Fehler bei der Kommunikation mit dem Sprachmodell ({rag_llm.name}): {gen_e}"
+
+    generation_time = time.time() - start_generation
+    print(f"Generation took {generation_time:.2f} seconds.")
+    return generated_answer, ok
+
+
+def run_rag_query(query, where=None):
+    # Greife auf die global geladenen Komponenten zu
+    if not RAG_COMPONENTS_LOADED:
+         return {"answer": "Fehler: RAG-Komponenten nicht geladen.", "sources": []}
+
+    results_data = {"answer": "Fehler bei der Verarbeitung.", "sources": []}
+    if not query:
+        results_data["answer"] = "Bitte gib eine Frage ein."
+        return results_data
+
+    try:
+        # 0. Antwort-Cache: gleiche oder sehr ähnliche Frage schon beantwortet?
+        scope = scope_key(where)
+        cached, similarity, query_embedding = rag_answer_cache.get(query, embed_query, scope)
+        if cached is not None:
+            print(f"Answer cache hit (similarity {similarity:.3f}).")
+            return cached
+
+        source_details, context_string = retrieve_context(query, query_embedding, where)
+        if not source_details:
+            results_data["answer"] = "Keine relevanten Textabschnitte gefunden."
+            return results_data
+        results_data["sources"] = source_details
+        results_data["answer"], ok = generate_answer(build_prompt(query, context_string))
+        if ok:
+            rag_answer_cache.put(query, query_embedding, results_data, scope)
 
     except Exception as e:
         results_data["answer"] = f"Ein Fehler ist aufgetreten: {e}"
@@ -247,34 +541,103 @@ def run_rag_query(query):
 @app.route('/', methods=['GET', 'POST'])
 def index():
     query = ""
+    source_files = ""
+    chunk_type = ""
     results = {"answer": "", "sources": []} # Standardmäßig leer
 
     if request.method == 'POST':
         # Formular wurde gesendet
         query = request.form.get('query', '') # Hole Query aus Formularfeld
+        source_files = request.form.get('source_files', '') # Optional: komma-getrennte PDF-Namen
+        chunk_type = request.form.get('chunk_type', '') # Optional: "abstract" oder "paragraph"
         if query and RAG_COMPONENTS_LOADED:
             print(f"Received query: {query}")
-            results = run_rag_query(query) # Führe RAG-Logik aus
+            results = run_rag_query(query, build_where(source_files, chunk_type)) # Führe RAG-Logik aus
         elif not RAG_COMPONENTS_LOADED:
-             results = {"answer": "System-Initialisierungsfehler. Bitte Logs prüfen.", "sources": []}
+             results = {"answer": not_ready_message(), "sources": []}
 
 
     # Rendere die HTML-Seite und übergebe Variablen
     # 'last_query' wird verwendet, um die Frage im Feld anzuzeigen
     return render_template('index.html',
                            last_query=query,
+                           last_source_files=source_files,
+                           last_chunk_type=chunk_type,
+                           known_source_files=get_default_store().source_files(), # gecacht bis zum nächsten Schreibvorgang
                            answer=results["answer"],
                            sources=results["sources"])
 
-# Optional: Route zum direkten Servieren von PDFs (Alternative zu Base64)
-# @app.route('/pdf/<path:filename>')
-# def serve_pdf(filename):
-#     try:
-#         return send_from_directory(pdfs_input_directory, filename, as_attachment=False)
-#     except FileNotFoundError:
-#         abort(404)
+# --- JSON-API ---
+# POST /api/query {"query": "...", "source_files": ["paper.pdf"], "chunk_types": ["abstract"]}
+# oder mit einer ChromaDB-where-Klausel: {"query": "...", "where": {"chunk_type": "abstract"}}
+@app.route('/api/query', methods=['POST'])
+def api_query():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Invalid JSON body."}), 400
+    query = str(payload.get("query", "")).strip()
+    if not query:
+        return jsonify({"error": "Bitte gib eine Frage ein."}), 400
+    try:
+        where = where_from_payload(payload)
+    except ValueError as e:
+        return jsonify({"error": f"Ungültiger Filter: {e}"}), 400
+    if not RAG_COMPONENTS_LOADED:
+        return jsonify({"error": not_ready_message()}), 503, {"Retry-After": str(retry_after_seconds)}
+    print(f"Received API query: {query} (filter: {where})")
+    return jsonify(run_rag_query(query, where))
+
+# --- Liveness/Readiness (z.B. für Kubernetes-Probes oder den Load Balancer) ---
+# /healthz: Prozess lebt und beantwortet HTTP (auch während des Ladens).
+# /readyz: 200 erst, wenn alle Komponenten geladen sind; sonst 503 mit Status und Ladezeiten.
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    status = loading_status()
+    body = {"status": status, "load_timings": load_timings}
+    if status == "failed":
+        body["error"] = RAG_LOAD_ERROR
+    if status != "ready":
+        return jsonify(body), 503, {"Retry-After": str(retry_after_seconds)}
+    return jsonify(body)
+
+# --- Laufzeit-Statistiken (Cache-Zähler) ---
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "load_timings": load_timings,
+        "chunk_cache": loaded_chunks_cache.stats(),
+        "query_embedding_cache": rag_query_cache.stats() if rag_query_cache else None,
+        "query_batcher": rag_query_batcher.stats() if rag_query_batcher else None,
+        "llm": rag_llm.stats() if rag_llm else None,
+        "answer_cache": rag_answer_cache.stats(),
+        "reranker": rag_reranker.stats() if rag_reranker else None,
+    })
+
+# --- Route zum direkten Servieren von PDFs (ersetzt Base64-Links) ---
+# send_from_directory streamt die Datei blockweise und unterstützt mit
+# conditional=True HTTP Range Requests (206), ETag/Last-Modified sowie
+# If-None-Match/If-Modified-Since (304). safe_join verhindert Path Traversal.
+@app.route('/pdf/<path:filename>')
+def serve_pdf(filename):
+    if not filename.lower().endswith(".pdf"):
+        abort(404)
+    return send_from_directory(pdfs_input_directory, filename,
+                               mimetype='application/pdf',
+                               as_attachment=False,
+                               conditional=True,
+                               etag=True,
+                               max_age=pdf_cache_max_age)
 # --------------------
 
+# Komponenten im Hintergrund laden; die Routen sind ab jetzt erreichbar.
+# Mit RAG_LOAD_MODE=preload (gunicorn.conf.py) lädt stattdessen create_app() vor dem fork.
+if load_mode == "background":
+    start_loading()
+
 # --- App Start ---
 if __name__ == '__main__':
     # debug=True startet den Development Server neu bei Änderungen
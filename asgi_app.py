@@ -0,0 +1,118 @@
+# --- ASGI-Einstiegspunkt mit Streaming-Antworten ---
+# Start: uvicorn asgi_app:app --port 5001
+#
+# Die Flask-App (app.py) läuft unverändert unter "/" weiter (über WSGIMiddleware).
+# Zusätzlich gibt es /api/stream: Die Quellen werden direkt nach dem Retrieval
+# gesendet, danach die generierten Tokens, sobald das LLM (Gemini, Ollama, ...) sie liefert
+# (Server-Sent Events). Da die Generation asynchron läuft, blockiert eine
+# laufende LLM-Anfrage keinen Worker – ein Prozess kann sehr viele
+# gleichzeitige Antworten offen halten.
+import json
+import time
+import traceback
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as rag_app
+from llm_backends import ContentBlocked, LLMError
+from metadata_filter import build_where, scope_key, where_from_payload
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _answer_events(query, where=None):
+    start_time = time.time()
+    scope = scope_key(where)
+    try:
+        # Embedding + Retrieval sind CPU-/IO-gebunden und synchron -> im Threadpool, damit der Event Loop frei bleibt
+        cached, similarity, query_embedding = await run_in_threadpool(
+            rag_app.rag_answer_cache.get, query, rag_app.embed_query, scope)
+        if cached is not None:
+            print(f"Answer cache hit (similarity {similarity:.3f}).")
+            yield _sse("sources", cached["sources"])
+            yield _sse("token", {"text": cached["answer"]})
+            yield _sse("done", {"answer": cached["answer"]})
+            return
+        sources, context_string = await run_in_threadpool(rag_app.retrieve_context, query, query_embedding, where)
+    except Exception as e:
+        print(f"Error during retrieval: {e}")
+        traceback.print_exc()
+        yield _sse("error", {"message": f"Ein Fehler ist aufgetreten: {e}"})
+        return
+
+    yield _sse("sources", sources)
+    if not sources:
+        yield _sse("done", {"answer": "Keine relevanten Textabschnitte gefunden."})
+        return
+    print(f"Time to sources: {time.time() - start_time:.2f} seconds.")
+
+    answer_parts = []
+    ok = True
+    llm = rag_app.rag_llm
+    try:
+        # Retries und Failover auf das nächste Backend nur, solange noch kein Token gesendet wurde
+        async for text in llm.stream(rag_app.build_prompt(query, context_string)):
+            answer_parts.append(text)
+            yield _sse("token", {"text": text})
+    except ContentBlocked:
+        yield _sse("error", {"message": "Die Antwort wurde aufgrund von Sicherheitseinstellungen blockiert."})
+        ok = False
+    except LLMError as e:
+        print(f"Error calling LLM backend '{llm.name}' (stream): {e}")
+        yield _sse("error", {"message": f"Fehler bei der Kommunikation mit dem Sprachmodell ({llm.name}): {e}"})
+        ok = False
+
+    answer = "".join(answer_parts).strip()
+    print(f"Streaming answer took {time.time() - start_time:.2f} seconds.")
+    if ok and answer:
+        rag_app.rag_answer_cache.put(query, query_embedding, {"answer": answer, "sources": sources}, scope)
+    yield _sse("done", {"answer": answer})
+
+
+async def stream_answer(request):
+    if request.method == "POST":
+        try:
+            payload = await request.json()
+        except ValueError:
+            return JSONResponse({"error": "Invalid JSON body."}, status_code=400)
+        query = str(payload.get("query", ""))
+        try:
+            where = where_from_payload(payload)
+        except ValueError as e:
+            return JSONResponse({"error": f"Ungültiger Filter: {e}"}, status_code=400)
+    else:
+        query = request.query_params.get("q", "")
+        # GET: ?source_file=a.pdf&source_file=b.pdf&chunk_type=abstract
+        where = build_where(request.query_params.getlist("source_file"),
+                            request.query_params.getlist("chunk_type"))
+    query = query.strip()
+
+    if not query:
+        return JSONResponse({"error": "Bitte gib eine Frage ein."}, status_code=400)
+    if not rag_app.RAG_COMPONENTS_LOADED:
+        return JSONResponse({"error": rag_app.not_ready_message()}, status_code=503,
+                            headers={"Retry-After": str(rag_app.retry_after_seconds)})
+
+    print(f"Received streaming query: {query}")
+    return StreamingResponse(_answer_events(query, where), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+app = Starlette(routes=[
+    Route("/api/stream", stream_answer, methods=["GET", "POST"]),
+    Mount("/", app=WSGIMiddleware(rag_app.app)), # Alle übrigen Routen (Formular, /pdf, /stats) über Flask
+])
+
+
+def create_app(preload=None):
+    """ Factory für gunicorn mit Uvicorn-Workern (siehe gunicorn.conf.py).
+
+    Lädt die Modelle wie app.create_app() vor dem fork und gibt die ASGI-App zurück.
+    """
+    rag_app.create_app(preload)
+    return app
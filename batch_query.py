@@ -0,0 +1,153 @@
+# --- Batch-Abfragen für Evaluation / Massen-Fragen ---
+# Beispiel:
+#   python batch_query.py questions.jsonl --output answers.jsonl --concurrency 8
+#
+# Eingabe: JSONL mit {"id": ..., "question": ...} pro Zeile (id optional) oder
+# eine Textdatei mit einer Frage pro Zeile. Ausgabe: JSONL, eine Zeile pro Frage.
+# Alle Fragen eines Blocks werden in einem Durchlauf encodiert und mit einer
+# einzigen Chroma-Abfrage (plus BM25, siehe app.hybrid_retrieval) gesucht; Chunk-Texte werden pro Block nur einmal
+# geladen. Die LLM-Aufrufe laufen parallel, begrenzt durch --concurrency.
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import app as rag_app
+
+# --- Konfiguration ---
+query_batch_size = 256 # Fragen pro Encoding-Durchlauf / Chroma-Abfrage
+llm_concurrency = 4 # Gleichzeitige LLM-Aufrufe (API-Limits beachten)
+# --------------------
+
+
+def read_questions(path):
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f_in:
+        for line_number, line in enumerate(f_in, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.lower().endswith((".jsonl", ".json")):
+                record = json.loads(line)
+                questions.append({"id": record.get("id", line_number), "question": record["question"]})
+            else:
+                questions.append({"id": line_number, "question": line})
+    return questions
+
+
+def completed_ids(output_path, generate=True):
+    """ IDs, die in einer früheren (abgebrochenen) Ausgabe bereits erfolgreich beantwortet wurden.
+
+    Mit generate zählen nur Datensätze mit LLM-Antwort; reine Retrieval-Ergebnisse
+    (--retrieval-only, "generated": False) werden dann erneut bearbeitet.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f_in:
+        for line in f_in:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # Letzte Zeile eines abgebrochenen Laufs
+            # Ältere Ausgaben ohne "generated": generiert, wenn eine Antwort vorhanden ist
+            generated = record.get("generated", record.get("answer") is not None)
+            if record.get("ok") and (generated or not generate):
+                done.add(record["id"])
+    return done
+
+
+def _source_summary(source, include_text):
+    summary = {key: source[key] for key in ("rank", "distance", "source_file", "paragraph_index", "chunk_type")}
+    if include_text:
+        summary["text"] = source["text"]
+    return summary
+
+
+def _answer(item, sources, context_string, generate):
+    record = {"id": item["id"], "question": item["question"], "answer": None, "ok": True, "generated": generate,
+              "sources": sources}
+    if not sources:
+        record["answer"] = "Keine relevanten Textabschnitte gefunden."
+    elif generate:
+        start_time = time.time()
+        record["answer"], record["ok"] = rag_app.generate_answer(rag_app.build_prompt(item["question"], context_string))
+        record["generation_seconds"] = round(time.time() - start_time, 3)
+    return record
+
+
+def run_batch(questions, output_path, batch_size=query_batch_size, concurrency=llm_concurrency,
+              generate=True, include_text=False, append=False):
+    stats = {"questions": 0, "failed": 0}
+    start_time = time.time()
+    with open(output_path, 'a' if append else 'w', encoding='utf-8') as f_out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def write(futures):
+            for future in futures:
+                record = future.result()
+                stats["questions"] += 1
+                stats["failed"] += not record["ok"]
+                f_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f_out.flush() # Fertige Antworten sofort sichern (--resume nach Abbruch)
+
+        pending = set()
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            # 1. Alle Fragen des Blocks vektorisiert encodieren
+            embeddings = rag_app.embed_queries([item["question"] for item in batch])
+            # 2. Eine Chroma-Abfrage für den ganzen Block
+            contexts = rag_app.retrieve_contexts([item["question"] for item in batch], embeddings)
+            # 3. LLM-Aufrufe parallel (höchstens `concurrency` gleichzeitig)
+            for item, (sources, context_string) in zip(batch, contexts):
+                summaries = [_source_summary(source, include_text) for source in sources]
+                pending.add(executor.submit(_answer, item, summaries, context_string, generate))
+            done = {future for future in pending if future.done()}
+            pending -= done
+            write(done)
+            print(f"  Retrieved {min(start + batch_size, len(questions))}/{len(questions)} questions, "
+                  f"{stats['questions']} answered...")
+
+        for future in as_completed(pending):
+            write([future])
+            if stats["questions"] % 100 == 0:
+                print(f"  Answered {stats['questions']}/{len(questions)} questions...")
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Beantwortet viele Fragen auf einmal und schreibt die Ergebnisse als JSONL.")
+    parser.add_argument("input", help="JSONL mit {\"id\", \"question\"} oder Textdatei mit einer Frage pro Zeile")
+    parser.add_argument("--output", default="batch_answers.jsonl", help="Ausgabedatei (JSONL)")
+    parser.add_argument("--batch-size", type=int, default=query_batch_size,
+                        help="Fragen pro Encoding-Durchlauf / Chroma-Abfrage")
+    parser.add_argument("--concurrency", type=int, default=llm_concurrency, help="Gleichzeitige LLM-Aufrufe")
+    parser.add_argument("--retrieval-only", action="store_true", help="Nur Retrieval, keine LLM-Antworten")
+    parser.add_argument("--include-text", action="store_true", help="Chunk-Texte mit in die Ausgabe schreiben")
+    parser.add_argument("--resume", action="store_true",
+                        help="Bereits erfolgreich beantwortete IDs in --output überspringen und anhängen "
+                             "(ohne --retrieval-only werden reine Retrieval-Ergebnisse neu beantwortet)")
+    args = parser.parse_args()
+
+    if not rag_app.wait_until_loaded():
+        print("Error: RAG components could not be loaded (see output above).")
+        exit(1)
+
+    questions = read_questions(args.input)
+    if args.resume:
+        done = completed_ids(args.output, generate=not args.retrieval_only)
+        questions = [item for item in questions if item["id"] not in done]
+        print(f"Resuming: {len(done)} questions already answered.")
+    print(f"Running {len(questions)} questions (batch size {args.batch_size}, concurrency {args.concurrency})...")
+
+    stats = run_batch(questions, args.output, batch_size=args.batch_size, concurrency=args.concurrency,
+                      generate=not args.retrieval_only, include_text=args.include_text, append=args.resume)
+    rate = stats["questions"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    print(f"\nAnswered {stats['questions']} questions in {stats['seconds']:.1f}s ({rate:.1f} questions/s), "
+          f"{stats['failed']} failed. Results in '{args.output}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """ Grobe Schätzung des Speicherbedarfs (Bytes) eines gecachten Werts. """
+    if value is None:
+        return sys.getsizeof(None)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, "nbytes"): # NumPy-Arrays
+        return int(value.nbytes) + 112
+    return sys.getsizeof(value)
+
+
+class ByteLRUCache:
+    """ Thread-sicherer LRU-Cache, der nach Bytes (nicht nach Einträgen) begrenzt ist.
+
+    Einträge können an die mtime einer Datei gebunden werden: ändert sich die
+    Datei (oder verschwindet sie / taucht sie auf), gilt der Eintrag als veraltet.
+    """
+
+    def __init__(self, max_bytes, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict() # key -> (value, size, mtime)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, mtime=None, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[2] != mtime:
+                # Datei wurde seit dem Laden geändert -> Eintrag verwerfen
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, mtime=None):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return # Einzelner Eintrag größer als der ganze Cache -> nicht cachen
+            self._entries[key] = (value, size, mtime)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def get_or_load(self, key, path, loader):
+        """ Gibt den gecachten Wert für `path` zurück oder lädt ihn mit loader(path).
+
+        Fehlende Dateien werden als None mit mtime None gecacht und damit
+        automatisch neu geladen, sobald die Datei existiert.
+        """
+        mtime = _file_mtime(path)
+        sentinel = object()
+        value = self.get(key, mtime=mtime, default=sentinel)
+        if value is not sentinel:
+            return value
+        value = loader(path) if mtime is not None else None
+        self.put(key, value, mtime=mtime)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,243 @@
+import os
+import json
+import sqlite3
+import threading
+from byte_lru_cache import ByteLRUCache
+
+# --- Konfiguration ---
+chunks_input_directory = "chunks_output" # Ordner mit den Chunk-JSON-Dateien
+chunk_store_path = os.path.join(chunks_input_directory, "chunk_store.sqlite") # Lookup-Store für Chunk-Texte
+chunk_cache_max_bytes = 64 * 1024 * 1024 # Obergrenze für im Prozess gecachte Chunk-Dateien (Fallback-Pfad)
+# --------------------
+
+# Der Chunk Store ist eine SQLite-Tabelle mit der Chroma-Chunk-ID als Primärschlüssel.
+# Ein Lookup ist damit ein einzelner B-Tree-Zugriff, statt die komplette
+# *_chunks.json zu laden und linear nach passenden Metadaten zu durchsuchen.
+# parse_xml.py schreibt den Store beim Parsen, app.py / rag_generate.py /
+# query_data.py lesen nur.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_chunks_source_file ON chunks(source_file);
+"""
+
+
+def make_chunk_id(source_file, chunk_index):
+    """ Erzeugt die Chunk-ID, wie sie auch in ChromaDB verwendet wird. """
+    return f"{source_file}_chunk_{chunk_index}"
+
+
+class ChunkStore:
+    """ SQLite-basierter Key-Value-Store: Chunk-ID -> (Text, Metadaten). """
+
+    def __init__(self, path=chunk_store_path, readonly=True):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local() # Eine Verbindung pro Thread (sqlite3 ist nicht thread-safe)
+        self._source_files = None # (Datei-Signatur, Liste) - wird bei jedem Seitenaufruf gebraucht
+        self._source_files_lock = threading.Lock()
+        if not readonly:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = self._connection()
+            conn.executescript(_SCHEMA)
+            conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                if not os.path.exists(self.path):
+                    return None # Store (noch) nicht gebaut
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            else:
+                conn = sqlite3.connect(self.path)
+                conn.execute("PRAGMA journal_mode=WAL") # Leser werden beim Schreiben nicht blockiert
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, chunk_id):
+        """ Gibt (text, metadata) für eine Chunk-ID zurück oder None. """
+        conn = self._connection()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT text, metadata FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def get_many(self, chunk_ids):
+        """ Lädt mehrere Chunks in einer Abfrage. Gibt ein Dict id -> (text, metadata) zurück. """
+        conn = self._connection()
+        found = {}
+        if conn is None:
+            return found
+        unique_ids = list(dict.fromkeys(chunk_ids))
+        # SQLite erlaubt nur eine begrenzte Anzahl an Parametern pro Statement
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})", batch)
+            for chunk_id, text, metadata in rows:
+                found[chunk_id] = (text, json.loads(metadata))
+        return found
+
+    def _file_signature(self):
+        """ mtime und Größe von Datenbank und WAL-Datei; ändert sich bei jedem Schreibvorgang. """
+        signature = []
+        for path in (self.path, self.path + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def source_files(self):
+        """ Alle Paper im Store, sortiert. Gecacht, bis sich Datenbank- oder WAL-Datei ändern. """
+        signature = self._file_signature()
+        with self._source_files_lock:
+            if self._source_files is not None and self._source_files[0] == signature:
+                return list(self._source_files[1])
+        conn = self._connection()
+        if conn is None:
+            return []
+        files = [row[0] for row in conn.execute("SELECT DISTINCT source_file FROM chunks ORDER BY source_file")]
+        with self._source_files_lock:
+            self._source_files = (signature, files)
+        return list(files)
+
+    def replace_document(self, source_file, chunks):
+        """ Ersetzt alle Chunks eines Papers (in einer Transaktion). """
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE source_file = ?", (source_file,))
+            conn.executemany(
+                "INSERT INTO chunks (id, source_file, text, metadata) VALUES (?, ?, ?, ?)",
+                [(make_chunk_id(source_file, i), source_file, chunk['text'],
+                  json.dumps(chunk['metadata'], ensure_ascii=False))
+                 for i, chunk in enumerate(chunks)]
+            )
+
+    def delete_document(self, source_file):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE source_file = ?", (source_file,))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# --- Gemeinsamer Lese-Zugriff für app.py, rag_generate.py und query_data.py ---
+_default_store = None
+_default_store_lock = threading.Lock()
+
+# Fallback für Paper, die noch nicht im Store sind (z.B. vor dem ersten Rebuild geparst).
+# Nach Bytes begrenzt und an die mtime der JSON-Datei gebunden, damit der
+# Flask-Prozess bei großen Korpora nicht unbegrenzt wächst.
+loaded_chunks_cache = ByteLRUCache(chunk_cache_max_bytes)
+
+
+def get_default_store():
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = ChunkStore(chunk_store_path, readonly=True)
+    return _default_store
+
+
+def _read_chunks_file_index(chunks_json_path, source_file):
+    """ Liest eine *_chunks.json und legt ein Dict chunk_id -> text an. """
+    with open(chunks_json_path, 'r', encoding='utf-8') as f_json:
+        chunks_list = json.load(f_json)
+    return {
+        make_chunk_id(source_file, i): chunk.get('text', "Error: Text key missing.")
+        for i, chunk in enumerate(chunks_list)
+    }
+
+
+def _load_chunks_file_index(source_file):
+    json_filename = source_file.replace(".pdf", "_chunks.json")
+    chunks_json_path = os.path.join(chunks_input_directory, json_filename)
+    return json_filename, loaded_chunks_cache.get_or_load(
+        chunks_json_path, chunks_json_path, lambda path: _read_chunks_file_index(path, source_file))
+
+
+def get_chunk_text(chunk_id, metadata=None):
+    """ Lädt den Text für einen Chunk anhand seiner Chroma-ID nach. """
+    try:
+        stored = get_default_store().get(chunk_id)
+    except sqlite3.Error as e:
+        print(f"Warning: Chunk store lookup failed for '{chunk_id}': {e}")
+        stored = None
+    if stored is not None:
+        return stored[0]
+
+    # Fallback: Chunk noch nicht im Store -> einmalig die JSON-Datei indizieren
+    source_file = (metadata or {}).get('source_file')
+    if not source_file:
+        return "Error: 'source_file' missing in metadata."
+    try:
+        json_filename, chunk_texts = _load_chunks_file_index(source_file)
+    except Exception as e:
+        print(f"Warning: Error loading chunks for {source_file}: {e}")
+        return f"Error loading/processing chunks file: {e}"
+    if chunk_texts is None:
+        return f"Error: Chunks file '{json_filename}' not found."
+    return chunk_texts.get(chunk_id, "Error: Matching chunk not found.")
+
+
+def get_chunk_texts(chunks):
+    """ Batch-Variante von get_chunk_text: chunks ist eine Liste von (chunk_id, metadata).
+
+    Jede Chunk-ID wird nur einmal geladen, alle aus dem Store in wenigen Abfragen.
+    Gibt ein Dict chunk_id -> Text zurück.
+    """
+    metadata_by_id = dict(chunks)
+    try:
+        stored = get_default_store().get_many(list(metadata_by_id))
+    except sqlite3.Error as e:
+        print(f"Warning: Chunk store batch lookup failed: {e}")
+        stored = {}
+    texts = {chunk_id: text for chunk_id, (text, _) in stored.items()}
+    for chunk_id, metadata in metadata_by_id.items():
+        if chunk_id not in texts:
+            texts[chunk_id] = get_chunk_text(chunk_id, metadata) # Fallback über die JSON-Datei
+    return texts
+
+
+# --- Rebuild des Stores aus bestehenden Chunk-Dateien ---
+def rebuild_from_chunks_directory(directory=chunks_input_directory, path=chunk_store_path):
+    store = ChunkStore(path, readonly=False)
+    total_chunks = 0
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith("_chunks.json"):
+            continue
+        with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f_in:
+            chunks = json.load(f_in)
+        if not chunks:
+            continue
+        source_file = chunks[0]['metadata'].get('source_file', filename.replace("_chunks.json", ".pdf"))
+        store.replace_document(source_file, chunks)
+        total_chunks += len(chunks)
+        print(f"  Stored {len(chunks)} chunks from {filename}")
+    store.close()
+    return total_chunks
+
+
+if __name__ == '__main__':
+    print(f"Rebuilding chunk store '{chunk_store_path}' from '{chunks_input_directory}'...")
+    if not os.path.exists(chunks_input_directory):
+        print(f"Error: Chunks input directory '{chunks_input_directory}' not found.")
+        exit()
+    count = rebuild_from_chunks_directory()
+    print(f"\nChunk store rebuilt with {count} chunks.")
@@ -0,0 +1,140 @@
+import re
+from collections import namedtuple
+
+# --- Konfiguration ---
+# "sections": Sätze innerhalb eines Abschnitts (<div> mit <head>) zu Fenstern mit höchstens
+# chunk_max_tokens Tokens packen, benachbarte Fenster überlappen um bis zu chunk_overlap_tokens.
+# "paragraphs": ein Chunk pro <p> (bisheriges Verhalten, ungleich große Chunks).
+chunk_strategy = "sections"
+# all-MiniLM-L6-v2 schneidet nach 256 Wordpiece-Tokens ab; count_tokens() zählt Wörter und
+# Satzzeichen und liegt bei Fachtexten meist etwas darunter -> etwas Luft lassen.
+chunk_max_tokens = 200
+chunk_overlap_tokens = 40
+# --------------------
+
+# Eingabe für den Chunker: ein Paragraph mit seinen Sätzen (GROBID liefert <s>-Tags,
+# da process_pdfs.py segmentSentences=true setzt; sonst wird per Regex getrennt).
+# section_id: laufende Nummer des umgebenden <div> (Abschnittsgrenze, auch bei leerer oder
+# wiederholter Überschrift); None für Abstract bzw. Paragraphen außerhalb eines <div>.
+Paragraph = namedtuple("Paragraph", "index text section sentences section_id", defaults=(None,))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+
+def count_tokens(text):
+    """ Schnelle Token-Schätzung (Wörter + Satzzeichen), ohne Tokenizer des Modells zu laden. """
+    return len(_TOKEN_RE.findall(text))
+
+
+def split_sentences(text):
+    """ Fallback für Text ohne <s>-Tags: trennt nach Satzzeichen vor einem Großbuchstaben/einer Zahl. """
+    return [sentence for sentence in _SENTENCE_END_RE.split(' '.join(text.split())) if sentence]
+
+
+def config_key(strategy=chunk_strategy, max_tokens=chunk_max_tokens, overlap_tokens=chunk_overlap_tokens):
+    """ Kennung der Chunking-Einstellungen; parse_xml.py parst neu, wenn sie sich ändert. """
+    if strategy == "paragraphs":
+        return "paragraphs"
+    # "div": Gruppierung nach <div> statt nach Überschrift (ältere Chunks werden neu erzeugt)
+    return f"{strategy}:{max_tokens}:{overlap_tokens}:div"
+
+
+def _split_long(sentence, max_tokens):
+    """ Teilt einen einzelnen Satz, der allein über dem Budget liegt, an Wortgrenzen. """
+    pieces, words, tokens = [], [], 0
+    for word in sentence.split():
+        word_tokens = count_tokens(word)
+        if words and tokens + word_tokens > max_tokens:
+            pieces.append(' '.join(words))
+            words, tokens = [], 0
+        words.append(word)
+        tokens += word_tokens
+    if words:
+        pieces.append(' '.join(words))
+    return pieces
+
+
+def pack_sentences(units, max_tokens=chunk_max_tokens, overlap_tokens=chunk_overlap_tokens):
+    """ Packt (text, tokens, paragraph_index)-Einheiten gierig zu Fenstern mit höchstens max_tokens.
+
+    Ein neues Fenster beginnt mit den letzten Sätzen des vorherigen, solange diese zusammen
+    höchstens overlap_tokens lang sind. Gibt eine Liste von Einheiten-Listen zurück.
+    """
+    windows, current, current_tokens = [], [], 0
+    for unit in units:
+        if current and current_tokens + unit[1] > max_tokens:
+            windows.append(current)
+            carry, carry_tokens = [], 0
+            for previous in reversed(current):
+                if carry_tokens + previous[1] > overlap_tokens:
+                    break
+                carry.insert(0, previous)
+                carry_tokens += previous[1]
+            if carry_tokens + unit[1] > max_tokens:
+                carry, carry_tokens = [], 0
+            current, current_tokens = carry, carry_tokens
+        current.append(unit)
+        current_tokens += unit[1]
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _units(paragraphs, max_tokens):
+    for paragraph in paragraphs:
+        for sentence in paragraph.sentences or split_sentences(paragraph.text):
+            sentence = ' '.join(sentence.split())
+            if not sentence:
+                continue
+            tokens = count_tokens(sentence)
+            pieces = _split_long(sentence, max_tokens) if tokens > max_tokens else [sentence]
+            for piece in pieces:
+                yield piece, (tokens if len(pieces) == 1 else count_tokens(piece)), paragraph.index
+
+
+def _window_text(window):
+    """ Sätze eines Paragraphen mit Leerzeichen, Paragraphen mit Zeilenumbruch verbinden. """
+    parts = []
+    for i, (text, _, paragraph_index) in enumerate(window):
+        if i and paragraph_index != window[i - 1][2]:
+            parts.append("\n")
+        elif i:
+            parts.append(" ")
+        parts.append(text)
+    return ''.join(parts)
+
+
+def chunk_sections(source_file, title, abstract, paragraphs, max_tokens=chunk_max_tokens,
+                   overlap_tokens=chunk_overlap_tokens):
+    """ Chunks mit vorhersehbarer Größe: Fenster über die Sätze je Abschnitt, nie über Abschnittsgrenzen.
+
+    abstract ist ein Paragraph (oder None); paragraphs in Dokumentreihenfolge. Metadaten wie bei
+    den Paragraph-Chunks plus section (Überschrift) und token_count; paragraph_index ist der
+    erste Paragraph im Fenster.
+    """
+    file_chunks = []
+    groups = []
+    if abstract is not None:
+        groups.append(("abstract", "Abstract", [abstract], None))
+    for paragraph in paragraphs:
+        # Gruppiert wird nach dem <div>, nicht nach dem Überschriftstext: benachbarte Abschnitte
+        # ohne bzw. mit gleicher Überschrift bleiben getrennt
+        if groups and groups[-1][0] == "paragraph" and groups[-1][3] == paragraph.section_id:
+            groups[-1][2].append(paragraph)
+        else:
+            groups.append(("paragraph", paragraph.section, [paragraph], paragraph.section_id))
+
+    for chunk_type, section, section_paragraphs, _ in groups:
+        for window in pack_sentences(list(_units(section_paragraphs, max_tokens)), max_tokens, overlap_tokens):
+            chunk_metadata = {
+                "source_file": source_file,
+                "title": title,
+                "chunk_type": chunk_type,
+                "section": section,
+                "token_count": sum(unit[1] for unit in window),
+            }
+            if chunk_type == "paragraph":
+                chunk_metadata["paragraph_index"] = window[0][2] # 0-basierter Index des ersten Paragraphen
+            file_chunks.append({"text": _window_text(window), "metadata": chunk_metadata})
+    return file_chunks
@@ -0,0 +1,116 @@
+import re
+from chunker import count_tokens, split_sentences
+from lexical_index import tokenize
+
+# --- Konfiguration ---
+context_token_budget = 1200 # Obergrenze für den Kontext im Prompt (Schätzung per chunker.count_tokens)
+min_excerpt_tokens = 40 # Restbudget, ab dem aus einem zu großen Chunk noch einzelne Sätze übernommen werden
+dedupe_threshold = 0.9 # Jaccard-Ähnlichkeit der Wortmengen, ab der ein Chunk als Duplikat gilt
+# --------------------
+
+# Baut den Kontext für das LLM aus den Retrieval-Treffern (beste zuerst):
+#  1. Gierig packen: passt ein Chunk ganz ins Restbudget, wird er übernommen; sonst nur
+#     seine Sätze mit den meisten Query-Begriffen (in Originalreihenfolge, Lücken als "…").
+#  2. Fast identische Texte (z.B. dasselbe Paper doppelt indiziert) werden übersprungen.
+#  3. Benachbarte Chunks desselben Papers werden zu einem Block zusammengefügt; die
+#     Überlappung der Chunk-Fenster (chunker.py) erscheint dabei nur einmal.
+# Damit ist die Prompt-Größe pro Anfrage begrenzt, unabhängig von der Chunk-Größe.
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _chunk_position(chunk_id):
+    """ '<source_file>_chunk_<i>' -> (source_file, i); i ist None bei anderen IDs. """
+    source, separator, index = chunk_id.rpartition("_chunk_")
+    return (source, int(index)) if separator and index.isdigit() else (chunk_id, None)
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def best_sentences(query, text, budget):
+    """ Die Sätze mit den meisten Query-Begriffen, die zusammen ins Budget passen. Gibt (Text, Tokens) zurück. """
+    query_terms = set(tokenize(query))
+    sentences = split_sentences(text)
+    scores = [len(query_terms & set(tokenize(sentence))) for sentence in sentences]
+    chosen, used = [], 0
+    for i in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+        if scores[i] == 0:
+            break
+        tokens = count_tokens(sentences[i])
+        if used + tokens <= budget:
+            chosen.append(i)
+            used += tokens
+    if not chosen:
+        return "", 0
+    chosen.sort()
+    parts = ["…"] if chosen[0] > 0 else []
+    for position, i in enumerate(chosen):
+        if position and i != chosen[position - 1] + 1:
+            parts.append("…")
+        parts.append(sentences[i])
+    if chosen[-1] < len(sentences) - 1:
+        parts.append("…")
+    return ' '.join(parts), used
+
+
+def _stitch(first, second):
+    """ Hängt second an first an und lässt dabei den überlappenden Anfang von second weg. """
+    probe = second[:30]
+    position = first.rfind(probe) if probe else -1
+    while position >= 0:
+        if second.startswith(first[position:]):
+            return first + second[len(first) - position:]
+        position = first.rfind(probe, 0, position)
+    return first + "\n" + second
+
+
+def pack_context(query, chunks, budget=context_token_budget):
+    """ Packt Chunks (Dicts mit id, source_file, location, text; beste zuerst) in das Token-Budget.
+
+    Gibt (context_string, Indizes der verwendeten Chunks in chunks, geschätzte Tokens) zurück.
+    """
+    selected = [] # (Index, Chunk, Text, ganz übernommen?)
+    seen_words = []
+    used = 0
+    for index, chunk in enumerate(chunks):
+        text = chunk["text"]
+        if not text or text.startswith("Error:"):
+            continue
+        words = set(_WORD_RE.findall(text.lower()))
+        if any(_jaccard(words, other) >= dedupe_threshold for other in seen_words):
+            continue
+        header_tokens = count_tokens(f"Source: {chunk['source_file']}, {chunk['location']}:")
+        tokens = count_tokens(text) + header_tokens
+        whole = used + tokens <= budget
+        if not whole:
+            if budget - used - header_tokens < min_excerpt_tokens:
+                continue
+            text, excerpt_tokens = best_sentences(query, text, budget - used - header_tokens)
+            if not text:
+                continue
+            tokens = excerpt_tokens + header_tokens
+        selected.append((index, chunk, text, whole))
+        seen_words.append(words)
+        used += tokens
+
+    # Benachbarte Chunks desselben Papers zusammenführen (Reihenfolge im Paper)
+    blocks = []
+    for index, chunk, text, whole in sorted(selected, key=lambda item: _chunk_position(item[1]["id"])):
+        source, position = _chunk_position(chunk["id"])
+        previous = blocks[-1] if blocks else None
+        if (previous is not None and position is not None and previous["source"] == source
+                and previous["last_position"] == position - 1):
+            previous["text"] = (_stitch(previous["text"], text) if previous["last_whole"] and whole
+                                else previous["text"] + "\n" + text)
+            previous["indices"].append(index)
+            previous["last_position"], previous["last_whole"] = position, whole
+        else:
+            blocks.append({"source": source, "source_file": chunk["source_file"], "location": chunk["location"],
+                           "text": text, "indices": [index], "last_position": position, "last_whole": whole})
+
+    blocks.sort(key=lambda block: min(block["indices"])) # Block mit dem besten Treffer zuerst
+    context_string = "\n---\n".join(f"Source: {block['source_file']}, {block['location']}:\n{block['text']}\n"
+                                    for block in blocks)
+    return context_string, sorted(index for index, _, _, _ in selected), used
@@ -1,6 +1,9 @@
 import os
 import json
-from sentence_transformers import SentenceTransformer
+import time
+import argparse
+from pipeline_manifest import PipelineManifest
+from embedding_cache import EmbeddingCache
 import numpy as np # Wird oft für die Arbeit mit Vektoren verwendet
 
 # --- Konfiguration ---
@@ -11,46 +14,195 @@ embeddings_output_directory = "embeddings_output" # Neuer Ordner für Daten mit
 # 'multi-qa-mpnet-base-dot-v1': Gut für semantische Suche / Q&A.
 # Für wissenschaftliche Texte könnten spezifischere Modelle besser sein (ggf. später testen)
 model_name = 'all-MiniLM-L6-v2'
+# "torch": SentenceTransformer (PyTorch); "onnx": exportiertes int8-Modell (onnx_encoder.py)
+encoder_backend = "torch"
+encode_batch_size = 64 # Texte pro Forward-Pass
+# Chunks aus allen Dateien werden in Fenstern dieser Größe gesammelt und nach Länge
+# sortiert, damit jeder Batch ähnlich lange Texte enthält (wenig Padding).
+scheduler_window = 8192
+# >1: Encoding über mehrere CPU-Prozesse (SentenceTransformer Multi-Process-Pool)
+num_processes = 1
+# Bereits berechnete Embeddings (gleicher normalisierter Text, gleiches Modell) wiederverwenden
+use_embedding_cache = True
 # --------------------
 
-print(f"Loading Sentence Transformer model: {model_name}")
-# Lädt das Modell. Beim ersten Mal wird es heruntergeladen (kann dauern).
-# Stelle sicher, dass du Internetzugang hast, wenn du das Skript zum ersten Mal ausführst.
-try:
-    model = SentenceTransformer(model_name)
-except Exception as e:
-    print(f"Error loading model {model_name}. Do you have internet access?")
-    print(f"Error details: {e}")
-    exit()
-print("Model loaded.")
-
-# Erstelle das Ausgabe-Verzeichnis für Embeddings, falls es nicht existiert
-if not os.path.exists(embeddings_output_directory):
-    os.makedirs(embeddings_output_directory)
-    print(f"Created embeddings output directory: {embeddings_output_directory}")
-
-if not os.path.exists(chunks_input_directory):
-    print(f"Error: Chunks input directory '{chunks_input_directory}' not found.")
-    exit()
-
-print(f"Starting embedding generation from '{chunks_input_directory}'...")
-
-# Gehe durch alle JSON-Dateien im Chunk-Verzeichnis
-for filename in os.listdir(chunks_input_directory):
-    if filename.lower().endswith("_chunks.json"):
-        json_path = os.path.join(chunks_input_directory, filename)
-        # Erstelle einen Basisnamen für die Output-Datei
-        base_output_name = filename.replace("_chunks.json", "")
-        # Wir speichern die Embeddings separat als NumPy-Datei und die Metadaten weiterhin als JSON
-        output_meta_path = os.path.join(embeddings_output_directory, f"{base_output_name}_meta.json")
-        output_embed_path = os.path.join(embeddings_output_directory, f"{base_output_name}_embeddings.npy")
 
-        print(f"  Processing: {filename} ...")
+class PendingFile:
+    """ Eine Chunk-Datei, deren Embeddings gerade über mehrere Fenster verteilt berechnet werden. """
 
-        try:
-            # Lade die Chunk-Daten aus der JSON-Datei
-            with open(json_path, 'r', encoding='utf-8') as f_in:
-                chunks_data = json.load(f_in)
+    def __init__(self, filename, json_path, content_hash, chunks_data):
+        base_output_name = filename.replace("_chunks.json", "")
+        self.filename = filename
+        self.json_path = json_path
+        self.content_hash = content_hash
+        # Wir speichern die Embeddings separat als NumPy-Datei und die Metadaten weiterhin als JSON
+        self.output_meta_path = os.path.join(embeddings_output_directory, f"{base_output_name}_meta.json")
+        self.output_embed_path = os.path.join(embeddings_output_directory, f"{base_output_name}_embeddings.npy")
+        self.metadata_list = [chunk['metadata'] for chunk in chunks_data]
+        self.embeddings = None # Wird angelegt, sobald die Vektorlänge bekannt ist
+        self.remaining = len(chunks_data)
+
+
+class EmbeddingScheduler:
+    """ Sammelt Chunks über Dateigrenzen hinweg, encodiert sie längensortiert und verteilt die
+    Ergebnisse zurück auf die einzelnen Paper. Fertige Paper werden sofort gespeichert. """
+
+    def __init__(self, model, manifest, batch_size=encode_batch_size, window=scheduler_window, pool=None, cache=None):
+        self.model = model
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.window = window
+        self.pool = pool
+        self.cache = cache
+        self.pending = [] # (PendingFile, Zeile, Text)
+        self.encoded_chunks = 0
+        self.completed_files = 0
+        self.encode_seconds = 0.0
+
+    def add_file(self, pending_file, texts):
+        for row, text in enumerate(texts):
+            self.pending.append((pending_file, row, text))
+        if len(self.pending) >= self.window:
+            self.flush()
+
+    def encode(self, texts):
+        if self.cache is not None:
+            # Nur Texte encodieren, deren Embedding noch nicht im Cache liegt
+            return self.cache.encode(self._encode_uncached, texts)
+        return self._encode_uncached(texts)
+
+    def _encode_uncached(self, texts):
+        if self.pool is not None:
+            return self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        return self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=True)
+
+    def flush(self):
+        if not self.pending:
+            return
+        # Längensortierung: Batches enthalten ähnlich lange Texte. Beim Multi-Process-Pool
+        # bekommt so auch jeder Worker homogene Stücke.
+        window = sorted(self.pending, key=lambda item: len(item[2]), reverse=True)
+        self.pending = []
+        print(f"  Encoding window of {len(window)} chunks...")
+        start_time = time.time()
+        embeddings = self.encode([text for _, _, text in window])
+        self.encode_seconds += time.time() - start_time
+        self.encoded_chunks += len(window)
+
+        # Ergebnisse zurück auf die Paper verteilen
+        for (pending_file, row, _), embedding in zip(window, embeddings):
+            if pending_file.embeddings is None:
+                pending_file.embeddings = np.zeros((len(pending_file.metadata_list), embedding.shape[0]),
+                                                   dtype=np.float32)
+            pending_file.embeddings[row] = embedding
+            pending_file.remaining -= 1
+            if pending_file.remaining == 0:
+                self.save(pending_file)
+
+    def save(self, pending_file):
+        # 1. Speichere die Embeddings als NumPy-Datei (.npy)
+        np.save(pending_file.output_embed_path, pending_file.embeddings)
+        # 2. Speichere die Metadaten als JSON (korrespondierend zu den Zeilen in der .npy-Datei)
+        with open(pending_file.output_meta_path, 'w', encoding='utf-8') as f_meta_out:
+            json.dump(pending_file.metadata_list, f_meta_out, ensure_ascii=False, indent=2)
+        self.manifest.record("embed", pending_file.filename, pending_file.content_hash,
+                             input_paths=[pending_file.json_path],
+                             outputs=[pending_file.output_embed_path, pending_file.output_meta_path])
+        self.completed_files += 1
+        print(f"    -> Saved {pending_file.embeddings.shape[0]} embeddings to '{pending_file.output_embed_path}'")
+        pending_file.embeddings = None # Speicher freigeben
+
+
+def load_model():
+    print(f"Loading Sentence Transformer model: {model_name}")
+    # Lädt das Modell. Beim ersten Mal wird es heruntergeladen (kann dauern).
+    # Stelle sicher, dass du Internetzugang hast, wenn du das Skript zum ersten Mal ausführst.
+    try:
+        if encoder_backend == "onnx":
+            from onnx_encoder import OnnxEncoder
+            model = OnnxEncoder(model_name)
+        else:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+    except Exception as e:
+        print(f"Error loading model {model_name}. Do you have internet access?")
+        print(f"Error details: {e}")
+        exit()
+    print("Model loaded.")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Erzeugt Embeddings für alle Chunk-JSON-Dateien.")
+    parser.add_argument("--force", action="store_true", help="Alle Chunk-Dateien neu embedden, auch unveränderte")
+    parser.add_argument("--batch-size", type=int, default=encode_batch_size, help="Texte pro Forward-Pass")
+    parser.add_argument("--window", type=int, default=scheduler_window,
+                        help="Chunks, die gemeinsam nach Länge sortiert werden")
+    parser.add_argument("--processes", type=int, default=num_processes,
+                        help="Anzahl Encoding-Prozesse (>1 nutzt den Multi-Process-Pool)")
+    parser.add_argument("--no-cache", action="store_true", help="Embedding-Cache nicht verwenden")
+    args = parser.parse_args()
+
+    # Erstelle das Ausgabe-Verzeichnis für Embeddings, falls es nicht existiert
+    if not os.path.exists(embeddings_output_directory):
+        os.makedirs(embeddings_output_directory)
+        print(f"Created embeddings output directory: {embeddings_output_directory}")
+
+    if not os.path.exists(chunks_input_directory):
+        print(f"Error: Chunks input directory '{chunks_input_directory}' not found.")
+        exit()
+
+    print(f"Starting embedding generation from '{chunks_input_directory}'...")
+
+    # Manifest: nur neue/geänderte Chunk-Dateien embedden, Ausgaben gelöschter Dateien entfernen
+    manifest = PipelineManifest()
+    chunk_filenames = sorted(f for f in os.listdir(chunks_input_directory) if f.lower().endswith("_chunks.json"))
+    for stale_name in manifest.stale_inputs("embed", chunk_filenames):
+        print(f"  Chunk file removed: {stale_name}")
+        manifest.remove_outputs("embed", stale_name)
+
+    pending_inputs = []
+    skipped_files = 0
+    for filename in chunk_filenames:
+        json_path = os.path.join(chunks_input_directory, filename)
+        content_hash = manifest.content_hash("embed", filename, json_path)
+        if not args.force and manifest.is_current("embed", filename, content_hash):
+            skipped_files += 1
+            continue
+        pending_inputs.append((filename, json_path, content_hash))
+
+    if not pending_inputs:
+        manifest.save()
+        print(f"\nNothing to do: all {skipped_files} chunk files are unchanged.")
+        return
+
+    model = load_model() # Erst laden, wenn wirklich etwas zu tun ist
+    pool = None
+    if args.processes > 1 and encoder_backend == "onnx":
+        print("Warning: --processes is ignored with the ONNX backend (ONNX Runtime uses all cores itself).")
+    elif args.processes > 1:
+        print(f"Starting multi-process pool with {args.processes} CPU workers...")
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * args.processes)
+
+    cache = None
+    if use_embedding_cache and not args.no_cache:
+        cache_name = model.cache_name if encoder_backend == "onnx" else model_name
+        cache = EmbeddingCache(cache_name, model.get_sentence_embedding_dimension())
+
+    scheduler = EmbeddingScheduler(model, manifest, batch_size=args.batch_size, window=args.window,
+                                   pool=pool, cache=cache)
+    start_time = time.time()
+    try:
+        # Gehe durch alle neuen/geänderten JSON-Dateien im Chunk-Verzeichnis
+        for filename, json_path, content_hash in pending_inputs:
+            print(f"  Queueing: {filename} ...")
+            try:
+                # Lade die Chunk-Daten aus der JSON-Datei
+                with open(json_path, 'r', encoding='utf-8') as f_in:
+                    chunks_data = json.load(f_in)
+            except json.JSONDecodeError as e:
+                print(f"    -> Error: Could not decode JSON from {filename}. Error: {e}")
+                continue
 
             if not chunks_data:
                 print("    -> Warning: No chunks found in this file. Skipping.")
@@ -58,33 +210,24 @@ for filename in os.listdir(chunks_input_directory):
 
             # Extrahiere nur die Texte für das Embedding-Modell
             texts_to_embed = [chunk['text'] for chunk in chunks_data]
-
-            # Generiere die Embeddings für alle Texte in dieser Datei auf einmal (effizienter)
-            print(f"    Generating embeddings for {len(texts_to_embed)} chunks...")
-            embeddings = model.encode(texts_to_embed, show_progress_bar=True) # Zeigt Fortschrittsbalken
-            print(f"    Embeddings generated with shape: {embeddings.shape}") # Zeigt Dimension (Anzahl Chunks, Vektorlänge)
-
-            # --- Speichern der Ergebnisse ---
-            # 1. Speichere die Embeddings als NumPy-Datei (.npy)
-            np.save(output_embed_path, embeddings)
-
-            # 2. Speichere die Metadaten (und Texte, falls gewünscht) als JSON
-            #    Wir erstellen hier eine Liste, die nur die Metadaten enthält,
-            #    korrespondierend zu den Zeilen in der .npy-Datei.
-            metadata_list = [chunk['metadata'] for chunk in chunks_data]
-            # Optional: Füge Text hinzu, wenn du ihn hier brauchst
-            # metadata_list = [{'text': chunk['text'], 'metadata': chunk['metadata']} for chunk in chunks_data]
-
-            with open(output_meta_path, 'w', encoding='utf-8') as f_meta_out:
-                json.dump(metadata_list, f_meta_out, ensure_ascii=False, indent=2)
-
-            print(f"    -> Success! Saved embeddings to '{output_embed_path}' and metadata to '{output_meta_path}'")
-
-        except json.JSONDecodeError as e:
-            print(f"    -> Error: Could not decode JSON from {filename}. Error: {e}")
-        except Exception as e:
-             print(f"    -> An unexpected error occurred processing {filename}: {e}")
-
-
-print("\nEmbedding generation finished.")
-print(f"Embedding data is in the '{embeddings_output_directory}' folder.")
\ No newline at end of file
+            scheduler.add_file(PendingFile(filename, json_path, content_hash, chunks_data), texts_to_embed)
+        scheduler.flush()
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+        manifest.save()
+
+    elapsed = time.time() - start_time
+    print("\nEmbedding generation finished.")
+    if skipped_files:
+        print(f"Skipped {skipped_files} unchanged chunk files.")
+    if scheduler.encoded_chunks and scheduler.encode_seconds > 0:
+        print(f"Encoded {scheduler.encoded_chunks} chunks from {scheduler.completed_files} files in {elapsed:.2f}s "
+              f"({scheduler.encoded_chunks / scheduler.encode_seconds:.1f} chunks/s model throughput).")
+    if cache is not None:
+        print(f"Embedding cache: {cache.disk_hits} reused, {cache.computed} newly computed.")
+    print(f"Embedding data is in the '{embeddings_output_directory}' folder.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from byte_lru_cache import ByteLRUCache
+
+# --- Konfiguration ---
+embedding_cache_directory = "embedding_cache" # Ein Unterordner pro Modell
+memory_cache_max_bytes = 16 * 1024 * 1024 # In-Memory-LRU vor dem Disk-Cache (v.a. für häufige Queries)
+# --------------------
+
+# Aufbau pro Modell (embedding_cache/<modell>/):
+#   vectors.f32   - alle Vektoren als rohe float32-Zeilen hintereinander (wird per np.memmap gelesen)
+#   index.sqlite  - Schlüssel (Hash des normalisierten Texts) -> Zeilennummer in vectors.f32
+#   meta.json     - Modellname und Vektorlänge
+# Neue Vektoren werden nur angehängt. Das Anhängen läuft innerhalb einer
+# SQLite-Schreibtransaktion, damit auch mehrere Prozesse (z.B. WSGI-Worker)
+# gleichzeitig schreiben können, ohne dass sich Zeilennummern überschneiden.
+
+
+def normalize_text(text):
+    """ Whitespace-Normalisierung. Ändert die Tokenisierung nicht, macht aber mehr Texte cache-gleich. """
+    return ' '.join(text.split())
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+def _model_slug(model_name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', model_name)
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, dim, directory=embedding_cache_directory, memory_max_bytes=memory_cache_max_bytes):
+        self.model_name = model_name
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.path = os.path.join(directory, _model_slug(model_name))
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.index_path = os.path.join(self.path, "index.sqlite")
+        os.makedirs(self.path, exist_ok=True)
+
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("dim") != dim:
+                raise ValueError(f"Embedding cache '{self.path}' has dim {meta.get('dim')}, model has {dim}")
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"model_name": model_name, "dim": dim}, f)
+
+        self.memory = ByteLRUCache(memory_max_bytes)
+        self._local = threading.local()
+        self._mmap = None
+        self._mmap_lock = threading.Lock()
+        self.disk_hits = 0
+        self.computed = 0
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (key BLOB PRIMARY KEY, row INTEGER NOT NULL) WITHOUT ROWID")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None) # Transaktionen explizit
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _vectors(self, min_rows):
+        """ Memory-Map der Vektordatei; wird neu gemappt, wenn die Datei gewachsen ist. """
+        with self._mmap_lock:
+            if self._mmap is None or self._mmap.shape[0] < min_rows:
+                rows = os.path.getsize(self.vectors_path) // self.row_bytes
+                self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+            return self._mmap
+
+    def get_many(self, texts):
+        """ Gibt (Liste mit Vektor oder None pro Text, Indizes der fehlenden Texte) zurück. """
+        keys = [text_key(text) for text in texts]
+        results = [self.memory.get(key) for key in keys]
+        lookup = {} # key -> Indizes aller Texte mit diesem Schlüssel (Duplikate im Batch)
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                lookup.setdefault(key, []).append(i)
+        if lookup:
+            conn = self._connection()
+            found_rows = {}
+            lookup_keys = list(lookup)
+            for start in range(0, len(lookup_keys), 500):
+                batch = lookup_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, row in conn.execute(f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", batch):
+                    found_rows[key] = row
+            if found_rows:
+                vectors = self._vectors(max(found_rows.values()) + 1)
+                for key, row in found_rows.items():
+                    vector = np.array(vectors[row]) # Kopie aus der Memory-Map
+                    for i in lookup[key]:
+                        results[i] = vector
+                    self.memory.put(key, vector)
+                self.disk_hits += len(found_rows)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        return results, missing
+
+    def put_many(self, texts, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        unique = {}
+        for text, vector in zip(texts, vectors):
+            unique.setdefault(text_key(text), vector)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE") # Schreibsperre: serialisiert Anhängen über Prozesse hinweg
+        try:
+            existing = set()
+            unique_keys = list(unique)
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                existing.update(key for (key,) in conn.execute(
+                    f"SELECT key FROM vectors WHERE key IN ({placeholders})", batch))
+            new_items = [(key, vector) for key, vector in unique.items() if key not in existing]
+            if new_items:
+                with open(self.vectors_path, 'ab') as f:
+                    end = f.seek(0, os.SEEK_END)
+                    if end % self.row_bytes:
+                        f.truncate(end - end % self.row_bytes) # Unvollständige Zeile eines abgebrochenen Laufs
+                    first_row = end // self.row_bytes
+                    f.write(np.stack([vector for _, vector in new_items]).tobytes())
+                conn.executemany("INSERT INTO vectors (key, row) VALUES (?, ?)",
+                                 [(key, first_row + i) for i, (key, _) in enumerate(new_items)])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for key, vector in unique.items():
+            self.memory.put(key, vector)
+
+    def encode(self, encode_fn, texts):
+        """ Wie encode_fn(texts), berechnet aber nur Texte, die noch nicht im Cache sind. """
+        results, missing = self.get_many(texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = np.asarray(encode_fn(missing_texts), dtype=np.float32)
+            self.put_many(missing_texts, computed)
+            for i, vector in zip(missing, computed):
+                results[i] = vector
+            self.computed += len(missing)
+        return np.stack(results) if results else np.zeros((0, self.dim), dtype=np.float32)
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk_hits": self.disk_hits, "computed": self.computed}
@@ -0,0 +1,32 @@
+# --- gunicorn-Konfiguration: mehrere Worker teilen sich ein Embedding-Modell ---
+# Start: gunicorn -c gunicorn.conf.py
+# Streaming (ASGI): gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker 'asgi_app:create_app()'
+#
+# Mit preload_app importiert der Master-Prozess app.py und create_app() lädt die Modelle
+# (SentenceTransformer, ggf. Reranker, BM25-Index) genau einmal. Die Worker entstehen per
+# fork() und teilen sich diese Speicherseiten per Copy-on-Write; ein zusätzlicher Worker
+# kostet so nur seine eigenen Verbindungen und Caches statt einer weiteren Modellkopie.
+# Verbindungen (ChromaDB, SQLite, LLM-Clients) sind nicht fork-sicher und werden erst im
+# Worker geöffnet (post_fork -> app.init_worker()).
+import os
+
+# Muss vor dem Import von app.py gesetzt sein: nicht beim Import im Hintergrund laden,
+# sondern in create_app() vor dem fork
+os.environ.setdefault("RAG_LOAD_MODE", "preload")
+
+# --- Konfiguration ---
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4)) # Threads pro Worker; LLM-Aufrufe warten meist auf I/O
+timeout = 120
+encoder_threads = max(1, (os.cpu_count() or 1) // workers) # CPU-Threads des Embedding-Modells pro Worker
+# --------------------
+
+wsgi_app = "app:create_app()"
+preload_app = True
+
+
+def post_fork(server, worker):
+    import app as rag_app
+    rag_app.init_worker(encoder_threads)
@@ -1,110 +1,291 @@
 import os
 import json
+import time
+import queue
+import argparse
+import threading
 import numpy as np
 import chromadb # ChromaDB importieren
-import uuid # Um eindeutige IDs für Chunks zu generieren
+from chunk_store import make_chunk_id # Gleiches ID-Schema wie im Chunk Store
+from pipeline_manifest import PipelineManifest
+import vector_index
 
 # --- Konfiguration ---
 embeddings_input_directory = "embeddings_output" # Ordner mit Embeddings und Metadaten
 chroma_db_path = "chroma_db" # Pfad, wo ChromaDB seine Daten speichern soll
 collection_name = "scientific_papers" # Name für die Sammlung in ChromaDB
+pdfs_input_directory = "pdfs_input" # Für --prune-missing: welche PDFs gibt es noch?
+index_batch_size = None # Chunks pro upsert-Aufruf. None -> Maximum des Chroma-Clients (client.get_max_batch_size())
+prefetch_documents = 8 # So viele Paper lädt der Producer-Thread im Voraus
+# Zusätzlich den In-Process-Vektorindex (vector_index.py) neu bauen, wenn sich etwas geändert hat.
+# Nur nötig, wenn app.py / query_data.py mit retrieval_backend = "numpy" laufen.
+update_vector_index = False
 # --------------------
 
-print("Initializing ChromaDB...")
-# Initialisiert ChromaDB. 'PersistentClient' speichert die Daten im angegebenen Pfad.
-# Wenn der Pfad nicht existiert, wird er erstellt.
-client = chromadb.PersistentClient(path=chroma_db_path)
-
-# Erstelle eine neue Sammlung oder hole eine bestehende.
-# metadata={"hnsw:space": "cosine"} legt fest, dass die Kosinus-Ähnlichkeit
-# für die Vektorsuche verwendet wird, was für Sentence Transformer Embeddings üblich ist.
-print(f"Getting or creating collection: {collection_name}")
-collection = client.get_or_create_collection(
-    name=collection_name,
-    metadata={"hnsw:space": "cosine"} # Wichtig für Ähnlichkeitsmaß
-    )
-
-print(f"Starting indexing process from '{embeddings_input_directory}'...")
-
-if not os.path.exists(embeddings_input_directory):
-    print(f"Error: Embeddings input directory '{embeddings_input_directory}' not found.")
-    exit()
-
-# Gehe durch alle Metadaten-Dateien im Embedding-Verzeichnis
-processed_files = 0
-total_chunks_added = 0
-for filename in os.listdir(embeddings_input_directory):
-    if filename.lower().endswith("_meta.json"):
+
+def get_document_ids(collection, source_file):
+    """ Alle Chunk-IDs, die aktuell für ein Paper in der Sammlung liegen. """
+    return collection.get(where={"source_file": source_file}, include=[])['ids']
+
+
+def delete_document(collection, source_file):
+    """ Entfernt alle Chunks eines Papers aus der Sammlung. Gibt die Anzahl zurück. """
+    existing_ids = get_document_ids(collection, source_file)
+    if existing_ids:
+        collection.delete(ids=existing_ids)
+    return len(existing_ids)
+
+
+def indexed_source_files(collection, page_size=10000):
+    """ Menge aller source_file-Werte in der Sammlung (seitenweise gelesen). """
+    source_files = set()
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        source_files.update(meta.get('source_file') for meta in page['metadatas'] if meta)
+        offset += len(page['ids'])
+    return source_files
+
+
+def existing_pdf_files(pdf_directory=pdfs_input_directory):
+    return set(os.listdir(pdf_directory)) if os.path.exists(pdf_directory) else set()
+
+
+def prune_missing_documents(collection, manifest, pdf_directory=pdfs_input_directory):
+    """ Löscht alle Chunks von Papern, deren PDF nicht mehr in pdf_directory liegt.
+
+    Ihre "index"-Einträge im Manifest werden ebenfalls entfernt, damit keine veralteten
+    Hashes zurückbleiben. Gibt die Anzahl gelöschter Chunks zurück.
+    """
+    existing_pdfs = existing_pdf_files(pdf_directory)
+    total_deleted = 0
+    for source_file in sorted(indexed_source_files(collection) - existing_pdfs):
+        if source_file is None:
+            continue
+        deleted = delete_document(collection, source_file)
+        total_deleted += deleted
+        print(f"  PDF no longer present: {source_file} ({deleted} chunks deleted from collection)")
+    for base_name, entry in list(manifest.stage("index").items()):
+        if entry.get("source_file", base_name + ".pdf") not in existing_pdfs:
+            manifest.forget("index", base_name)
+    return total_deleted
+
+
+def load_document(base_name, meta_path, embed_path):
+    """ Lädt ein Dateipaar. Die Embeddings werden nur gemappt (mmap), nicht in Python-Listen kopiert. """
+    with open(meta_path, 'r', encoding='utf-8') as f_meta:
+        metadata_list = json.load(f_meta)
+    embeddings = np.load(embed_path, mmap_mode='r')
+
+    # Überprüfe Konsistenz: Anzahl Metadaten muss Anzahl Embeddings entsprechen
+    if len(metadata_list) != embeddings.shape[0]:
+        raise ValueError(f"Mismatch between number of metadata entries ({len(metadata_list)}) "
+                         f"and embeddings ({embeddings.shape[0]}) in file pair for '{base_name}'")
+
+    source_file = metadata_list[0].get('source_file', base_name + '.pdf') if metadata_list else base_name + '.pdf'
+    # Erzeuge eine eindeutige ID für jeden Chunk (aus Dateiname und Index)
+    ids = [make_chunk_id(meta.get('source_file', base_name + '.pdf'), i) for i, meta in enumerate(metadata_list)]
+    return {"base_name": base_name, "source_file": source_file, "ids": ids,
+            "metadatas": metadata_list, "embeddings": embeddings}
+
+
+def _produce_documents(pending_pairs, out_queue):
+    """ Producer-Thread: lädt Dateipaare im Voraus, während der Consumer in Chroma schreibt. """
+    for pair in pending_pairs:
+        try:
+            document = load_document(pair["base_name"], pair["meta_path"], pair["embed_path"])
+        except Exception as e:
+            document = {"base_name": pair["base_name"], "error": e}
+        document["pair"] = pair
+        out_queue.put(document)
+    out_queue.put(None) # Ende signalisieren
+
+
+def bulk_index(collection, pending_pairs, manifest, batch_size):
+    """ Schreibt alle Dateipaare in Batches von `batch_size` Chunks über Dateigrenzen hinweg.
+
+    Embedding-Slices werden direkt als float32-Arrays an Chroma übergeben. Verwaiste
+    IDs eines Papers werden erst gelöscht (und das Paper erst im Manifest
+    vermerkt), wenn sein letzter Chunk geschrieben wurde.
+    Gibt (Anzahl Paper, Anzahl Chunks, gelöschte verwaiste Chunks) zurück.
+    """
+    document_queue = queue.Queue(maxsize=prefetch_documents)
+    producer = threading.Thread(target=_produce_documents, args=(pending_pairs, document_queue), daemon=True)
+    producer.start()
+
+    batch_ids, batch_metadatas, batch_slices = [], [], []
+    batch_documents = [] # Paper mit mindestens einem Chunk im aktuellen Batch
+    completed_documents = [] # Paper, deren letzter Chunk im aktuellen Batch liegt
+    stats = {"documents": 0, "chunks": 0, "orphans": 0}
+    start_time = time.time()
+
+    def finalize(document):
+        pair = document["pair"]
+        orphan_ids = sorted(set(document["existing_ids"]) - set(document["ids"]))
+        if orphan_ids:
+            collection.delete(ids=orphan_ids)
+        manifest.record("index", document["base_name"], pair["content_hash"],
+                        input_paths=[pair["meta_path"], pair["embed_path"]],
+                        source_file=document["source_file"], num_chunks=len(document["ids"]))
+        stats["documents"] += 1
+        stats["chunks"] += len(document["ids"])
+        stats["orphans"] += len(orphan_ids)
+        orphan_note = f", removed {len(orphan_ids)} orphaned chunks" if orphan_ids else ""
+        print(f"    -> Upserted {len(document['ids'])} chunks of {document['source_file']}{orphan_note}.")
+
+    def flush():
+        if not batch_ids:
+            return
+        try:
+            embeddings = batch_slices[0] if len(batch_slices) == 1 else np.concatenate(batch_slices)
+            collection.upsert(ids=batch_ids, embeddings=np.asarray(embeddings, dtype=np.float32),
+                              metadatas=batch_metadatas)
+        except Exception as e:
+            # Betroffene Paper werden nicht im Manifest vermerkt und beim nächsten Lauf erneut indiziert
+            print(f"    -> Error: Batch upsert of {len(batch_ids)} chunks failed: {e}")
+            for document in batch_documents:
+                document["failed"] = True
+        for document in completed_documents:
+            if not document.get("failed"):
+                finalize(document)
+        elapsed = time.time() - start_time
+        print(f"  Batch of {len(batch_ids)} chunks done "
+              f"({stats['chunks'] / elapsed if elapsed > 0 else 0:.0f} chunks/s so far)")
+        batch_ids.clear()
+        batch_metadatas.clear()
+        batch_slices.clear()
+        batch_documents.clear()
+        completed_documents.clear()
+
+    while True:
+        document = document_queue.get()
+        if document is None:
+            break
+        if "error" in document:
+            print(f"    -> Error: Could not load file pair for '{document['base_name']}': {document['error']}. Skipping.")
+            continue
+        if not document["ids"]:
+            print(f"    -> Warning: No metadata/embeddings found for '{document['base_name']}'. Skipping.")
+            continue
+
+        document["existing_ids"] = get_document_ids(collection, document["source_file"])
+        position, total = 0, len(document["ids"])
+        while position < total:
+            take = min(batch_size - len(batch_ids), total - position)
+            batch_ids.extend(document["ids"][position:position + take])
+            batch_metadatas.extend(document["metadatas"][position:position + take])
+            batch_slices.append(document["embeddings"][position:position + take])
+            if not batch_documents or batch_documents[-1] is not document:
+                batch_documents.append(document)
+            position += take
+            if position == total:
+                completed_documents.append(document)
+            if len(batch_ids) >= batch_size:
+                flush()
+    flush()
+    producer.join()
+
+    elapsed = time.time() - start_time
+    if stats["chunks"]:
+        print(f"\nBulk load: {stats['chunks']} chunks from {stats['documents']} papers in {elapsed:.2f}s "
+              f"({stats['chunks'] / elapsed:.0f} chunks/s, batch size {batch_size}).")
+    return stats["documents"], stats["chunks"], stats["orphans"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indiziert Embeddings und Metadaten in ChromaDB.")
+    parser.add_argument("--force", action="store_true", help="Alle Dateipaare neu indizieren, auch unveränderte")
+    parser.add_argument("--prune-missing", action="store_true",
+                        help=f"Chunks aller Paper löschen, deren PDF nicht mehr in '{pdfs_input_directory}' liegt")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Chunks pro upsert-Aufruf (Standard: Maximum des Chroma-Clients)")
+    parser.add_argument("--vector-index", action="store_true",
+                        help="Zusätzlich den numpy-Vektorindex (vector_index.py) aktualisieren")
+    args = parser.parse_args()
+
+    print("Initializing ChromaDB...")
+    # Initialisiert ChromaDB. 'PersistentClient' speichert die Daten im angegebenen Pfad.
+    # Wenn der Pfad nicht existiert, wird er erstellt.
+    client = chromadb.PersistentClient(path=chroma_db_path)
+
+    # Erstelle eine neue Sammlung oder hole eine bestehende.
+    # metadata={"hnsw:space": "cosine"} legt fest, dass die Kosinus-Ähnlichkeit
+    # für die Vektorsuche verwendet wird, was für Sentence Transformer Embeddings üblich ist.
+    print(f"Getting or creating collection: {collection_name}")
+    collection = client.get_or_create_collection(
+        name=collection_name,
+        metadata={"hnsw:space": "cosine"} # Wichtig für Ähnlichkeitsmaß
+        )
+
+    print(f"Starting indexing process from '{embeddings_input_directory}'...")
+
+    if not os.path.exists(embeddings_input_directory):
+        print(f"Error: Embeddings input directory '{embeddings_input_directory}' not found.")
+        exit()
+
+    # Manifest: nur neue/geänderte Dateipaare indizieren, Chunks gelöschter Paper aus der Sammlung entfernen
+    manifest = PipelineManifest()
+    meta_filenames = sorted(f for f in os.listdir(embeddings_input_directory) if f.lower().endswith("_meta.json"))
+    stale_names = manifest.stale_inputs("index", [f.replace("_meta.json", "") for f in meta_filenames])
+    for stale_name in stale_names:
+        stale_entry = manifest.forget("index", stale_name)
+        deleted = delete_document(collection, stale_entry.get("source_file", stale_name + ".pdf"))
+        print(f"  Paper removed: {stale_name} ({deleted} chunks deleted from collection)")
+
+    existing_pdfs = None
+    if args.prune_missing:
+        prune_missing_documents(collection, manifest)
+        existing_pdfs = existing_pdf_files()
+
+    # Gehe durch alle Metadaten-Dateien im Embedding-Verzeichnis und sammle neue/geänderte Paare
+    skipped_files = 0
+    pending_pairs = []
+    for filename in meta_filenames:
         base_name = filename.replace("_meta.json", "")
+        if existing_pdfs is not None and f"{base_name}.pdf" not in existing_pdfs:
+            continue # Mit --prune-missing nicht wieder indizieren, solange die PDF fehlt
         meta_path = os.path.join(embeddings_input_directory, filename)
         embed_path = os.path.join(embeddings_input_directory, f"{base_name}_embeddings.npy")
 
-        print(f"  Processing file pair: {filename} and {base_name}_embeddings.npy ...")
-
         # Stelle sicher, dass die zugehörige .npy-Datei existiert
         if not os.path.exists(embed_path):
             print(f"    -> Warning: Corresponding embedding file '{base_name}_embeddings.npy' not found. Skipping.")
             continue
 
-        try:
-            # Lade Metadaten
-            with open(meta_path, 'r', encoding='utf-8') as f_meta:
-                metadata_list = json.load(f_meta)
-
-            # Lade Embeddings
-            embeddings = np.load(embed_path)
-
-            # Überprüfe Konsistenz: Anzahl Metadaten muss Anzahl Embeddings entsprechen
-            if len(metadata_list) != embeddings.shape[0]:
-                print(f"    -> Error: Mismatch between number of metadata entries ({len(metadata_list)}) "
-                      f"and embeddings ({embeddings.shape[0]}) in file pair for '{base_name}'. Skipping.")
-                continue
-
-            if not metadata_list:
-                print("    -> Warning: No metadata/embeddings found in this file pair. Skipping.")
-                continue
-
-            # --- Daten für ChromaDB vorbereiten ---
-            ids_to_add = []
-            embeddings_to_add = []
-            metadata_to_add = []
-
-            for i, meta in enumerate(metadata_list):
-                # Erzeuge eine eindeutige ID für jeden Chunk
-                # z.B. aus Dateiname und Index
-                chunk_id = f"{meta.get('source_file', base_name + '.pdf')}_chunk_{i}"
-                # Alternativ: eine zufällige UUID
-                # chunk_id = str(uuid.uuid4())
-
-                ids_to_add.append(chunk_id)
-                # ChromaDB erwartet Embeddings als Liste von Listen (oder NumPy-Array)
-                embeddings_to_add.append(embeddings[i].tolist()) # Konvertiere NumPy-Zeile in Liste
-                # Füge die Metadaten hinzu, die wir gespeichert hatten
-                metadata_to_add.append(meta) # Das Metadaten-Dictionary direkt verwenden
-
-            # --- Daten zur ChromaDB-Sammlung hinzufügen ---
-            # Füge die Chunks in Batches hinzu (hier alle auf einmal, für große Datenmengen evtl. aufteilen)
-            collection.add(
-                ids=ids_to_add,
-                embeddings=embeddings_to_add,
-                metadatas=metadata_to_add
-                # Optional: documents=texte_der_chunks (wenn du den Text auch in Chroma speichern willst)
-            )
-            num_added = len(ids_to_add)
-            total_chunks_added += num_added
-            print(f"    -> Success! Added {num_added} chunks to ChromaDB collection '{collection_name}'.")
-            processed_files += 1
-
-        except FileNotFoundError:
-             print(f"    -> Error: File not found during processing of {filename} or its .npy counterpart.")
-        except Exception as e:
-             print(f"    -> An unexpected error occurred processing file pair for '{base_name}': {e}")
+        content_hash = manifest.content_hash("index", base_name, meta_path, embed_path)
+        if not args.force and manifest.is_current("index", base_name, content_hash):
+            skipped_files += 1
+            continue
+        pending_pairs.append({"base_name": base_name, "meta_path": meta_path,
+                              "embed_path": embed_path, "content_hash": content_hash})
+
+    batch_size = args.batch_size or index_batch_size or client.get_max_batch_size()
+    print(f"Indexing {len(pending_pairs)} new or changed file pairs in batches of up to {batch_size} chunks...")
+    try:
+        processed_files, total_chunks_added, total_orphans_deleted = bulk_index(
+            collection, pending_pairs, manifest, batch_size)
+    finally:
+        manifest.save()
+
+    print("\nIndexing finished.")
+    if skipped_files > 0:
+        print(f"Skipped {skipped_files} unchanged file pairs.")
+    if processed_files > 0:
+        print(f"Successfully processed {processed_files} file pairs.")
+        print(f"Total chunks upserted to collection '{collection_name}': {total_chunks_added}")
+        if total_orphans_deleted:
+            print(f"Total orphaned chunks deleted: {total_orphans_deleted}")
+        print(f"ChromaDB data is stored in: '{chroma_db_path}'")
+    else:
+        print("No files were processed.")
+
+    if (args.vector_index or update_vector_index) and (
+            processed_files or stale_names or not os.path.exists(vector_index.vector_index_directory)):
+        print("\nRebuilding in-process vector index...")
+        vector_index.build_index(input_directory=embeddings_input_directory)
 
 
-print("\nIndexing finished.")
-if processed_files > 0:
-    print(f"Successfully processed {processed_files} file pairs.")
-    print(f"Total chunks added to collection '{collection_name}': {total_chunks_added}")
-    print(f"ChromaDB data is stored in: '{chroma_db_path}'")
-else:
-    print("No files were processed.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import math
+import time
+import shutil
+import sqlite3
+import threading
+from array import array
+import numpy as np
+from chunk_store import chunk_store_path
+from metadata_filter import filter_fields, parse_where
+
+# --- Konfiguration ---
+lexical_index_directory = "lexical_index" # Wird von parse_xml.py nach jedem Lauf neu gebaut
+bm25_k1 = 1.2
+bm25_b = 0.75
+rrf_k = 60 # Reciprocal Rank Fusion: score = Summe 1 / (rrf_k + Rang)
+# Terms, die in mehr als diesem Anteil der Chunks vorkommen, liefern keine eigenen
+# Kandidaten, sondern erhöhen nur den Score der Kandidaten seltenerer Terms.
+common_term_fraction = 0.05
+# --------------------
+
+# Invertierter Index über alle Chunks im Chunk Store, im CSR-Format:
+#   term_offsets.npy  - int64, Postings des Terms t liegen in [offsets[t], offsets[t+1])
+#   doc_ids.npy       - uint32, Dokumentnummern (aufsteigend je Term)
+#   impacts.npy       - float32, vorberechneter BM25-Anteil tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))
+#   vocab.json        - Term -> Termnummer
+#   chunk_ids.json    - Dokumentnummer -> Chunk-ID (wie in ChromaDB)
+#   field_<feld>.npy  - uint32, Wertnummer je Dokument für die Filterfelder (source_file, chunk_type, title)
+#   field_values.json - Feld -> Liste der Werte (Wertnummer = Position)
+#   meta.json         - Anzahl Dokumente, avgdl, k1, b
+# Die Arrays werden per mmap geöffnet. Eine Anfrage liest nur die Postings ihrer
+# Terms und summiert idf * impact vektorisiert – ohne Python-Schleife über Dokumente.
+
+_TOKEN_RE = re.compile(r"\w+")
+# Sehr häufige englische Wörter: tragen kaum zum Ranking bei, hätten aber die längsten Postings
+STOPWORDS = frozenset("""a an and are as at be by for from has have in is it its of on or that the
+this to was were which with""".split())
+MISSING_VALUE = np.iinfo(np.uint32).max # Wertnummer für Chunks ohne das Metadatenfeld
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _iter_store_chunks(store_path):
+    conn = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+    try:
+        for chunk_id, text, metadata in conn.execute("SELECT id, text, metadata FROM chunks ORDER BY id"):
+            yield chunk_id, text, json.loads(metadata)
+    finally:
+        conn.close()
+
+
+def build_index(store_path=chunk_store_path, directory=lexical_index_directory, k1=bm25_k1, b=bm25_b):
+    """ Baut den Index komplett aus dem Chunk Store neu und ersetzt den alten. Gibt die Anzahl Chunks zurück. """
+    start_time = time.time()
+    vocab = {}
+    chunk_ids = []
+    doc_lengths = array('I')
+    posting_terms, posting_docs, posting_tfs = array('I'), array('I'), array('H')
+    field_values = {field: {} for field in filter_fields}
+    field_codes = {field: array('I') for field in filter_fields}
+    for chunk_id, text, metadata in _iter_store_chunks(store_path):
+        doc = len(chunk_ids)
+        chunk_ids.append(chunk_id)
+        for field in filter_fields:
+            value = metadata.get(field)
+            values = field_values[field]
+            field_codes[field].append(MISSING_VALUE if value is None else values.setdefault(str(value), len(values)))
+        tokens = tokenize(text)
+        doc_lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            term = vocab.setdefault(token, len(vocab))
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            posting_terms.append(term)
+            posting_docs.append(doc)
+            posting_tfs.append(min(tf, 65535))
+
+    num_docs = len(chunk_ids)
+    lengths = np.frombuffer(doc_lengths, dtype=np.uint32).astype(np.float32)
+    avgdl = float(lengths.mean()) if num_docs else 0.0
+    terms = np.frombuffer(posting_terms, dtype=np.uint32)
+    docs = np.frombuffer(posting_docs, dtype=np.uint32)
+    tfs = np.frombuffer(posting_tfs, dtype=np.uint16).astype(np.float32)
+
+    # Nach Term sortieren (stabil -> Dokumentnummern bleiben je Term aufsteigend)
+    order = np.argsort(terms, kind='stable')
+    docs = docs[order]
+    tfs = tfs[order]
+    norms = k1 * (1 - b + b * lengths[docs] / (avgdl or 1.0))
+    impacts = (tfs * (k1 + 1) / (tfs + norms)).astype(np.float32)
+    term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=len(vocab)), out=term_offsets[1:])
+
+    # In ein temporäres Verzeichnis schreiben und dann austauschen
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    np.save(os.path.join(tmp_directory, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(tmp_directory, "doc_ids.npy"), docs)
+    np.save(os.path.join(tmp_directory, "impacts.npy"), impacts)
+    with open(os.path.join(tmp_directory, "vocab.json"), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(tmp_directory, "chunk_ids.json"), 'w', encoding='utf-8') as f:
+        json.dump(chunk_ids, f, ensure_ascii=False)
+    for field in filter_fields:
+        np.save(os.path.join(tmp_directory, f"field_{field}.npy"), np.frombuffer(field_codes[field], dtype=np.uint32))
+    with open(os.path.join(tmp_directory, "field_values.json"), 'w', encoding='utf-8') as f:
+        json.dump({field: list(values) for field, values in field_values.items()}, f, ensure_ascii=False)
+    with open(os.path.join(tmp_directory, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"num_docs": num_docs, "avgdl": avgdl, "k1": k1, "b": b, "built_at": time.time()}, f)
+    old_directory = f"{directory}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    print(f"Lexical index: {num_docs} chunks, {len(vocab)} terms, {len(docs)} postings "
+          f"built in {time.time() - start_time:.2f}s.")
+    return num_docs
+
+
+class LexicalIndex:
+    def __init__(self, directory=lexical_index_directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "vocab.json"), 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(directory, "chunk_ids.json"), 'r', encoding='utf-8') as f:
+            self.chunk_ids = json.load(f)
+        self.term_offsets = np.load(os.path.join(directory, "term_offsets.npy"), mmap_mode='r')
+        self.doc_ids = np.load(os.path.join(directory, "doc_ids.npy"), mmap_mode='r')
+        self.impacts = np.load(os.path.join(directory, "impacts.npy"), mmap_mode='r')
+        self.num_docs = self.meta["num_docs"]
+        self.field_values, self.field_codes = {}, {}
+        values_path = os.path.join(directory, "field_values.json")
+        if os.path.exists(values_path): # Indizes von vor den Filtern haben keine Felder
+            with open(values_path, 'r', encoding='utf-8') as f:
+                self.field_values = {field: {value: code for code, value in enumerate(values)}
+                                     for field, values in json.load(f).items()}
+            self.field_codes = {field: np.load(os.path.join(directory, f"field_{field}.npy"), mmap_mode='r')
+                                for field in self.field_values}
+
+    def allowed_docs(self, where):
+        """ Bool-Maske über alle Dokumente für eine where-Klausel (None = kein Filter). """
+        if not where:
+            return None
+        mask = np.ones(self.num_docs, dtype=bool)
+        for field, values in parse_where(where).items():
+            if field not in self.field_codes:
+                print(f"Warning: Lexical index has no '{field}' field; rebuild it with `python lexical_index.py`.")
+                return np.zeros(self.num_docs, dtype=bool)
+            codes = [self.field_values[field][value] for value in values if value in self.field_values[field]]
+            mask &= np.isin(self.field_codes[field], codes)
+        return mask
+
+    def _postings(self, term):
+        start, end = int(self.term_offsets[term]), int(self.term_offsets[term + 1])
+        df = end - start
+        idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+        return self.doc_ids[start:end], self.impacts[start:end], np.float32(idf)
+
+    def search(self, query, k, where=None):
+        """ Top-k Chunks nach BM25. Gibt eine Liste (chunk_id, score) zurück, bester Treffer zuerst.
+
+        Häufige Terms (siehe common_term_fraction) erzeugen keine eigenen Kandidaten, sofern
+        die Anfrage auch seltenere Terms enthält: Ihre Postings werden nur per Binärsuche für
+        die Kandidaten gelesen. Das hält Anfragen auch bei Millionen Chunks im Millisekundenbereich.
+        where (siehe metadata_filter.py) entfernt nicht passende Kandidaten vor dem Scoring
+        der häufigen Terms.
+        """
+        terms = {self.vocab[token] for token in tokenize(query) if token in self.vocab}
+        if not terms or not self.num_docs:
+            return []
+        mask = self.allowed_docs(where)
+        df = {term: int(self.term_offsets[term + 1] - self.term_offsets[term]) for term in terms}
+        max_df = common_term_fraction * self.num_docs
+        rare = [term for term in terms if df[term] <= max_df]
+        if not rare:
+            return self._search_dense(terms, k, mask)
+        common = [term for term in terms if term not in rare]
+
+        docs, weights = [], []
+        for term in rare:
+            term_docs, impacts, idf = self._postings(term)
+            docs.append(term_docs)
+            weights.append(impacts * idf)
+        if len(docs) == 1:
+            candidates, scores = np.asarray(docs[0]), weights[0].astype(np.float64)
+        else:
+            # Scores pro Dokument summieren (nur über Dokumente, die einen Query-Term enthalten)
+            candidates, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(weights))
+        if mask is not None:
+            keep = mask[candidates]
+            candidates, scores = candidates[keep], scores[keep]
+        for term in common:
+            term_docs, impacts, idf = self._postings(term)
+            positions = np.minimum(np.searchsorted(term_docs, candidates), len(term_docs) - 1)
+            found = term_docs[positions] == candidates
+            scores[found] += impacts[positions[found]] * idf
+
+        return self._top_k(candidates, scores, k)
+
+    def _search_dense(self, terms, k, mask=None):
+        """ Nur häufige Terms: Scores direkt in einem Array über alle Dokumente aufaddieren. """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in terms:
+            term_docs, impacts, idf = self._postings(term)
+            scores[term_docs] += impacts * idf # Dokumentnummern sind je Term eindeutig
+        if mask is not None:
+            scores[~mask] = 0 # _top_k liefert nur Scores > 0
+        return self._top_k(np.arange(self.num_docs), scores, k)
+
+    def _top_k(self, candidates, scores, k):
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.chunk_ids[int(candidates[i])], float(scores[i])) for i in top if scores[i] > 0]
+
+
+# --- Gemeinsamer Lese-Zugriff (wird neu geladen, wenn parse_xml.py den Index neu gebaut hat) ---
+_default_index = None
+_default_index_mtime = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """ Gibt den aktuellen Index zurück oder None, falls (noch) keiner gebaut wurde. """
+    global _default_index, _default_index_mtime
+    try:
+        mtime = os.stat(os.path.join(lexical_index_directory, "meta.json")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _default_index_lock:
+        if _default_index is None or mtime != _default_index_mtime:
+            try:
+                _default_index = LexicalIndex(lexical_index_directory)
+                _default_index_mtime = mtime
+            except (OSError, ValueError) as e: # z.B. gerade im Austausch
+                print(f"Warning: Could not load lexical index: {e}")
+        return _default_index
+
+
+def reciprocal_rank_fusion(rankings, k=rrf_k, limit=None):
+    """ Führt mehrere Rankings (Listen von IDs, bester zuerst) zusammen. Gibt [(id, score)] zurück. """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:limit] if limit else fused
+
+
+if __name__ == '__main__':
+    print(f"Rebuilding lexical index '{lexical_index_directory}' from '{chunk_store_path}'...")
+    if not os.path.exists(chunk_store_path):
+        print(f"Error: Chunk store '{chunk_store_path}' not found. Run parse_xml.py (or chunk_store.py) first.")
+        exit()
+    build_index()
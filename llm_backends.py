@@ -0,0 +1,466 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import httpx
+
+# --- Konfiguration ---
+llm_timeout_seconds = 60 # Pro Versuch (beim Streaming: maximale Pause zwischen zwei Teilen)
+llm_connect_timeout = 10
+llm_max_retries = 2 # Zusätzliche Versuche bei vorübergehenden Fehlern (Timeout, Verbindungsfehler, 429, 5xx)
+llm_retry_base_delay = 0.5 # Sekunden; Wartezeit zufällig aus [0, base * 2^Versuch] ("Full Jitter")
+llm_retry_max_delay = 8
+rate_limit_cooldown = 30 # Sekunden, die ein Backend nach einem 429 in einer Failover-Kette übersprungen wird
+queue_timeout = 30 # So lange wartet eine Anfrage auf einen freien Slot (beim letzten Backend der Kette)
+http_max_connections = 32 # Gemeinsamer Connection-Pool pro Basis-URL und Prozess
+# Gleichzeitige Anfragen pro Backend und Prozess (lokales Ollama verkraftet meist nur wenige)
+default_max_concurrency = {"gemini": 16, "ollama": 2, "openai": 16, "stub": 64}
+ollama_model_name = "llama3:8b"
+ollama_base_url = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Jeder Server mit OpenAI-kompatibler Chat-API (OpenAI, vLLM, llama.cpp-Server, LM Studio, ...)
+openai_model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+openai_base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# --------------------
+
+# Gemeinsame Schnittstelle für die Generation:
+#   backend.generate(prompt) -> str            (blockierend, z.B. app.py / batch_query.py)
+#   async for text in backend.stream(prompt)   (asynchron, asgi_app.py)
+# Jedes Backend begrenzt seine gleichzeitigen Anfragen mit einem Semaphor, bricht nach
+# llm_timeout_seconds ab und wiederholt vorübergehende Fehler mit exponentiellem Backoff
+# und Jitter. Ollama und OpenAI-kompatible Server laufen über gemeinsame httpx-Clients
+# (Keep-Alive-Verbindungen werden wiederverwendet); Gemini nutzt den Client des SDK.
+# build_llm(["gemini", "ollama"]) liefert eine FailoverBackend-Kette: Ist das erste Backend
+# ausgelastet, im Cooldown nach einem 429 oder schlägt es fehl, übernimmt das nächste.
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Gemini finish_reason-Werte, bei denen die Antwort gefiltert wurde (STOP/MAX_TOKENS sind normale Enden)
+BLOCKED_FINISH_REASONS = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+
+
+class LLMError(Exception):
+    """ Generation fehlgeschlagen. retryable: vorübergehend (Retry bzw. Failover sinnvoll). """
+
+    def __init__(self, message, retryable=False, rate_limited=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.rate_limited = rate_limited
+
+
+class BackendSaturated(LLMError):
+    """ Alle Slots des Backends sind belegt. """
+
+    def __init__(self, message):
+        super().__init__(message, retryable=True)
+
+
+class ContentBlocked(LLMError):
+    """ Antwort vom Sicherheitsfilter blockiert; kein Retry und kein Failover. """
+
+
+def classify_error(error):
+    """ Übersetzt Ausnahmen von httpx bzw. den SDKs in LLMError (vorübergehend oder nicht). """
+    if isinstance(error, LLMError):
+        return error
+    if isinstance(error, (httpx.TimeoutException, TimeoutError, asyncio.TimeoutError)):
+        return LLMError(f"Timeout: {error}", retryable=True)
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    else:
+        status = getattr(error, "code", None) # google.api_core.exceptions: HTTP-Status
+    if isinstance(status, int):
+        return LLMError(f"HTTP {status}: {error}", retryable=status in RETRYABLE_STATUS, rate_limited=status == 429)
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return LLMError(f"Connection error: {error}", retryable=True)
+    return LLMError(str(error) or type(error).__name__)
+
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(llm_retry_max_delay, llm_retry_base_delay * 2 ** attempt))
+
+
+# --- Gemeinsame HTTP-Clients (pro Prozess; nach einem fork werden neue angelegt) ---
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+
+def _client_options(base_url):
+    return {
+        "base_url": base_url,
+        "timeout": httpx.Timeout(llm_timeout_seconds, connect=llm_connect_timeout),
+        "limits": httpx.Limits(max_connections=http_max_connections, max_keepalive_connections=http_max_connections),
+    }
+
+
+def http_client(base_url):
+    """ Gemeinsamer httpx.Client (Connection-Pool) für eine Basis-URL. """
+    key = (os.getpid(), base_url)
+    with _http_clients_lock:
+        if key not in _http_clients:
+            _http_clients[key] = httpx.Client(**_client_options(base_url))
+        return _http_clients[key]
+
+
+def async_http_client(base_url):
+    """ Gemeinsamer httpx.AsyncClient für eine Basis-URL und den laufenden Event Loop. """
+    key = (os.getpid(), base_url, id(asyncio.get_running_loop()))
+    with _http_clients_lock:
+        if key not in _http_clients:
+            _http_clients[key] = httpx.AsyncClient(**_client_options(base_url))
+        return _http_clients[key]
+
+
+async def _acquire_async(semaphore, wait):
+    """ Wie semaphore.acquire(timeout=wait), ohne den Event Loop zu blockieren.
+
+    Ist kein Slot frei, wartet ein Executor-Thread auf den (mit generate() geteilten)
+    threading-Semaphor. Wird die Coroutine dabei abgebrochen, gibt ein Callback den
+    Slot zurück, falls der Thread ihn danach noch bekommt.
+    """
+    if semaphore.acquire(blocking=False):
+        return True
+    if wait <= 0:
+        return False
+    future = asyncio.get_running_loop().run_in_executor(None, semaphore.acquire, True, wait)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        def release_if_acquired(done):
+            if not done.cancelled() and done.exception() is None and done.result():
+                semaphore.release()
+        future.add_done_callback(release_if_acquired)
+        raise
+
+
+class LLMBackend:
+    """ Basisklasse: Slots, Timeouts, Retries und Zähler. Adapter implementieren _generate/_stream. """
+    name = "base"
+
+    def __init__(self, max_concurrency=None, timeout=llm_timeout_seconds, max_retries=llm_max_retries):
+        self.max_concurrency = max_concurrency or default_max_concurrency.get(self.name, 8)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._cooldown_until = 0.0
+        self._stats_lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "in_flight": 0}
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    async def _stream(self, prompt):
+        raise NotImplementedError
+        yield # Async-Generator
+
+    def _count(self, counter, delta=1):
+        with self._stats_lock:
+            self.counters[counter] += delta
+
+    def available(self):
+        """ False, solange das Backend nach einem 429 pausiert. """
+        return time.monotonic() >= self._cooldown_until
+
+    def _failed(self, error, attempt, retry_rate_limited):
+        """ Zählt den Fehler und entscheidet, ob ein weiterer Versuch folgt. """
+        self._count("failures")
+        if error.rate_limited:
+            self._cooldown_until = time.monotonic() + rate_limit_cooldown
+        print(f"Warning: LLM backend '{self.name}' failed (attempt {attempt + 1}): {error}")
+        return (error.retryable and attempt < self.max_retries
+                and (retry_rate_limited or not error.rate_limited))
+
+    def generate(self, prompt, wait=queue_timeout, retry_rate_limited=True):
+        """ Generiert eine Antwort (blockierend). Wartet höchstens wait Sekunden auf einen freien Slot. """
+        if not self._slots.acquire(timeout=wait):
+            self._count("rejected")
+            raise BackendSaturated(f"{self.name}: all {self.max_concurrency} slots busy")
+        self._count("in_flight")
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._count("calls")
+                try:
+                    return self._generate(prompt)
+                except Exception as e:
+                    error = classify_error(e)
+                if not self._failed(error, attempt, retry_rate_limited):
+                    raise error
+                self._count("retries")
+                time.sleep(backoff_delay(attempt))
+        finally:
+            self._count("in_flight", -1)
+            self._slots.release()
+
+    async def stream(self, prompt, wait=queue_timeout, retry_rate_limited=True):
+        """ Liefert die Antwort in Teilen. Wiederholt wird nur, solange noch kein Text geliefert wurde. """
+        if not await _acquire_async(self._slots, wait):
+            self._count("rejected")
+            raise BackendSaturated(f"{self.name}: all {self.max_concurrency} slots busy")
+        self._count("in_flight")
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._count("calls")
+                started = False
+                try:
+                    async for text in self._stream(prompt):
+                        started = True
+                        yield text
+                    return
+                except Exception as e:
+                    error = classify_error(e)
+                if started or not self._failed(error, attempt, retry_rate_limited):
+                    raise error
+                self._count("retries")
+                await asyncio.sleep(backoff_delay(attempt))
+        finally:
+            self._count("in_flight", -1)
+            self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self.counters)
+        return {"backend": self.name, "max_concurrency": self.max_concurrency,
+                "cooling_down": not self.available(), **counters}
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name, api_key, safety_settings=None, **kwargs):
+        super().__init__(**kwargs)
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.safety_settings = safety_settings
+
+    @staticmethod
+    def _block_reason(response):
+        """ Grund, falls Prompt oder Antwort blockiert wurden, sonst None. """
+        feedback = getattr(response, "prompt_feedback", None)
+        if feedback is not None and getattr(feedback, "block_reason", None):
+            return f"prompt blocked ({getattr(feedback.block_reason, 'name', feedback.block_reason)})"
+        for candidate in getattr(response, "candidates", None) or []:
+            reason = getattr(candidate.finish_reason, "name", str(candidate.finish_reason))
+            if reason in BLOCKED_FINISH_REASONS:
+                return f"response blocked ({reason})"
+        return None
+
+    @classmethod
+    def _text(cls, response):
+        block_reason = cls._block_reason(response)
+        if block_reason:
+            print(f"Warning: Gemini {block_reason}. Feedback: {response.prompt_feedback}")
+            raise ContentBlocked(f"Gemini {block_reason}")
+        try:
+            return response.text
+        except ValueError:
+            return "" # Teil ohne Text, z.B. der letzte Chunk eines Streams (nur finish_reason)
+
+    def _generate(self, prompt):
+        response = self.model.generate_content(prompt, safety_settings=self.safety_settings,
+                                               request_options={"timeout": self.timeout})
+        text = self._text(response).strip()
+        if not text:
+            raise LLMError("Gemini returned an empty response")
+        return text
+
+    async def _stream(self, prompt):
+        response = await self.model.generate_content_async(prompt, safety_settings=self.safety_settings, stream=True,
+                                                           request_options={"timeout": self.timeout})
+        async for chunk in response:
+            text = self._text(chunk)
+            if text:
+                yield text
+
+
+class OllamaBackend(LLMBackend):
+    name = "ollama"
+
+    def __init__(self, model_name=ollama_model_name, base_url=ollama_base_url, options=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self.base_url = base_url
+        self.options = options or {} # z.B. {"temperature": 0.2, "num_predict": 150}
+
+    def _payload(self, prompt, stream):
+        return {"model": self.model_name, "messages": [{"role": "user", "content": prompt}],
+                "stream": stream, "options": self.options}
+
+    def list_models(self):
+        """ Namen der lokal verfügbaren Modelle (GET /api/tags). """
+        response = http_client(self.base_url).get("/api/tags", timeout=llm_connect_timeout)
+        response.raise_for_status()
+        return [model["name"] for model in response.json().get("models", [])]
+
+    def _generate(self, prompt):
+        response = http_client(self.base_url).post("/api/chat", json=self._payload(prompt, False), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["message"]["content"].strip()
+
+    async def _stream(self, prompt):
+        async with async_http_client(self.base_url).stream("POST", "/api/chat", json=self._payload(prompt, True),
+                                                           timeout=self.timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines(): # NDJSON, eine Zeile pro Teil
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise LLMError(f"Ollama: {data['error']}")
+                text = data.get("message", {}).get("content", "")
+                if text:
+                    yield text
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, model_name=openai_model_name, base_url=openai_base_url, api_key=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self.base_url = base_url
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _payload(self, prompt, stream):
+        return {"model": self.model_name, "messages": [{"role": "user", "content": prompt}], "stream": stream}
+
+    def _generate(self, prompt):
+        response = http_client(self.base_url).post("/chat/completions", json=self._payload(prompt, False),
+                                                   headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+        return (response.json()["choices"][0]["message"]["content"] or "").strip()
+
+    async def _stream(self, prompt):
+        async with async_http_client(self.base_url).stream("POST", "/chat/completions", json=self._payload(prompt, True),
+                                                           headers=self.headers, timeout=self.timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines(): # Server-Sent Events: "data: {...}"
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                text = choices[0].get("delta", {}).get("content")
+                if text:
+                    yield text
+
+
+class StubBackend(LLMBackend):
+    """ Offline-Backend für Tests: deterministische Antwort, optional mit Latenz und simulierten Fehlern. """
+    name = "stub"
+
+    def __init__(self, answer=None, delay=0.0, fail_times=0, rate_limited=False, **kwargs):
+        super().__init__(**kwargs)
+        self.answer = answer
+        self.delay = delay
+        self.fail_times = fail_times # So viele Aufrufe schlagen zuerst (vorübergehend) fehl
+        self.rate_limited = rate_limited # Fehler als 429 melden
+        self._fail_lock = threading.Lock()
+
+    def _reply(self, prompt):
+        with self._fail_lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise LLMError("Simulated failure", retryable=True, rate_limited=self.rate_limited)
+        return self.answer or f"Stub-Antwort auf einen Prompt mit {len(prompt)} Zeichen."
+
+    def _generate(self, prompt):
+        time.sleep(self.delay)
+        return self._reply(prompt)
+
+    async def _stream(self, prompt):
+        words = self._reply(prompt).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.delay / len(words))
+            yield word if i == 0 else " " + word
+
+
+class FailoverBackend:
+    """ Kette von Backends mit derselben Schnittstelle wie ein einzelnes Backend.
+
+    Ein Backend wird übersprungen, wenn alle Slots belegt sind (es wird nicht gewartet) oder
+    es nach einem 429 pausiert; schlägt es fehl, übernimmt das nächste. Nur das letzte Backend
+    wartet auf einen freien Slot und wiederholt auch nach einem 429. Blockierte Antworten
+    (ContentBlocked) werden nicht an andere Backends weitergereicht.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.name = "+".join(backend.name for backend in backends)
+        self._stats_lock = threading.Lock()
+        self.failovers = 0
+
+    def available(self):
+        return any(backend.available() for backend in self.backends)
+
+    def _candidates(self):
+        # Backends im Cooldown ans Ende, die Reihenfolge bleibt ansonsten erhalten
+        return ([backend for backend in self.backends if backend.available()]
+                + [backend for backend in self.backends if not backend.available()])
+
+    def _failover(self, backend, error):
+        print(f"Warning: Failing over from LLM backend '{backend.name}': {error}")
+        with self._stats_lock:
+            self.failovers += 1
+
+    def generate(self, prompt, wait=queue_timeout, retry_rate_limited=True):
+        candidates = self._candidates()
+        for i, backend in enumerate(candidates):
+            last = i == len(candidates) - 1
+            try:
+                return backend.generate(prompt, wait=wait if last else 0,
+                                        retry_rate_limited=last and retry_rate_limited)
+            except ContentBlocked:
+                raise
+            except LLMError as e:
+                if last:
+                    raise
+                self._failover(backend, e)
+
+    async def stream(self, prompt, wait=queue_timeout, retry_rate_limited=True):
+        candidates = self._candidates()
+        for i, backend in enumerate(candidates):
+            last = i == len(candidates) - 1
+            started = False
+            try:
+                async for text in backend.stream(prompt, wait=wait if last else 0,
+                                                 retry_rate_limited=last and retry_rate_limited):
+                    started = True
+                    yield text
+                return
+            except ContentBlocked:
+                raise
+            except LLMError as e:
+                if last or started:
+                    raise
+                self._failover(backend, e)
+
+    def stats(self):
+        return {"backend": self.name, "failovers": self.failovers,
+                "backends": [backend.stats() for backend in self.backends]}
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "ollama": OllamaBackend,
+    "openai": OpenAICompatibleBackend,
+    "stub": StubBackend,
+}
+
+
+def build_llm(chain, **options):
+    """ Baut ein Backend bzw. eine Failover-Kette aus Namen, z.B. build_llm(["gemini", "ollama"]).
+
+    options[name] sind die Konstruktor-Argumente des jeweiligen Backends.
+    """
+    if not chain:
+        raise ValueError("No LLM backend configured")
+    backends = []
+    for name in chain:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown LLM backend '{name}' (available: {', '.join(BACKENDS)})")
+        backends.append(BACKENDS[name](**options.get(name, {})))
+    return backends[0] if len(backends) == 1 else FailoverBackend(backends)
@@ -0,0 +1,121 @@
+import json
+
+# --- Konfiguration ---
+filter_fields = ("source_file", "chunk_type", "title") # Metadatenfelder, nach denen gefiltert werden kann
+# --------------------
+
+# Filter werden überall als ChromaDB-where-Klauseln weitergereicht, z.B.
+#   {"source_file": "paper.pdf"}
+#   {"$and": [{"source_file": {"$in": ["a.pdf", "b.pdf"]}}, {"chunk_type": "abstract"}]}
+# ChromaDB wertet sie selbst aus (Vorfilterung über den eigenen Metadaten-Index).
+# Der numpy-Vektorindex und der BM25-Index übersetzen sie mit parse_where() in
+# {Feld: erlaubte Werte} und schlagen die passenden Zeilen in ihrem Sekundärindex nach,
+# sodass nur die gefilterte Teilmenge bewertet wird.
+# Von außen kommende Klauseln bringt normalize_where() in die Form, die ChromaDB verlangt
+# (genau ein Schlüssel pro Ebene, mindestens zwei Klauseln unter $and).
+
+
+def _as_list(values):
+    """ Akzeptiert None, einen komma-getrennten String oder eine Liste. """
+    if values is None:
+        return []
+    if isinstance(values, str):
+        values = values.split(",")
+    return [str(value).strip() for value in values if str(value).strip()]
+
+
+def build_where(source_files=None, chunk_types=None):
+    """ Baut eine where-Klausel aus Listen erlaubter Werte. Gibt None zurück, wenn nichts gefiltert wird. """
+    clauses = []
+    for field, values in (("source_file", source_files), ("chunk_type", chunk_types)):
+        values = sorted(set(_as_list(values)))
+        if len(values) == 1:
+            clauses.append({field: values[0]})
+        elif values:
+            clauses.append({field: {"$in": values}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def parse_where(where):
+    """ Übersetzt eine where-Klausel in {Feld: Menge erlaubter Werte}.
+
+    Unterstützt Gleichheit, $eq, $in und $and über die Felder in filter_fields;
+    alles andere löst einen ValueError aus.
+    """
+    allowed = {}
+
+    def add(field, values):
+        if field not in filter_fields:
+            raise ValueError(f"Unsupported filter field '{field}' (allowed: {', '.join(filter_fields)})")
+        values = {str(value) for value in values}
+        allowed[field] = allowed[field] & values if field in allowed else values
+
+    def visit(clause):
+        if not isinstance(clause, dict) or not clause:
+            raise ValueError(f"Invalid where clause: {clause!r}")
+        for key, value in clause.items():
+            if key == "$and":
+                if not isinstance(value, list):
+                    raise ValueError("'$and' expects a list of clauses")
+                for sub_clause in value:
+                    visit(sub_clause)
+            elif isinstance(value, dict):
+                for operator, operand in value.items():
+                    if operator == "$eq":
+                        add(key, [operand])
+                    elif operator == "$in" and isinstance(operand, list):
+                        add(key, operand)
+                    else:
+                        raise ValueError(f"Unsupported filter operator '{operator}'")
+            elif isinstance(value, (str, int, float, bool)):
+                add(key, [value])
+            else:
+                raise ValueError(f"Invalid value for '{key}': {value!r}")
+
+    if where:
+        visit(where)
+    return allowed
+
+
+def _flatten(clause):
+    """ Zerlegt eine (geprüfte) Klausel in eine Liste von Klauseln mit je einem Feld. """
+    clauses = []
+    for key, value in clause.items():
+        if key == "$and":
+            for sub_clause in value:
+                clauses.extend(_flatten(sub_clause))
+        else:
+            clauses.append({key: value})
+    return clauses
+
+
+def normalize_where(where):
+    """ Prüft eine where-Klausel und bringt sie in die von ChromaDB akzeptierte Form.
+
+    Mehrere Felder auf einer Ebene werden in $and gepackt, verschachtelte $and flachgeklopft
+    und ein $and mit nur einer Klausel ausgepackt. Ein leeres $and löst einen ValueError aus.
+    """
+    parse_where(where)
+    clauses = _flatten(where)
+    if not clauses:
+        raise ValueError("'$and' needs at least one clause")
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def where_from_payload(payload):
+    """ Liest den Filter aus einem JSON-Body bzw. Formular-Dict.
+
+    Entweder "where" (ChromaDB-Klausel, wird geprüft und normalisiert) oder "source_files"/"chunk_types"
+    (Listen oder komma-getrennte Strings). Ungültige Filter lösen einen ValueError aus.
+    """
+    where = payload.get("where")
+    if where:
+        return normalize_where(where)
+    return build_where(payload.get("source_files"), payload.get("chunk_types"))
+
+
+def scope_key(where):
+    """ Stabiler Schlüssel für Caches: gleiche Filter -> gleicher String, kein Filter -> "". """
+    return json.dumps(where, sort_keys=True, ensure_ascii=False) if where else ""
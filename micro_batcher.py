@@ -0,0 +1,180 @@
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+# --- Konfiguration ---
+batch_window_ms = 5 # So lange wird nach der ersten wartenden Frage auf weitere gewartet
+max_batch_size = 32 # Spätestens bei so vielen Fragen wird sofort encodiert
+stats_window = 2048 # Anzahl der letzten Messwerte für die Perzentile in stats()
+# --------------------
+
+# Unter Last kommen viele Fragen gleichzeitig an, und jede würde einzeln (Batch-Größe 1)
+# durch das Embedding-Modell laufen; die Forward-Passes konkurrieren dann um dieselben
+# CPU-Kerne. MicroBatcher sammelt stattdessen alle Fragen, die innerhalb von
+# batch_window_ms nach der ersten eintreffen (höchstens max_batch_size), encodiert sie in
+# einem einzigen Aufruf und verteilt die Zeilen über Futures an die wartenden Threads.
+# Bei wenig Last wird nicht gewartet; sobald sich Fragen stauen, wartet keine länger als
+# batch_window_ms über den laufenden Batch hinaus.
+
+
+class MicroBatcher:
+    """ Bündelt gleichzeitige encode-Aufrufe einzelner Texte zu Batches (ein Hintergrund-Thread). """
+
+    def __init__(self, encode_fn, window_ms=batch_window_ms, max_batch=max_batch_size):
+        self.encode_fn = encode_fn # list[str] -> Array (n, dim)
+        self.window_seconds = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._last_batch_size = 0
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._queue_wait = deque(maxlen=stats_window) # Sekunden von submit() bis Batch-Start, pro Text
+        self._compute = deque(maxlen=stats_window) # Sekunden pro encode_fn-Aufruf
+
+    def _ensure_started(self):
+        # Thread erst beim ersten Aufruf starten (z.B. erst im Worker nach dem fork)
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text):
+        """ Reiht einen Text ein; das Future liefert später seinen Embedding-Vektor. """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def __call__(self, texts):
+        """ Gleiche Schnittstelle wie model.encode(list) (z.B. für EmbeddingCache.encode). """
+        futures = [self.submit(text) for text in texts]
+        return np.stack([future.result() for future in futures])
+
+    def _collect(self):
+        """ Blockiert bis zur ersten Anfrage und sammelt dann bis Fenster-Ende bzw. max_batch.
+
+        Das Fenster zählt ab dem Eintreffen der ersten Frage: Wer schon während des letzten
+        Batches gewartet hat, wartet nicht noch einmal. Bei wenig Last (letzter Batch mit nur
+        einer Frage, nichts weiter in der Warteschlange) wird sofort encodiert.
+        """
+        batch = [self._queue.get()]
+        if self._last_batch_size <= 1 and self._queue.empty():
+            return batch
+        deadline = batch[0][2] + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Nach Fenster-Ende nur noch mitnehmen, was bereits wartet
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._last_batch_size = len(batch)
+            start_compute = time.perf_counter()
+            try:
+                vectors = self.encode_fn([text for text, _, _ in batch])
+                failed = None
+            except Exception as e:
+                failed = e
+            compute_seconds = time.perf_counter() - start_compute
+
+            for i, (_, future, _) in enumerate(batch):
+                if failed is not None:
+                    future.set_exception(failed)
+                else:
+                    future.set_result(vectors[i])
+            with self._stats_lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.failed_batches += failed is not None
+                self._batch_sizes.append(len(batch))
+                self._queue_wait.extend(start_compute - submitted for _, _, submitted in batch)
+                self._compute.append(compute_seconds)
+
+    def stats(self):
+        with self._stats_lock:
+            batch_sizes = np.array(self._batch_sizes)
+            queue_wait = np.array(self._queue_wait) * 1000
+            compute = np.array(self._compute) * 1000
+
+        def summary(values):
+            if not len(values):
+                return None
+            return {"mean": round(float(values.mean()), 3), "p50": round(float(np.percentile(values, 50)), 3),
+                    "p99": round(float(np.percentile(values, 99)), 3)}
+
+        return {
+            "window_ms": self.window_seconds * 1000,
+            "max_batch_size": self.max_batch,
+            "requests": self.requests,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "mean_batch_size": round(float(batch_sizes.mean()), 2) if len(batch_sizes) else None,
+            "queue_wait_ms": summary(queue_wait),
+            "compute_ms": summary(compute),
+        }
+
+
+def benchmark(encode_fn, texts, concurrency, window_ms, max_batch):
+    """ Encodiert texts mit concurrency Threads einzeln bzw. über den MicroBatcher. """
+    results = {}
+    batcher = MicroBatcher(encode_fn, window_ms, max_batch)
+    for name, single in (("direct", lambda text: encode_fn([text])[0]),
+                         ("batched", lambda text: batcher([text])[0])):
+        latencies = []
+
+        def timed(text):
+            start = time.perf_counter()
+            single(text)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, texts))
+        seconds = time.perf_counter() - start
+        latencies = np.array(latencies) * 1000
+        results[name] = {"queries_per_second": round(len(texts) / seconds, 1),
+                         "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                         "p99_ms": round(float(np.percentile(latencies, 99)), 2)}
+    results["batcher"] = batcher.stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vergleicht Einzel-Encoding mit Micro-Batching bei parallelen Fragen.")
+    parser.add_argument("--model", default='all-MiniLM-L6-v2', help="SentenceTransformer-Modell")
+    parser.add_argument("--queries", type=int, default=2000, help="Anzahl synthetischer Fragen")
+    parser.add_argument("--concurrency", type=int, default=32, help="Gleichzeitige Anfragen (Threads)")
+    parser.add_argument("--window-ms", type=float, default=batch_window_ms)
+    parser.add_argument("--max-batch", type=int, default=max_batch_size)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    encode_fn = lambda texts: model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+    texts = [f"What is the effect of compound {i} on protein kinase {i % 97} activity?" for i in range(args.queries)]
+    encode_fn(texts[:8]) # Warm-up
+
+    results = benchmark(encode_fn, texts, args.concurrency, args.window_ms, args.max_batch)
+    for name in ("direct", "batched"):
+        print(f"{name:8s} {results[name]['queries_per_second']:8.1f} q/s   "
+              f"p50 {results[name]['p50_ms']:7.2f} ms   p99 {results[name]['p99_ms']:7.2f} ms")
+    print(f"Batcher: {results['batcher']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import time
+import argparse
+import threading
+import numpy as np
+
+# --- Konfiguration ---
+model_name = 'all-MiniLM-L6-v2'
+onnx_model_directory = "onnx_models" # Exportierte Modelle, ein Unterordner pro Modell
+onnx_quantized = True # int8-Modell (quantize_dynamic) statt float32 verwenden, falls exportiert
+onnx_threads = 0 # Threads pro ONNX-Session (0: ONNX Runtime entscheidet)
+onnx_batch_size = 64
+parity_threshold = 0.99 # Mindest-Kosinus-Ähnlichkeit zu den PyTorch-Embeddings (--compare)
+# --------------------
+
+# Alternative zum SentenceTransformer-Stack (PyTorch) für CPU-Knoten:
+#   python onnx_encoder.py           -> Export nach onnx_models/<Modell>/ (model.onnx + model.int8.onnx)
+#   python onnx_encoder.py --compare -> Parität (Kosinus >= parity_threshold) und CPU-Latenz/Durchsatz
+# Nur der Export braucht torch/sentence_transformers. OnnxEncoder selbst lädt lediglich den
+# Tokenizer (tokenizers) und das Modell (onnxruntime) und bildet Pooling und Normalisierung
+# des SentenceTransformers in numpy nach. encode() und get_sentence_embedding_dimension()
+# haben dieselbe Schnittstelle wie beim SentenceTransformer, sodass app.py und
+# embed_chunks.py das Backend nur austauschen müssen (encoder_backend = "onnx").
+
+
+def model_directory(name=model_name, directory=onnx_model_directory):
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9._-]+', '_', name))
+
+
+def export_model(name=model_name, directory=onnx_model_directory, quantize=True):
+    """ Exportiert das Transformer-Modul eines SentenceTransformers nach ONNX (+ int8-Variante). """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    target = model_directory(name, directory)
+    os.makedirs(target, exist_ok=True)
+    sentence_model = SentenceTransformer(name, device="cpu")
+    transformer = sentence_model[0].auto_model.eval()
+    tokenizer = sentence_model.tokenizer
+    pooling = next(module for module in sentence_model if isinstance(module, Pooling))
+    pooling_mode = pooling.get_pooling_mode_str()
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode '{pooling_mode}' (supported: mean, cls)")
+
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids")
+                   if name in tokenizer.model_input_names]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    example = tokenizer(["ONNX export example", "a second, somewhat longer example sentence"],
+                        padding=True, return_tensors="pt")
+    dynamic_axes = {input_name: {0: "batch", 1: "sequence"} for input_name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(target, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(LastHiddenState(transformer), tuple(example[input_name] for input_name in input_names),
+                          fp32_path, input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=17, do_constant_folding=True, dynamo=False)
+    tokenizer.save_pretrained(target) # tokenizer.json für die tokenizers-Bibliothek
+
+    meta = {
+        "model_name": name,
+        "dim": sentence_model.get_sentence_embedding_dimension(),
+        "max_seq_length": sentence_model.max_seq_length,
+        "pooling": pooling_mode,
+        "normalize": any(isinstance(module, Normalize) for module in sentence_model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "input_names": input_names,
+    }
+    with open(os.path.join(target, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"Exported '{name}' to '{fp32_path}' ({os.path.getsize(fp32_path) / 1e6:.1f} MB).")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        int8_path = os.path.join(target, "model.int8.onnx")
+        prepared_path = os.path.join(target, "model.prep.onnx")
+        # Graph optimieren + Shape-Inferenz, damit möglichst viele MatMuls quantisiert werden
+        quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+        # Gewichte int8, Aktivierungen werden zur Laufzeit pro Batch quantisiert
+        quantize_dynamic(prepared_path, int8_path, weight_type=QuantType.QInt8)
+        os.remove(prepared_path)
+        print(f"Quantized to '{int8_path}' ({os.path.getsize(int8_path) / 1e6:.1f} MB).")
+    elif os.path.exists(os.path.join(target, "model.int8.onnx")):
+        os.remove(os.path.join(target, "model.int8.onnx")) # Passt nicht mehr zum neuen float32-Modell
+    return target
+
+
+class OnnxEncoder:
+    """ SentenceTransformer-kompatibles encode() auf einem exportierten ONNX-Modell. """
+
+    def __init__(self, name=model_name, directory=onnx_model_directory, quantized=onnx_quantized,
+                 threads=onnx_threads):
+        from tokenizers import Tokenizer
+        self.path = model_directory(name, directory)
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No ONNX export for '{name}' in '{self.path}'. Run: python onnx_encoder.py")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.model_name = name
+        if quantized and not os.path.exists(os.path.join(self.path, "model.int8.onnx")):
+            # Mit --no-quantize exportiert: auf das float32-Modell ausweichen
+            print(f"Warning: No int8 model in '{self.path}', using float32 'model.onnx'.")
+            quantized = False
+        self.quantized = quantized
+        self.model_path = os.path.join(self.path, "model.int8.onnx" if quantized else "model.onnx")
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"ONNX model '{self.model_path}' not found. Run: python onnx_encoder.py")
+        # Eigener Schlüssel für den Embedding-Cache: die Vektoren weichen leicht von PyTorch ab
+        self.cache_name = f"{name}@onnx{'-int8' if quantized else ''}"
+        self.threads = threads
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.meta["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.meta["pad_token_id"], pad_token=self.meta["pad_token"])
+        # Die Session (inkl. Thread-Pool von ONNX Runtime) erst beim ersten encode() erzeugen:
+        # Threads überleben keinen fork(), so funktioniert auch das Vorladen in gunicorn.conf.py
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import onnxruntime
+                    options = onnxruntime.SessionOptions()
+                    options.intra_op_num_threads = self.threads
+                    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    self._session = onnxruntime.InferenceSession(self.model_path, options,
+                                                                 providers=["CPUExecutionProvider"])
+        return self._session
+
+    def get_sentence_embedding_dimension(self):
+        return self.meta["dim"]
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        hidden = self._get_session().run(None, {name: inputs[name] for name in self.meta["input_names"]})[0]
+        if self.meta["pooling"] == "cls":
+            embeddings = hidden[:, 0]
+        else: # Mean-Pooling über die echten Tokens (wie sentence_transformers.models.Pooling)
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.meta["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences, batch_size=onnx_batch_size, show_progress_bar=False, **kwargs):
+        """ Wie SentenceTransformer.encode(): str -> Vektor, Liste -> Array (n, dim). """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.meta["dim"]), dtype=np.float32)
+        # Nach Länge sortieren, damit jeder Batch wenig Padding enthält
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[i] for i in rows])
+        return embeddings[0] if single else embeddings
+
+
+def _sample_texts(count, chunks_directory="chunks_output"):
+    """ Chunk-Texte aus chunks_output/ (falls vorhanden), aufgefüllt mit synthetischen Fragen. """
+    texts = []
+    if os.path.isdir(chunks_directory):
+        for filename in sorted(os.listdir(chunks_directory)):
+            if filename.endswith("_chunks.json") and len(texts) < count:
+                with open(os.path.join(chunks_directory, filename), 'r', encoding='utf-8') as f:
+                    texts.extend(chunk["text"] for chunk in json.load(f))
+    texts = texts[:count]
+    texts += [f"What is the effect of compound {i} on protein kinase {i % 97} activity?"
+              for i in range(count - len(texts))]
+    return texts
+
+
+def _benchmark(encode, texts, batch_size, single_queries=200):
+    """ Latenz einzelner Fragen (p50/p99) und Durchsatz beim Batch-Encoding. """
+    encode(texts[:8], batch_size) # Warm-up
+    latencies = []
+    for text in texts[:single_queries]:
+        start = time.perf_counter()
+        encode([text], 1)
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    encode(texts, batch_size)
+    seconds = time.perf_counter() - start
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+            "texts_per_second": len(texts) / seconds}
+
+
+def parity_cosines(encoder, torch_model, texts, batch_size=onnx_batch_size):
+    """ Kosinus-Ähnlichkeit je Text zwischen ONNX- und PyTorch-Embedding. """
+    reference = torch_model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    embeddings = encoder.encode(texts, batch_size=batch_size)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings * reference).sum(axis=1)
+
+
+def compare(name=model_name, num_texts=512, batch_size=onnx_batch_size, threshold=parity_threshold):
+    """ Vergleicht ONNX (float32, int8 falls exportiert) mit PyTorch. Gibt False zurück, wenn die Parität verfehlt wird. """
+    from sentence_transformers import SentenceTransformer
+    texts = _sample_texts(num_texts)
+    torch_model = SentenceTransformer(name, device="cpu")
+
+    ok = True
+    candidates = [("torch", lambda batch, size: torch_model.encode(batch, batch_size=size), None)]
+    for quantized in (False, True):
+        encoder = OnnxEncoder(name, quantized=quantized)
+        if encoder.quantized != quantized:
+            print("onnx-int8  not exported (--no-quantize), skipped.")
+            continue
+        cosine = parity_cosines(encoder, torch_model, texts, batch_size)
+        label = "onnx-int8" if quantized else "onnx-fp32"
+        passed = cosine.min() >= threshold
+        ok = ok and passed
+        print(f"{label:10s} cosine to torch: min {cosine.min():.4f}, mean {cosine.mean():.4f} "
+              f"-> {'OK' if passed else f'FAILED (< {threshold})'}")
+        candidates.append((label, lambda batch, size, encoder=encoder: encoder.encode(batch, batch_size=size),
+                           os.path.getsize(encoder.model_path)))
+
+    print(f"\nCPU benchmark ({len(texts)} texts, batch size {batch_size}):")
+    for label, encode, model_bytes in candidates:
+        result = _benchmark(encode, texts, batch_size)
+        size = f"{model_bytes / 1e6:6.1f} MB" if model_bytes else "       -"
+        print(f"{label:10s} single query p50 {result['p50_ms']:6.2f} ms  p99 {result['p99_ms']:6.2f} ms   "
+              f"batch {result['texts_per_second']:8.1f} texts/s   model file {size}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportiert den Sentence Transformer nach ONNX (int8) und vergleicht ihn mit PyTorch.")
+    parser.add_argument("--model", default=model_name, help="SentenceTransformer-Modell")
+    parser.add_argument("--force", action="store_true", help="Neu exportieren, auch wenn schon ein Export existiert")
+    parser.add_argument("--no-quantize", action="store_true", help="Nur das float32-Modell exportieren")
+    parser.add_argument("--compare", action="store_true",
+                        help="Parität (Kosinus) sowie CPU-Latenz und Durchsatz gegen PyTorch messen")
+    parser.add_argument("--texts", type=int, default=512, help="Anzahl Texte für --compare")
+    parser.add_argument("--batch-size", type=int, default=onnx_batch_size)
+    args = parser.parse_args()
+
+    if args.force or not os.path.exists(os.path.join(model_directory(args.model), "meta.json")):
+        export_model(args.model, quantize=not args.no_quantize)
+    else:
+        print(f"Using existing export in '{model_directory(args.model)}' (--force to re-export).")
+    if args.compare and not compare(args.model, args.texts, args.batch_size):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,98 +1,344 @@
 import os
 import json # Importiere das JSON-Modul
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from lxml import etree
+from chunk_store import ChunkStore, chunk_store_path
+from pipeline_manifest import PipelineManifest
+import chunker
+from chunker import Paragraph
+import lexical_index
 
 # --- Konfiguration ---
 xml_input_directory = "grobid_output" # Ordner mit den Grobid XML-Dateien
 chunks_output_directory = "chunks_output" # Neuer Ordner für die Chunk-JSON-Dateien
+# "stream": etree.iterparse, verarbeitete Teilbäume werden sofort freigegeben (konstanter Speicher,
+# auch bei riesigen Literaturverzeichnissen); "tree": ganzes Dokument laden und per XPath auswerten.
+# Beide erzeugen identische Chunks.
+parse_mode = "stream"
+parse_processes = os.cpu_count() or 1 # XML-Dateien werden parallel in so vielen Prozessen geparst
 # --------------------
 
-print(f"Starting XML parsing and chunking from '{xml_input_directory}'...")
+TEI = '{http://www.tei-c.org/ns/1.0}'
 
-# Erstelle das Ausgabe-Verzeichnis für Chunks, falls es nicht existiert
-if not os.path.exists(chunks_output_directory):
-    os.makedirs(chunks_output_directory)
-    print(f"Created chunks output directory: {chunks_output_directory}")
 
-if not os.path.exists(xml_input_directory):
-    print(f"Error: XML input directory '{xml_input_directory}' not found.")
-    exit()
+def _text(element):
+    """ Entspricht XPath string(): alle Textknoten des Teilbaums. """
+    return ''.join(element.itertext())
 
-# Gehe durch alle Dateien im XML-Verzeichnis
-for filename in os.listdir(xml_input_directory):
-    if filename.lower().endswith(".xml"):
+
+def _paragraph(index, element, section, section_id=None):
+    """ Paragraph mit den Sätzen aus GROBIDs <s>-Tags (leer, wenn diese fehlen oder nicht den ganzen Text abdecken). """
+    text = _text(element)
+    sentences = [_text(s_element) for s_element in element.iter(f"{TEI}s")]
+    if ''.join(''.join(sentences).split()) != ''.join(text.split()):
+        sentences = [] # Text außerhalb der <s>-Tags -> chunker trennt selbst
+    return Paragraph(index, text, section, sentences, section_id)
+
+
+def _heading(head):
+    return ' '.join(_text(head).split())
+
+
+def _section_div(element):
+    return next(element.iterancestors(f"{TEI}div"), None)
+
+
+def _section_id(section_ids, div):
+    """ Nummer des <div> in der Reihenfolge, in der seine ersten Paragraphen auftreten (None ohne <div>). """
+    if div is None:
+        return None
+    return section_ids.setdefault(div, len(section_ids))
+
+
+def extract_tree(xml_path):
+    """ Lädt das ganze Dokument. Gibt (title, abstract oder None, [Paragraph]) zurück. """
+    tree = etree.parse(xml_path)
+    root = tree.getroot()
+    ns = {'tei': 'http://www.tei-c.org/ns/1.0'} # Namespace
+
+    title_elements = root.xpath('//tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:title', namespaces=ns)
+    title = title_elements[0].xpath('string()').strip() if title_elements else "Title not found"
+
+    abstract_elements = root.xpath('//tei:teiHeader/tei:profileDesc/tei:abstract/tei:p', namespaces=ns)
+    abstract = _paragraph(None, abstract_elements[0], "Abstract") if abstract_elements else None
+
+    # Abschnitt = erste <head> des nächsten umgebenden <div>, sofern sie vor dem Paragraphen steht
+    headings, sections = {}, {}
+    for element in root.iter(f"{TEI}head", f"{TEI}p"):
+        if element.tag == f"{TEI}head":
+            parent = element.getparent()
+            if parent is not None and parent.tag == f"{TEI}div":
+                headings.setdefault(parent, _heading(element))
+        else:
+            sections[element] = headings.get(_section_div(element), "")
+
+    paragraph_elements = root.xpath('//tei:text/tei:body//tei:p', namespaces=ns)
+    section_ids = {}
+    paragraphs = [_paragraph(i, p_element, sections[p_element], _section_id(section_ids, _section_div(p_element)))
+                  for i, p_element in enumerate(paragraph_elements)]
+    return title, abstract, paragraphs
+
+
+_TITLE_PATH = [f"{TEI}teiHeader", f"{TEI}fileDesc", f"{TEI}titleStmt", f"{TEI}title"]
+_ABSTRACT_PATH = [f"{TEI}teiHeader", f"{TEI}profileDesc", f"{TEI}abstract", f"{TEI}p"]
+# Nur für diese Elemente liefert iterparse Events (alles andere bleibt in C). Die Container
+# sind die Stellen, an denen fertige Teilbäume (Literaturverzeichnis, Abbildungen, ...) freigegeben werden.
+_HEADER_TAGS = [f"{TEI}title", f"{TEI}p", f"{TEI}teiHeader"]
+_BODY_TAGS = [f"{TEI}{name}" for name in
+              ("p", "head", "div", "figure", "note", "biblStruct", "listBibl", "front", "back")]
+
+
+def _release(element):
+    """ Leert einen fertig verarbeiteten Teilbaum und entfernt bereits verarbeitete Geschwister davor. """
+    element.clear(keep_tail=False)
+    parent = element.getparent()
+    while parent is not None and element.getprevious() is not None:
+        del parent[0]
+
+
+def _has_path(element, path):
+    """ True, wenn element und seine direkten Vorfahren genau die Tags in path haben (letzter = element). """
+    for tag in reversed(path):
+        if element is None or element.tag != tag:
+            return False
+        element = element.getparent()
+    return True
+
+
+def _in_body(element):
+    """ Entspricht //tei:text/tei:body//*: element liegt in einem <body> direkt unter <text>. """
+    for body in element.iterancestors(f"{TEI}body"):
+        parent = body.getparent()
+        if parent is not None and parent.tag == f"{TEI}text":
+            return True
+    return False
+
+
+def extract_streaming(xml_path):
+    """ Wie extract_tree, aber per iterparse ohne XPath und ohne das ganze Dokument im Speicher.
+
+    Titel und Abstract kommen aus einem kurzen Durchlauf bis </teiHeader>. Im Hauptdurchlauf
+    wird ein Paragraph übernommen, sobald sein (äußerstes) <p> geschlossen ist; danach wird
+    der Teilbaum geleert und bereits verarbeitete Geschwister werden entfernt.
+    """
+    title = None
+    abstract = None
+    for _, element in etree.iterparse(xml_path, events=('end',), tag=_HEADER_TAGS):
+        if element.tag == f"{TEI}teiHeader":
+            break
+        if title is None and _has_path(element, _TITLE_PATH):
+            title = _text(element).strip()
+        elif abstract is None and _has_path(element, _ABSTRACT_PATH):
+            abstract = _paragraph(None, element, "Abstract")
+
+    paragraphs = []
+    headings = {} # Offene <div> -> Überschrift (die <head> selbst wird sofort freigegeben)
+    section_ids = {} # Offene <div> -> Abschnittsnummer
+    section_count = 0
+    for _, element in etree.iterparse(xml_path, events=('end',), tag=_BODY_TAGS):
+        inside_paragraph = next(element.iterancestors(f"{TEI}p"), None) is not None
+        if inside_paragraph:
+            continue # Wird mit dem äußersten <p> übernommen und freigegeben
+        tag = element.tag
+        if tag == f"{TEI}head":
+            parent = element.getparent()
+            if parent is not None and parent.tag == f"{TEI}div":
+                headings.setdefault(parent, _heading(element))
+        elif tag == f"{TEI}p" and _in_body(element):
+            # Verschachtelte <p> zählen bei XPath einzeln, in Dokumentreihenfolge
+            for p_element in element.iter(f"{TEI}p"):
+                div = _section_div(p_element)
+                if div is not None and div not in section_ids:
+                    # Wie _section_id(), aber geschlossene <div> werden vergessen -> Zähler statt len()
+                    section_ids[div] = section_count
+                    section_count += 1
+                paragraphs.append(_paragraph(len(paragraphs), p_element, headings.get(div, ""),
+                                             section_ids.get(div)))
+        elif tag == f"{TEI}div":
+            headings.pop(element, None)
+            section_ids.pop(element, None)
+        _release(element)
+
+    return (title if title is not None else "Title not found"), abstract, paragraphs
+
+
+def build_chunks(source_file, title, abstract, paragraphs, strategy=chunker.chunk_strategy,
+                 max_tokens=chunker.chunk_max_tokens, overlap_tokens=chunker.chunk_overlap_tokens):
+    """ Chunk-Liste im Format der *_chunks.json-Dateien.
+
+    strategy "sections": token-begrenzte Fenster je Abschnitt (chunker.py);
+    "paragraphs": Abstract + ein Chunk pro Paragraph.
+    """
+    if strategy == "sections":
+        return chunker.chunk_sections(source_file, title, abstract, paragraphs, max_tokens, overlap_tokens)
+
+    file_chunks = [] # Liste für die Chunks dieser Datei
+    abstract = abstract.text.strip() if abstract is not None else ""
+
+    # Optional: Füge Abstract als ersten Chunk hinzu, wenn vorhanden
+    if abstract:
+        chunk_metadata = {
+            "source_file": source_file,
+            "title": title,
+            "chunk_type": "abstract" # Spezifischer Typ
+        }
+        file_chunks.append({
+            "text": ' '.join(abstract.split()), # Bereinigter Abstract-Text
+            "metadata": chunk_metadata
+        })
+
+    # Füge Paragraphen als Chunks hinzu
+    for i, para_text, _, _ in paragraphs:
+        cleaned_text = ' '.join(para_text.split()) # Bereinigter Text
+
+        if cleaned_text: # Nur nicht-leere Paragraphen hinzufügen
+            chunk_metadata = {
+                "source_file": source_file,
+                "title": title,
+                "chunk_type": "paragraph",
+                "paragraph_index": i # 0-basierter Index des Paragraphen
+            }
+            file_chunks.append({
+                "text": cleaned_text,
+                "metadata": chunk_metadata
+            })
+    return file_chunks
+
+
+def parse_file(filename, xml_path, json_output_path, source_file, mode=parse_mode, chunking=None):
+    """ Parst eine XML-Datei und schreibt die Chunk-JSON (läuft in einem Worker-Prozess).
+
+    chunking: optionale Argumente für build_chunks (strategy, max_tokens, overlap_tokens).
+
+    Gibt ein Dict mit den Chunks (für Chunk Store und Manifest im Hauptprozess) oder dem Fehler zurück.
+    """
+    result = {"filename": filename, "chunks": None, "error": None}
+    try:
+        extract = extract_streaming if mode == "stream" else extract_tree
+        file_chunks = build_chunks(source_file, *extract(xml_path), **(chunking or {}))
+        if file_chunks: # Nur speichern, wenn Chunks gefunden wurden
+            with open(json_output_path, 'w', encoding='utf-8') as f_out:
+                # indent=2 sorgt für schöne Formatierung (Einrückung)
+                # ensure_ascii=False erlaubt Sonderzeichen direkt (wichtig für Umlaute etc.)
+                json.dump(file_chunks, f_out, ensure_ascii=False, indent=2)
+        elif os.path.exists(json_output_path):
+            # Evtl. vorhandene Chunks einer früheren Version dieser Datei entfernen
+            os.remove(json_output_path)
+        result["chunks"] = file_chunks
+    except etree.XMLSyntaxError as e:
+        result["error"] = f"Could not parse XML file {filename}. Error: {e}"
+    except Exception as e:
+        result["error"] = f"An unexpected error occurred processing {filename}: {e}"
+    return result
+
+
+def parse_files(tasks, mode=parse_mode, processes=parse_processes, chunking=None):
+    """ Parst die Tasks (Argument-Tupel für parse_file) parallel und liefert die Ergebnisse, sobald sie fertig sind. """
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield parse_file(*task, mode=mode, chunking=chunking)
+        return
+    with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as executor:
+        futures = [executor.submit(parse_file, *task, mode=mode, chunking=chunking) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parst GROBID-XML und erzeugt Chunk-JSON-Dateien.")
+    parser.add_argument("--force", action="store_true", help="Alle XML-Dateien neu parsen, auch unveränderte")
+    parser.add_argument("--mode", choices=["stream", "tree"], default=parse_mode,
+                        help="stream: iterparse mit konstantem Speicher; tree: ganzes Dokument + XPath")
+    parser.add_argument("--processes", type=int, default=parse_processes, help="Anzahl Parser-Prozesse")
+    parser.add_argument("--chunking", choices=["sections", "paragraphs"], default=chunker.chunk_strategy,
+                        help="sections: token-begrenzte Fenster je Abschnitt; paragraphs: ein Chunk pro <p>")
+    parser.add_argument("--max-tokens", type=int, default=chunker.chunk_max_tokens, help="Token-Budget pro Chunk")
+    parser.add_argument("--overlap-tokens", type=int, default=chunker.chunk_overlap_tokens,
+                        help="Überlappung benachbarter Chunks eines Abschnitts")
+    args = parser.parse_args()
+    chunking = {"strategy": args.chunking, "max_tokens": args.max_tokens, "overlap_tokens": args.overlap_tokens}
+    # Geänderte Chunking-Einstellungen machen alle bisherigen Chunks ungültig
+    chunking_key = chunker.config_key(args.chunking, args.max_tokens, args.overlap_tokens)
+
+    print(f"Starting XML parsing and chunking from '{xml_input_directory}'...")
+
+    # Erstelle das Ausgabe-Verzeichnis für Chunks, falls es nicht existiert
+    if not os.path.exists(chunks_output_directory):
+        os.makedirs(chunks_output_directory)
+        print(f"Created chunks output directory: {chunks_output_directory}")
+
+    if not os.path.exists(xml_input_directory):
+        print(f"Error: XML input directory '{xml_input_directory}' not found.")
+        exit()
+
+    # Chunk Store für O(1)-Lookups der Chunk-Texte (wird parallel zu den JSON-Dateien geschrieben)
+    chunk_store = ChunkStore(chunk_store_path, readonly=False)
+
+    # Manifest: nur neue/geänderte XML-Dateien parsen, Ausgaben gelöschter XML-Dateien entfernen
+    manifest = PipelineManifest()
+    store_changed = False # Lexikalischer Index muss nur nach Änderungen am Chunk Store neu gebaut werden
+    xml_filenames = sorted(f for f in os.listdir(xml_input_directory) if f.lower().endswith(".xml"))
+    for stale_name in manifest.stale_inputs("parse", xml_filenames):
+        print(f"  XML removed: {stale_name}")
+        stale_entry = manifest.remove_outputs("parse", stale_name)
+        chunk_store.delete_document(stale_entry.get("source_file", stale_name.replace("_grobid.xml", ".pdf")))
+        store_changed = True
+
+    skipped_files = 0
+    tasks = []
+    pending = {} # filename -> (xml_path, json_output_path, source_file, content_hash)
+    for filename in xml_filenames:
         xml_path = os.path.join(xml_input_directory, filename)
         # Erstelle einen Basisnamen für die Output-JSON-Datei (entferne _grobid.xml)
         base_output_name = filename.replace("_grobid.xml", "").replace(".xml", "")
         json_output_path = os.path.join(chunks_output_directory, f"{base_output_name}_chunks.json")
+        source_file = filename.replace("_grobid.xml", ".pdf") # Versuche, den PDF-Namen zu rekonstruieren
+
+        content_hash = manifest.content_hash("parse", filename, xml_path)
+        if (not args.force and manifest.is_current("parse", filename, content_hash)
+                and manifest.get("parse", filename).get("chunking") == chunking_key):
+            skipped_files += 1
+            continue
+        tasks.append((filename, xml_path, json_output_path, source_file))
+        pending[filename] = (xml_path, json_output_path, source_file, content_hash)
+
+    print(f"Parsing {len(tasks)} XML files ({args.mode} mode, chunking {chunking_key}, "
+          f"up to {args.processes} processes)...")
+    # Chunk Store und Manifest werden nur hier im Hauptprozess geschrieben
+    for result in parse_files(tasks, args.mode, args.processes, chunking):
+        filename = result["filename"]
+        xml_path, json_output_path, source_file, content_hash = pending[filename]
+        print(f"  Processed: {filename}")
+        if result["error"]:
+            print(f"    -> Error: {result['error']}")
+            continue
+        store_changed = True
+        file_chunks = result["chunks"]
+        if file_chunks:
+            chunk_store.replace_document(source_file, file_chunks)
+            manifest.record("parse", filename, content_hash, input_paths=[xml_path],
+                            outputs=[json_output_path], source_file=source_file, chunking=chunking_key)
+            print(f"    -> Success! Found {len(file_chunks)} chunks. Saved chunks to '{json_output_path}'")
+        else:
+            print(f"    -> Warning: No text paragraphs found in the body of {filename}. No chunks saved.")
+            chunk_store.delete_document(source_file)
+            manifest.record("parse", filename, content_hash, input_paths=[xml_path],
+                            outputs=[], source_file=source_file, chunking=chunking_key)
+
+    chunk_store.close()
+    manifest.save()
+
+    # BM25-Index für das Hybrid-Retrieval (app.py) aus dem Chunk Store neu bauen
+    if store_changed or not os.path.exists(lexical_index.lexical_index_directory):
+        print("\nBuilding lexical (BM25) index...")
+        lexical_index.build_index()
+
+    print("\nXML parsing and chunking finished.")
+    if skipped_files:
+        print(f"Skipped {skipped_files} unchanged XML files.")
+    print(f"Chunk JSON files are in the '{chunks_output_directory}' folder.")
+
 
-        print(f"  Processing: {filename} ...")
-
-        try:
-            # Lade die XML-Datei
-            tree = etree.parse(xml_path)
-            root = tree.getroot()
-            ns = {'tei': 'http://www.tei-c.org/ns/1.0'} # Namespace
-
-            # --- Extraktion ---
-            title_elements = root.xpath('//tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:title', namespaces=ns)
-            title = title_elements[0].xpath('string()').strip() if title_elements else "Title not found"
-
-            abstract_elements = root.xpath('//tei:teiHeader/tei:profileDesc/tei:abstract/tei:p', namespaces=ns)
-            abstract = abstract_elements[0].xpath('string()').strip() if abstract_elements else "" # Leerer String, falls nicht gefunden
-
-            # --- Chunking (Jeder Paragraph wird ein Chunk) ---
-            file_chunks = [] # Liste für die Chunks dieser Datei
-            paragraph_elements = root.xpath('//tei:text/tei:body//tei:p', namespaces=ns)
-
-            # Optional: Füge Abstract als ersten Chunk hinzu, wenn vorhanden
-            if abstract:
-                 chunk_metadata = {
-                        "source_file": filename.replace("_grobid.xml", ".pdf"), # Versuche, den PDF-Namen zu rekonstruieren
-                        "title": title,
-                        "chunk_type": "abstract" # Spezifischer Typ
-                    }
-                 file_chunks.append({
-                     "text": ' '.join(abstract.split()), # Bereinigter Abstract-Text
-                     "metadata": chunk_metadata
-                 })
-
-            # Füge Paragraphen als Chunks hinzu
-            for i, p_element in enumerate(paragraph_elements):
-                para_text = p_element.xpath('string()').strip()
-                cleaned_text = ' '.join(para_text.split()) # Bereinigter Text
-
-                if cleaned_text: # Nur nicht-leere Paragraphen hinzufügen
-                    # Erstelle Metadaten für diesen Chunk
-                    chunk_metadata = {
-                        "source_file": filename.replace("_grobid.xml", ".pdf"), # Versuche, den PDF-Namen zu rekonstruieren
-                        "title": title,
-                        "chunk_type": "paragraph",
-                        "paragraph_index": i # 0-basierter Index des Paragraphen
-                    }
-                    # Erstelle den Chunk (Dictionary) und füge ihn zur Liste hinzu
-                    file_chunks.append({
-                        "text": cleaned_text,
-                        "metadata": chunk_metadata
-                    })
-
-            # --- Speichere die Chunks als JSON-Datei ---
-            if file_chunks: # Nur speichern, wenn Chunks gefunden wurden
-                with open(json_output_path, 'w', encoding='utf-8') as f_out:
-                    # json.dump schreibt die Python-Liste als JSON in die Datei
-                    # indent=2 sorgt für schöne Formatierung (Einrückung)
-                    # ensure_ascii=False erlaubt Sonderzeichen direkt (wichtig für Umlaute etc.)
-                    json.dump(file_chunks, f_out, ensure_ascii=False, indent=2)
-                print(f"    -> Success! Found {len(file_chunks)} chunks. Saved chunks to '{json_output_path}'")
-            else:
-                print(f"    -> Warning: No text paragraphs found in the body of {filename}. No chunks saved.")
-
-
-        except etree.XMLSyntaxError as e:
-            print(f"    -> Error: Could not parse XML file {filename}. Error: {e}")
-        except Exception as e:
-             print(f"    -> An unexpected error occurred processing {filename}: {e}")
-
-
-print("\nXML parsing and chunking finished.")
-print(f"Chunk JSON files are in the '{chunks_output_directory}' folder.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
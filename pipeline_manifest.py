@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# --- Konfiguration ---
+manifest_path = "pipeline_manifest.json" # Gemeinsames Manifest aller Pipeline-Stufen
+autosave_every = 50 # Manifest nach so vielen Änderungen zwischenspeichern (Abbruch-sicher)
+# --------------------
+
+# Das Manifest merkt sich pro Stufe ("grobid", "parse", "embed", "index") und
+# Eingabedatei den Content-Hash der Eingabe und die erzeugten Ausgaben.
+# Jede Stufe verarbeitet damit nur neue oder geänderte Eingaben und räumt die
+# Ausgaben gelöschter Eingaben auf. Da jede Stufe ihre Ausgaben löscht, sieht
+# die nächste Stufe die fehlende Eingabe und räumt ihrerseits auf.
+#
+# Aufbau:
+# {"version": 1, "stages": {"parse": {"paper_grobid.xml": {
+#     "hash": "...", "signature": [size, mtime_ns], "outputs": ["chunks_output/paper_chunks.json"],
+#     "updated_at": 1712345678.9, ...}}}}
+
+
+def file_hash(*paths):
+    """ SHA-256 über den Inhalt einer oder mehrerer Dateien. """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _signature(paths):
+    stats = [os.stat(path) for path in paths]
+    return [[s.st_size, s.st_mtime_ns] for s in stats]
+
+
+class PipelineManifest:
+    def __init__(self, path=manifest_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.data = {"version": 1, "stages": {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def stage(self, stage):
+        return self.data["stages"].setdefault(stage, {})
+
+    def content_hash(self, stage, input_name, *paths):
+        """ Hash der Eingabedateien. Unveränderte Dateien (gleiche Größe + mtime) werden nicht neu gelesen. """
+        signature = _signature(paths)
+        entry = self.stage(stage).get(input_name)
+        if entry and entry.get("signature") == signature:
+            return entry["hash"]
+        return file_hash(*paths)
+
+    def is_current(self, stage, input_name, content_hash):
+        """ True, wenn die Eingabe unverändert ist und alle Ausgaben noch existieren. """
+        entry = self.stage(stage).get(input_name)
+        if not entry or entry.get("hash") != content_hash:
+            return False
+        return all(os.path.exists(output) for output in entry.get("outputs", []))
+
+    def get(self, stage, input_name):
+        return self.stage(stage).get(input_name)
+
+    def record(self, stage, input_name, content_hash, input_paths=(), outputs=(), **info):
+        """ Merkt sich eine erfolgreich verarbeitete Eingabe samt Ausgaben. """
+        with self._lock:
+            entry = {
+                "hash": content_hash,
+                "signature": _signature(input_paths) if input_paths else None,
+                "outputs": list(outputs),
+                "updated_at": time.time(),
+            }
+            entry.update(info)
+            self.stage(stage)[input_name] = entry
+            self._mark_dirty()
+
+    def forget(self, stage, input_name):
+        with self._lock:
+            entry = self.stage(stage).pop(input_name, None)
+            self._mark_dirty()
+            return entry
+
+    def stale_inputs(self, stage, current_input_names):
+        """ Eingaben, die im Manifest stehen, aber nicht mehr existieren. """
+        current = set(current_input_names)
+        return [name for name in self.stage(stage) if name not in current]
+
+    def remove_outputs(self, stage, input_name):
+        """ Löscht die Ausgabedateien einer entfernten Eingabe und vergisst sie. Gibt den alten Eintrag zurück. """
+        entry = self.forget(stage, input_name) or {}
+        for output in entry.get("outputs", []):
+            if os.path.exists(output):
+                os.remove(output)
+                print(f"    -> Removed stale output '{output}'")
+        return entry
+
+    def save(self):
+        with self._lock:
+            self._write()
+
+    def _mark_dirty(self):
+        self._dirty += 1
+        if self._dirty >= autosave_every:
+            self._write()
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path) # Atomar: nie ein halb geschriebenes Manifest
+        self._dirty = 0
@@ -1,90 +1,220 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline_manifest import PipelineManifest
 
 # --- Konfiguration ---
-grobid_url = "http://localhost:8070/api/processFulltextDocument"
+grobid_base_url = os.getenv("GROBID_URL", "http://localhost:8070") # Per Umgebungsvariable / --grobid-url änderbar (z.B. Stub-Server)
 pdf_directory = "pdfs_input"  # Ordner mit den zu verarbeitenden PDFs
 output_directory = "grobid_output" # Ordner für die resultierenden XML-Dateien
+# Anzahl paralleler Anfragen. Sollte der Anzahl Worker-Threads von GROBID entsprechen
+# (grobid.yml: concurrency), sonst antwortet GROBID mit 503 ("busy").
+grobid_concurrency = 1
+request_timeout = 300 # Sekunden pro Anfrage
+max_retries = 5 # Wiederholungen bei 503 / Verbindungsfehlern
+timeout_retries = 1 # Davon höchstens so viele nach einem Timeout (jeder kostet bis zu request_timeout)
+retry_backoff_base = 2.0 # Sekunden, verdoppelt sich pro Versuch (plus Jitter)
 # --------------------
 
-print(f"Checking Grobid service at {grobid_url}...")
-try:
-    # Einfacher Check, ob Grobid erreichbar ist
-    ping_url = "http://localhost:8070/api/isalive"
-    ping_response = requests.get(ping_url, timeout=10)
-    if ping_response.status_code == 200 and ping_response.text == "true":
-        print("Grobid service is alive.")
-    else:
+
+def create_session(pool_size):
+    """ Gemeinsame HTTP-Session mit Connection Pool (Keep-Alive) für alle Worker-Threads. """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def check_grobid_alive(session, base_url):
+    print(f"Checking Grobid service at {base_url}...")
+    try:
+        # Einfacher Check, ob Grobid erreichbar ist
+        ping_response = session.get(f"{base_url}/api/isalive", timeout=10)
+        if ping_response.status_code == 200 and ping_response.text == "true":
+            print("Grobid service is alive.")
+            return True
         print(f"Grobid service check failed. Status: {ping_response.status_code}, Response: {ping_response.text}")
         print("Bitte stelle sicher, dass der Grobid Docker Container läuft.")
-        exit() # Beenden, wenn Grobid nicht läuft
-except requests.exceptions.RequestException as e:
-    print(f"Could not connect to Grobid service: {e}")
-    print("Bitte stelle sicher, dass der Grobid Docker Container läuft und auf Port 8070 erreichbar ist.")
-    exit() # Beenden, wenn Grobid nicht erreichbar
+    except requests.exceptions.RequestException as e:
+        print(f"Could not connect to Grobid service: {e}")
+        print("Bitte stelle sicher, dass der Grobid Docker Container läuft und auf Port 8070 erreichbar ist.")
+    return False
 
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
-    print(f"Created output directory: {output_directory}")
 
-if not os.path.exists(pdf_directory):
-    print(f"Error: Input PDF directory '{pdf_directory}' not found.")
-    print("Bitte erstelle den Ordner und lege PDFs hinein.")
-    exit()
+def _backoff_delay(attempt, response=None):
+    """ Wartezeit vor dem nächsten Versuch. Respektiert Retry-After, falls GROBID es sendet. """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit() and int(retry_after) > 0:
+            return float(retry_after)
+    return retry_backoff_base * (2 ** attempt) + random.uniform(0, retry_backoff_base)
 
-print(f"Starting PDF processing from '{pdf_directory}'...")
 
-# Gehe durch alle Dateien im PDF-Verzeichnis
-for filename in os.listdir(pdf_directory):
-    if filename.lower().endswith(".pdf"):
-        pdf_path = os.path.join(pdf_directory, filename)
-        # Erstelle einen eindeutigen Namen für die XML-Datei
-        base_filename = os.path.splitext(filename)[0]
-        output_xml_path = os.path.join(output_directory, f"{base_filename}_grobid.xml")
-
-        print(f"  Processing: {filename} ...")
+def process_pdf(session, filename, base_url, input_dir=pdf_directory, output_dir=output_directory):
+    """ Schickt eine PDF an GROBID und speichert das TEI-XML. Gibt ein Ergebnis-Dict zurück. """
+    pdf_path = os.path.join(input_dir, filename)
+    # Erstelle einen eindeutigen Namen für die XML-Datei
+    base_filename = os.path.splitext(filename)[0]
+    output_xml_path = os.path.join(output_dir, f"{base_filename}_grobid.xml")
+    result = {"filename": filename, "output": output_xml_path, "ok": False, "attempts": 0,
+              "seconds": 0.0, "bytes": 0, "error": None}
+    try:
+        result["bytes"] = os.path.getsize(pdf_path)
+    except OSError as e: # z.B. zwischen Auflisten und Verarbeiten gelöscht
+        result["error"] = f"Could not read PDF: {e}"
+        return result
+    # Parameter für die Grobid API
+    params = {
+        'consolidateHeader': '1', # Versucht Metadaten zu verbessern
+        'segmentSentences': 'true' # Segmentiert den Text in Sätze (<s> Tags)
+    }
 
+    start_time = time.time()
+    response = None
+    timeouts = 0
+    for attempt in range(max_retries + 1):
+        result["attempts"] = attempt + 1
         try:
             with open(pdf_path, 'rb') as f:
-                files = {
-                    # Wichtig: Der Dateiname im Tupel muss nicht der Originalname sein,
-                    # aber es ist oft hilfreich.
-                    'input': (filename, f, 'application/pdf')
-                    }
-                # Parameter für die Grobid API
-                params = {
-                    'consolidateHeader': '1', # Versucht Metadaten zu verbessern
-                    'segmentSentences': 'true' # Segmentiert den Text in Sätze (<s> Tags)
-                }
-
-                # Sende die Anfrage an Grobid
-                start_time = time.time()
-                response = requests.post(grobid_url, files=files, data=params, timeout=300) # Timeout erhöhen (Sekunden)
-                end_time = time.time()
-
+                files = {'input': (filename, f, 'application/pdf')}
+                response = session.post(f"{base_url}/api/processFulltextDocument",
+                                        files=files, data=params, timeout=request_timeout)
+            if response.status_code == 503 and attempt < max_retries:
+                # GROBID ist ausgelastet (alle Worker belegt) -> später erneut versuchen
+                time.sleep(_backoff_delay(attempt, response))
+                continue
             # Überprüfe, ob die Anfrage erfolgreich war (Status Code 200)
             response.raise_for_status()
 
             # Speichere die XML-Antwort
             with open(output_xml_path, 'w', encoding='utf-8') as out_f:
                 out_f.write(response.text)
-
-            processing_time = end_time - start_time
-            print(f"    -> Success! Saved XML to '{output_xml_path}' (Time: {processing_time:.2f}s)")
+            result["ok"] = True
+            break
 
         except requests.exceptions.Timeout:
-             print(f"    -> Error: Request timed out for {filename}. Grobid braucht möglicherweise länger oder die PDF ist sehr komplex.")
+            # Eine sehr komplexe PDF läuft meist wieder in den Timeout -> nur begrenzt wiederholen
+            result["error"] = "Request timed out. Grobid braucht möglicherweise länger oder die PDF ist sehr komplex."
+            timeouts += 1
+            if timeouts > timeout_retries:
+                break
+            if attempt < max_retries:
+                time.sleep(_backoff_delay(attempt))
+                continue
+        except requests.exceptions.ConnectionError as e:
+            # Vorübergehend wie ein 503: GROBID ist neu gestartet oder (noch) nicht erreichbar
+            result["error"] = f"Connection error: {e}"
+            if attempt < max_retries:
+                time.sleep(_backoff_delay(attempt))
+                continue
         except requests.exceptions.RequestException as e:
-            print(f"    -> Error processing {filename}: {e}")
-            # Optional: Detailliertere Fehlermeldung ausgeben, falls vorhanden
-            try:
-                error_detail = response.text
-                print(f"       Grobid Response: {error_detail[:500]}...") # Zeige Anfang der Antwort
-            except:
-                pass # Falls keine Antwort verfügbar
+            result["error"] = str(e)
+            if response is not None:
+                result["error"] += f" | Grobid Response: {response.text[:500]}..." # Zeige Anfang der Antwort
+            break
         except Exception as e:
-             print(f"    -> An unexpected error occurred for {filename}: {e}")
+            result["error"] = f"An unexpected error occurred: {e}"
+            break
+
+    result["seconds"] = time.time() - start_time
+    return result
+
+
+def select_pending_pdfs(manifest, input_dir=pdf_directory, force=False):
+    """ Ermittelt neue/geänderte PDFs und räumt XML-Ausgaben gelöschter PDFs auf. """
+    filenames = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(".pdf"))
+    for stale_name in manifest.stale_inputs("grobid", filenames):
+        print(f"  PDF removed: {stale_name}")
+        manifest.remove_outputs("grobid", stale_name)
+
+    pending = []
+    hashes = {}
+    for filename in filenames:
+        content_hash = manifest.content_hash("grobid", filename, os.path.join(input_dir, filename))
+        hashes[filename] = content_hash
+        if force or not manifest.is_current("grobid", filename, content_hash):
+            pending.append(filename)
+    print(f"{len(pending)} of {len(filenames)} PDFs are new or changed.")
+    return pending, hashes
+
+
+def process_directory(base_url, concurrency=grobid_concurrency, input_dir=pdf_directory, output_dir=output_directory,
+                      filenames=None, manifest=None, hashes=None):
+    """ Verarbeitet alle (oder die angegebenen) PDFs mit bis zu `concurrency` parallelen Anfragen. """
+    if filenames is None:
+        filenames = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(".pdf"))
+    session = create_session(concurrency)
+    results = []
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(process_pdf, session, filename, base_url, input_dir, output_dir)
+                   for filename in filenames]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["ok"]:
+                if manifest is not None:
+                    pdf_path = os.path.join(input_dir, result["filename"])
+                    manifest.record("grobid", result["filename"], hashes[result["filename"]],
+                                    input_paths=[pdf_path], outputs=[result["output"]])
+                retries_note = f", {result['attempts'] - 1} retries" if result["attempts"] > 1 else ""
+                print(f"  -> Success: {result['filename']} -> '{result['output']}' "
+                      f"(Time: {result['seconds']:.2f}s{retries_note})")
+            else:
+                print(f"  -> Error processing {result['filename']}: {result['error']}")
+    session.close()
+
+    elapsed = time.time() - start_time
+    succeeded = [r for r in results if r["ok"]]
+    total_mb = sum(r["bytes"] for r in succeeded) / (1024 * 1024)
+    print(f"\nProcessed {len(succeeded)}/{len(results)} PDFs in {elapsed:.2f}s "
+          f"(concurrency {concurrency}).")
+    if elapsed > 0 and succeeded:
+        print(f"Throughput: {len(succeeded) / elapsed:.2f} PDFs/s, {total_mb / elapsed:.2f} MB/s, "
+              f"avg. {sum(r['seconds'] for r in succeeded) / len(succeeded):.2f}s per PDF")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sendet PDFs an GROBID und speichert TEI-XML.")
+    parser.add_argument("--concurrency", type=int, default=grobid_concurrency,
+                        help="Anzahl paralleler Anfragen (= GROBID Worker-Pool-Größe)")
+    parser.add_argument("--grobid-url", default=grobid_base_url, help="Basis-URL des GROBID-Servers")
+    parser.add_argument("--input-dir", default=pdf_directory)
+    parser.add_argument("--output-dir", default=output_directory)
+    parser.add_argument("--force", action="store_true", help="Alle PDFs neu verarbeiten, auch unveränderte")
+    args = parser.parse_args()
+
+    with create_session(1) as session:
+        if not check_grobid_alive(session, args.grobid_url):
+            exit() # Beenden, wenn Grobid nicht läuft
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+        print(f"Created output directory: {args.output_dir}")
+
+    if not os.path.exists(args.input_dir):
+        print(f"Error: Input PDF directory '{args.input_dir}' not found.")
+        print("Bitte erstelle den Ordner und lege PDFs hinein.")
+        exit()
+
+    print(f"Starting PDF processing from '{args.input_dir}'...")
+    manifest = PipelineManifest()
+    pending, hashes = select_pending_pdfs(manifest, args.input_dir, args.force)
+    try:
+        process_directory(args.grobid_url, args.concurrency, args.input_dir, args.output_dir,
+                          filenames=pending, manifest=manifest, hashes=hashes)
+    finally:
+        manifest.save()
+
+    print("\nGrobid processing finished.")
+    print(f"XML outputs are in the '{args.output_dir}' folder.")
+
 
-print("\nGrobid processing finished.")
-print(f"XML outputs are in the '{output_directory}' folder.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
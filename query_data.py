@@ -1,8 +1,10 @@
 import os
-import json
 import chromadb
 from sentence_transformers import SentenceTransformer
 import pprint
+from chunk_store import get_chunk_text, get_default_store # Gemeinsamer O(1)-Lookup der Chunk-Texte
+from lexical_index import get_default_index, reciprocal_rank_fusion
+from vector_index import VectorIndex
 
 # --- Konfiguration ---
 chroma_db_path = "chroma_db" # Pfad zur gespeicherten ChromaDB
@@ -16,23 +18,36 @@ chunks_input_directory = "chunks_output"
 user_query = "What were the results regarding CAR T cell persistence?"
 # Anzahl der Top-Ergebnisse, die zurückgegeben werden sollen
 top_k = 5
+# "chroma" oder "numpy" (In-Process-Index aus vector_index.py), siehe app.py
+retrieval_backend = "chroma"
+# Vektor- und BM25-Ranking per Reciprocal Rank Fusion kombinieren (falls der lexikalische Index existiert)
+hybrid_retrieval = True
+hybrid_candidates = 20
 # --------------------
 
 # --- Initialisierung ---
-print("Initializing ChromaDB client...")
-try:
-    client = chromadb.PersistentClient(path=chroma_db_path)
-except Exception as e:
-    print(f"Error initializing ChromaDB client at path '{chroma_db_path}': {e}")
-    exit()
-
-print(f"Getting collection: {collection_name}")
-try:
-    collection = client.get_collection(name=collection_name)
-except Exception as e:
-    print(f"Error getting collection '{collection_name}'. Does it exist in '{chroma_db_path}'?")
-    print(f"Error details: {e}")
-    exit()
+if retrieval_backend == "numpy":
+    print("Loading in-process vector index...")
+    try:
+        collection = VectorIndex()
+    except Exception as e:
+        print(f"Error loading vector index. Did you run 'python vector_index.py'? Error details: {e}")
+        exit()
+else:
+    print("Initializing ChromaDB client...")
+    try:
+        client = chromadb.PersistentClient(path=chroma_db_path)
+    except Exception as e:
+        print(f"Error initializing ChromaDB client at path '{chroma_db_path}': {e}")
+        exit()
+
+    print(f"Getting collection: {collection_name}")
+    try:
+        collection = client.get_collection(name=collection_name)
+    except Exception as e:
+        print(f"Error getting collection '{collection_name}'. Does it exist in '{chroma_db_path}'?")
+        print(f"Error details: {e}")
+        exit()
 
 print(f"Loading sentence transformer model: {model_name}")
 try:
@@ -53,22 +68,35 @@ print(f"\nUser Query: '{user_query}'")
 print("Generating embedding for the query...")
 query_embedding = model.encode(user_query).tolist()
 
-print(f"Querying ChromaDB for top {top_k} most similar chunks...")
+lexical = get_default_index() if hybrid_retrieval else None
+print(f"Querying {retrieval_backend} for top {top_k} most similar chunks{' (hybrid with BM25)' if lexical else ''}...")
 try:
     results = collection.query(
         query_embeddings=[query_embedding],
-        n_results=top_k,
+        n_results=hybrid_candidates if lexical else top_k,
         include=['metadatas', 'distances'] # 'documents' holen wir selbst
     )
 except Exception as e:
     print(f"Error querying ChromaDB collection: {e}")
     exit()
 
+if lexical and results and results.get('ids'):
+    # Fusion: Chunks, die nur lexikalisch gefunden wurden, haben keine Distanz
+    dense_hits = {chunk_id: (metadata, distance) for chunk_id, metadata, distance
+                  in zip(results['ids'][0], results['metadatas'][0], results['distances'][0])}
+    lexical_ids = [chunk_id for chunk_id, _ in lexical.search(user_query, hybrid_candidates)]
+    fused_ids = [chunk_id for chunk_id, _ in reciprocal_rank_fusion([results['ids'][0], lexical_ids], limit=top_k)]
+    for chunk_id, (_, metadata) in get_default_store().get_many(
+            [chunk_id for chunk_id in fused_ids if chunk_id not in dense_hits]).items():
+        dense_hits[chunk_id] = (metadata, None)
+    fused_ids = [chunk_id for chunk_id in fused_ids if chunk_id in dense_hits]
+    results = {'ids': [fused_ids],
+               'metadatas': [[dense_hits[chunk_id][0] for chunk_id in fused_ids]],
+               'distances': [[dense_hits[chunk_id][1] for chunk_id in fused_ids]]}
+
 # --- Ergebnisse verarbeiten und Text nachladen ---
 print("\nQuery Results:")
 
-loaded_chunks_cache = {} # Cache für geladene JSON-Dateien
-
 if results and results.get('ids') and results['ids'][0]:
     num_results_found = len(results['ids'][0])
     print(f"Found {num_results_found} results:")
@@ -77,56 +105,14 @@ if results and results.get('ids') and results['ids'][0]:
         distance = results['distances'][0][i]
         metadata = results['metadatas'][0][i]
         doc_id = results['ids'][0][i]
-        document_text = "Error: Text not found." # Standardwert
-
-        source_file = metadata.get('source_file')
-        if source_file:
-            # Rekonstruiere den Namen der JSON-Datei
-            json_filename = source_file.replace(".pdf", "_chunks.json")
-            chunks_json_path = os.path.join(chunks_input_directory, json_filename)
-
-            try:
-                # Lade Chunk-Daten aus Cache oder Datei
-                if chunks_json_path not in loaded_chunks_cache:
-                    print(f"    (Loading chunks from {json_filename}...)")
-                    if os.path.exists(chunks_json_path):
-                        with open(chunks_json_path, 'r', encoding='utf-8') as f_json:
-                            loaded_chunks_cache[chunks_json_path] = json.load(f_json)
-                    else:
-                         loaded_chunks_cache[chunks_json_path] = None # Markiere als nicht gefunden
-
-                # Hole Daten aus Cache
-                chunks_list = loaded_chunks_cache.get(chunks_json_path)
-
-                if chunks_list:
-                    # Finde den passenden Chunk anhand der Metadaten
-                    found_chunk = None
-                    for chunk in chunks_list:
-                        # Vergleiche die Metadaten-Dictionaries
-                        if chunk.get('metadata') == metadata:
-                            found_chunk = chunk
-                            break
-
-                    if found_chunk:
-                        document_text = found_chunk.get('text', "Error: Text key missing in chunk.")
-                    else:
-                        document_text = "Error: Matching chunk not found in JSON."
-                else:
-                     document_text = f"Error: Chunks file '{json_filename}' not found or empty."
-
-            except json.JSONDecodeError:
-                document_text = f"Error: Could not decode JSON from '{json_filename}'."
-            except Exception as e:
-                 document_text = f"Error loading/processing chunks file: {e}"
-        else:
-            document_text = "Error: 'source_file' missing in metadata."
-
+        # Text über den gemeinsamen Chunk Store nachladen (Lookup per Chunk-ID)
+        document_text = get_chunk_text(doc_id, metadata)
 
         # --- Ausgabe ---
         print("-" * 20)
         print(f"Rank {i+1}:")
         print(f"  ID: {doc_id}")
-        print(f"  Distance: {distance:.4f}")
+        print(f"  Distance: {distance:.4f}" if distance is not None else "  Distance: - (lexical match only)")
         print(f"  Metadata:")
         pprint.pprint(metadata, indent=4)
         print(f"  Retrieved Text: {document_text[:500]}...") # Zeige Anfang des Textes
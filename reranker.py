@@ -0,0 +1,102 @@
+import time
+import hashlib
+import threading
+from byte_lru_cache import ByteLRUCache
+from answer_cache import normalize_query
+
+# --- Konfiguration ---
+reranker_model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2' # Klein genug für CPU
+rerank_batch_size = 64 # Paare pro Forward-Pass (alle Kandidaten einer Frage passen meist in einen)
+pair_cache_max_bytes = 8 * 1024 * 1024 # Gecachte Scores (Frage, Chunk) -> float
+warmup_pairs = 32 # Paare voller Länge für die erste Laufzeitmessung
+probe_every = 20 # Passt kein einziges Paar ins Budget, wird trotzdem jede n-te Frage ein Paar gemessen
+# --------------------
+
+# Ein Cross-Encoder bewertet (Frage, Chunk)-Paare gemeinsam und ist damit deutlich
+# genauer als der Bi-Encoder, aber auch teurer. Deshalb wird er nur auf die
+# vorab geholten Kandidaten angewendet. Die Laufzeit pro Paar wird gemessen
+# (gleitender Mittelwert); würde das Reranking aller Kandidaten das Zeitbudget
+# sprengen, werden nur die vordersten Kandidaten neu sortiert, so viele wie ins Budget
+# passen (der Rest folgt in der ursprünglichen Reihenfolge). Jeder Aufruf misst dabei
+# weiter, sodass sich eine zu pessimistische Schätzung wieder erholt.
+
+_WARMUP_PASSAGE = " ".join(["The kinase inhibitor reduced phosphorylation of the target protein in vitro."] * 40)
+
+
+def query_key(query):
+    return hashlib.blake2b(normalize_query(query).encode('utf-8'), digest_size=16).digest()
+
+
+class Reranker:
+    def __init__(self, model_name=reranker_model_name, batch_size=rerank_batch_size,
+                 cache_max_bytes=pair_cache_max_bytes):
+        from sentence_transformers import CrossEncoder # Nur laden, wenn Reranking aktiv ist
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+        self.pair_cache = ByteLRUCache(cache_max_bytes)
+        self._lock = threading.Lock()
+        self.seconds_per_pair = None # Gleitender Mittelwert der gemessenen Laufzeit
+        self.reranked = 0
+        self.partial = 0
+        self.skipped = 0
+        # Lazy-Init des Modells (ungemessen), danach die erste Messung mit realistisch langen Paaren
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        self._predict([("effect of kinase inhibitors on phosphorylation", _WARMUP_PASSAGE)] * warmup_pairs)
+
+    def _predict(self, pairs):
+        start_time = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        per_pair = (time.perf_counter() - start_time) / len(pairs)
+        with self._lock:
+            self.seconds_per_pair = (per_pair if self.seconds_per_pair is None
+                                     else 0.8 * self.seconds_per_pair + 0.2 * per_pair)
+        return scores
+
+    def rerank(self, query, candidates, k, budget_seconds=None):
+        """ Sortiert candidates (Liste von (chunk_id, text)) nach Cross-Encoder-Score.
+
+        Gibt [(Index in candidates, Score)] für die besten k zurück. Passt nicht alles ins
+        Zeitbudget, werden nur die vordersten Kandidaten neu sortiert; die übrigen folgen
+        in der ursprünglichen Reihenfolge mit Score None. None, wenn das Reranking ganz
+        übersprungen wurde.
+        """
+        if not candidates:
+            return []
+        key = query_key(query)
+        scores = [self.pair_cache.get((key, chunk_id, hash(text))) for chunk_id, text in candidates]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        limit = len(candidates) # Nur candidates[:limit] werden neu sortiert
+        if (missing and budget_seconds is not None and self.seconds_per_pair is not None
+                and len(missing) * self.seconds_per_pair > budget_seconds):
+            affordable = int(budget_seconds / self.seconds_per_pair)
+            with self._lock:
+                if affordable == 0:
+                    self.skipped += 1
+                    if self.skipped % probe_every:
+                        return None
+                    affordable = 1 # Stichprobe, damit die Schätzung nicht für immer zu hoch bleibt
+                self.partial += 1
+            limit = missing[affordable] # Erster fehlender Kandidat, der nicht mehr ins Budget passt
+            missing = missing[:affordable]
+        if missing:
+            # Alle (noch ins Budget passenden) fehlenden Paare in einem gebatchten Forward-Pass
+            computed = self._predict([(query, candidates[i][1]) for i in missing])
+            for i, score in zip(missing, computed):
+                scores[i] = float(score)
+                chunk_id, text = candidates[i]
+                self.pair_cache.put((key, chunk_id, hash(text)), scores[i])
+        with self._lock:
+            self.reranked += 1
+        order = sorted(range(limit), key=lambda i: scores[i], reverse=True) + list(range(limit, len(candidates)))
+        return [(i, scores[i] if i < limit else None) for i in order[:k]]
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "reranked": self.reranked,
+            "partially_reranked": self.partial,
+            "skipped_over_budget": self.skipped,
+            "ms_per_pair": self.seconds_per_pair * 1000 if self.seconds_per_pair is not None else None,
+            "pair_cache": self.pair_cache.stats(),
+        }
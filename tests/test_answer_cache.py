@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache, IndexVersions
+from pipeline_manifest import PipelineManifest
+
+
+def result(answer, *source_files):
+    return {"answer": answer, "sources": [{"source_file": source_file} for source_file in source_files]}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = PipelineManifest(str(tmp_path / "manifest.json"))
+    manifest.record("index", "a", "h1", source_file="a.pdf")
+    manifest.record("index", "b", "h1", source_file="b.pdf")
+    manifest.save()
+    return manifest
+
+
+@pytest.fixture
+def cache(manifest):
+    return AnswerCache(threshold=0.9, index_versions=IndexVersions(manifest.path))
+
+
+def test_exact_and_semantic_hits(cache):
+    cache.put("What is p53?", np.array([1.0, 0.0]), result("tumour suppressor", "a.pdf"))
+    cached, similarity, _ = cache.get("  what is P53? ")
+    assert cached["answer"] == "tumour suppressor" and similarity == 1.0
+
+    cached, similarity, vector = cache.get("p53 function?", lambda query: np.array([0.99, 0.1]))
+    assert cached["answer"] == "tumour suppressor" and similarity > 0.9
+    assert cache.get("BRCA1?", lambda query: np.array([0.0, 1.0]))[0] is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["semantic_hits"] == 1
+
+
+def test_scope_must_match(cache):
+    cache.put("q", np.array([1.0, 0.0]), result("scoped", "a.pdf"), scope="x")
+    assert cache.get("q", scope="y")[0] is None
+    assert cache.get("q", scope="x")[0]["answer"] == "scoped"
+
+
+def test_reindexing_a_source_invalidates(cache, manifest):
+    cache.put("q1", None, result("from a", "a.pdf"))
+    cache.put("q2", None, result("from b", "b.pdf"))
+    manifest.record("index", "a", "h2", source_file="a.pdf")
+    manifest.save()
+    stat = os.stat(manifest.path) # mtime sicher verändern (grobe Zeitstempel-Auflösung mancher Dateisysteme)
+    os.utime(manifest.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get("q1")[0] is None
+    assert cache.get("q2")[0]["answer"] == "from b"
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_versions_are_read_outside_the_lock(cache):
+    calls = []
+    versions = cache.index_versions
+
+    class CheckingVersions:
+        def current(self):
+            calls.append(cache._lock.locked())
+            return versions.current()
+
+        def snapshot(self, source_files):
+            return versions.snapshot(source_files)
+
+    cache.index_versions = CheckingVersions()
+    cache.put("q", np.array([1.0, 0.0]), result("a", "a.pdf"))
+    cache.get("q")
+    cache.get("similar", lambda query: np.array([1.0, 0.05]))
+    assert calls and not any(calls)
+
+
+def test_results_are_copied(cache):
+    stored = result("original", "a.pdf")
+    cache.put("q", None, stored)
+    stored["answer"] = "changed by caller"
+    stored["sources"].append({"source_file": "b.pdf"})
+
+    cached = cache.get("q")[0]
+    assert cached == result("original", "a.pdf")
+    cached["sources"][0]["source_file"] = "changed again"
+    assert cache.get("q")[0] == result("original", "a.pdf")
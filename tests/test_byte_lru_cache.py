@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+from byte_lru_cache import ByteLRUCache, estimate_size
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ByteLRUCache(30, sizeof=len)
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 10)
+    cache.put("c", "x" * 10)
+    assert cache.get("a") == "x" * 10 # "a" ist jetzt der jüngste Eintrag
+    cache.put("d", "x" * 5)
+    assert cache.get("b") is None
+    assert [key for key in ("a", "c", "d") if cache.get(key) is not None] == ["a", "c", "d"]
+    assert cache.current_bytes == 25 and cache.stats()["evictions"] == 1
+
+    cache.put("e", "x" * 20) # verdrängt mehrere Einträge auf einmal
+    assert len(cache) == 2 and cache.current_bytes == 25
+    assert cache.get("a") is None and cache.get("c") is None
+
+
+def test_oversized_entry_is_not_cached():
+    cache = ByteLRUCache(10, sizeof=len)
+    cache.put("small", "x" * 4)
+    cache.put("huge", "x" * 11)
+    assert cache.get("huge") is None and cache.get("small") == "x" * 4
+    assert cache.current_bytes == 4
+
+
+def test_replacing_a_key_updates_the_byte_count():
+    cache = ByteLRUCache(100, sizeof=len)
+    cache.put("a", "x" * 40)
+    cache.put("a", "x" * 10)
+    assert len(cache) == 1 and cache.current_bytes == 10
+    cache.invalidate("a")
+    assert cache.current_bytes == 0 and cache.stats()["invalidations"] == 1
+
+
+def test_mtime_mismatch_invalidates():
+    cache = ByteLRUCache(100, sizeof=len)
+    cache.put("a", "old", mtime=1)
+    assert cache.get("a", mtime=1) == "old"
+    assert cache.get("a", mtime=2) is None
+    assert len(cache) == 0 and cache.stats()["invalidations"] == 1
+
+
+def test_get_or_load_follows_file_changes(tmp_path):
+    path = str(tmp_path / "chunks.json")
+    loads = []
+
+    def loader(file_path):
+        loads.append(file_path)
+        with open(file_path, encoding='utf-8') as f:
+            return f.read()
+
+    cache = ByteLRUCache(1024)
+    assert cache.get_or_load(path, path, loader) is None # fehlt -> None, ohne loader
+    assert loads == []
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("v1")
+    assert cache.get_or_load(path, path, loader) == "v1"
+    assert cache.get_or_load(path, path, loader) == "v1"
+    assert len(loads) == 1
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("v2")
+    stat = os.stat(path) # mtime sicher verändern (grobe Zeitstempel-Auflösung mancher Dateisysteme)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get_or_load(path, path, loader) == "v2"
+    assert len(loads) == 2
+
+    os.remove(path)
+    assert cache.get_or_load(path, path, loader) is None
+    assert len(loads) == 2
+
+
+def test_estimate_size_counts_nested_values_and_arrays():
+    text = "x" * 1000
+    assert estimate_size({"text": text}) > estimate_size(text) >= 1000
+    assert estimate_size([text, text]) > 2000
+    assert estimate_size(np.zeros(256, dtype=np.float32)) >= 1024
@@ -0,0 +1,35 @@
+import os
+
+from chunk_store import ChunkStore
+
+
+def chunk(text):
+    return {"text": text, "metadata": {"chunk_type": "paragraph"}}
+
+
+def test_source_files_cache_follows_writes(tmp_path):
+    path = str(tmp_path / "chunk_store.sqlite")
+    writer = ChunkStore(path, readonly=False)
+    writer.replace_document("b.pdf", [chunk("B")])
+    reader = ChunkStore(path, readonly=True)
+    assert reader.source_files() == ["b.pdf"]
+
+    # Zweiter Aufruf ohne Änderung kommt aus dem Cache (keine Abfrage)
+    queries = []
+    reader._connection().set_trace_callback(queries.append)
+    assert reader.source_files() == ["b.pdf"]
+    assert queries == []
+
+    writer.replace_document("a.pdf", [chunk("A1"), chunk("A2")])
+    assert reader.source_files() == ["a.pdf", "b.pdf"]
+    assert len(queries) == 1
+
+    writer.delete_document("b.pdf")
+    assert reader.source_files() == ["a.pdf"]
+    writer.close()
+    reader.close()
+
+
+def test_source_files_without_store(tmp_path):
+    reader = ChunkStore(os.path.join(tmp_path, "missing.sqlite"), readonly=True)
+    assert reader.source_files() == []
@@ -0,0 +1,81 @@
+from chunker import Paragraph, chunk_sections, count_tokens, pack_sentences
+
+
+def sentence(label, words):
+    """ Satz mit eindeutiger Kennung und bekannter Länge: label + words Wörter + Punkt. """
+    return f"{label} " + " ".join(["word"] * words) + "."
+
+
+def section(index, label, section_id, count, words=8, heading="Methods"):
+    sentences = [sentence(f"{label}{i}", words) for i in range(count)]
+    return Paragraph(index, " ".join(sentences), heading, sentences, section_id)
+
+
+def labels(chunk):
+    return [part.split()[0] for part in chunk["text"].replace("\n", " ").split(".") if part.strip()]
+
+
+def test_pack_sentences_budget_and_overlap():
+    units = [(f"s{i}", tokens, 0) for i, tokens in enumerate([30, 30, 30, 30, 30, 30, 30, 30])]
+    windows = pack_sentences(units, max_tokens=100, overlap_tokens=40)
+    assert [[unit[0] for unit in window] for window in windows] == [
+        ["s0", "s1", "s2"], ["s2", "s3", "s4"], ["s4", "s5", "s6"], ["s6", "s7"]]
+    for previous, window in zip(windows, windows[1:]):
+        carried = [unit for unit in window if unit in previous]
+        assert carried == previous[-len(carried):] and sum(unit[1] for unit in carried) <= 40
+    assert all(sum(unit[1] for unit in window) <= 100 for window in windows)
+
+
+def test_pack_sentences_drops_overlap_that_would_not_fit():
+    windows = pack_sentences([("a", 20, 0), ("b", 90, 0)], max_tokens=100, overlap_tokens=40)
+    assert [[unit[0] for unit in window] for window in windows] == [["a"], ["b"]]
+    assert pack_sentences([], 100, 40) == []
+
+
+def test_windows_never_cross_section_boundaries():
+    abstract = Paragraph(None, "Short abstract. It has two sentences.", "Abstract",
+                         ["Short abstract.", "It has two sentences."])
+    paragraphs = [
+        section(0, "A", 0, 12),
+        section(1, "B", 0, 3), # gleicher Abschnitt -> gemeinsame Fenster mit A
+        section(2, "C", 1, 4), # gleiche Überschrift, aber neues <div>
+        section(3, "D", None, 2, heading=""),
+        section(4, "E", None, 2, heading=""),
+    ]
+    chunks = chunk_sections("paper.pdf", "Title", abstract, paragraphs, max_tokens=50, overlap_tokens=12)
+
+    assert chunks[0]["metadata"] == {"source_file": "paper.pdf", "title": "Title", "chunk_type": "abstract",
+                                     "section": "Abstract", "token_count": count_tokens(abstract.text)}
+    assert chunks[0]["text"] == "Short abstract. It has two sentences."
+    groups = [{label[0] for label in labels(chunk)} for chunk in chunks[1:]]
+    assert all(group <= {"A", "B"} or group == {"C"} or group <= {"D", "E"} for group in groups)
+    assert {"A", "B"} in groups and {"D", "E"} in groups
+
+    for chunk in chunks:
+        assert chunk["metadata"]["token_count"] <= 50
+        assert chunk["metadata"]["token_count"] == count_tokens(chunk["text"])
+    c_chunks = [chunk for chunk in chunks if labels(chunk)[0].startswith("C")]
+    assert [chunk["metadata"]["paragraph_index"] for chunk in c_chunks] == [2] * len(c_chunks)
+    # Jeder Satz kommt vor, überlappende Fenster wiederholen nur Sätze desselben Abschnitts
+    seen = [label for chunk in chunks[1:] for label in labels(chunk)]
+    expected = [f"{p}{i}" for p, n in zip("ABCDE", (12, 3, 4, 2, 2)) for i in range(n)]
+    assert list(dict.fromkeys(seen)) == expected
+
+
+def test_overlap_between_consecutive_windows():
+    chunks = chunk_sections("paper.pdf", "Title", None, [section(0, "A", 0, 20)], max_tokens=50, overlap_tokens=12)
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        before, after = labels(previous), labels(chunk)
+        assert after[0] == before[-1] # Ein Satz (11 Tokens) passt in den Überlapp von 12
+        assert after[1] not in before
+
+
+def test_paragraphs_joined_with_newline_and_long_sentences_split():
+    paragraphs = [Paragraph(0, "First one.", "Intro", [], 0),
+                  Paragraph(1, "Second one.", "Intro", [], 0),
+                  Paragraph(2, " ".join(["long"] * 30), "Intro", [], 0)]
+    chunks = chunk_sections("paper.pdf", "Title", None, paragraphs, max_tokens=12, overlap_tokens=0)
+    assert chunks[0]["text"] == "First one.\nSecond one."
+    assert [chunk["text"].split() for chunk in chunks[1:]] == [["long"] * 12, ["long"] * 12, ["long"] * 6]
+    assert [chunk["metadata"]["paragraph_index"] for chunk in chunks] == [0, 2, 2, 2]
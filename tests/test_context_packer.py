@@ -0,0 +1,75 @@
+from chunker import count_tokens
+from context_packer import best_sentences, pack_context
+
+
+def chunk(chunk_id, text, location="Paragraph 1"):
+    return {"id": chunk_id, "source_file": chunk_id.rpartition("_chunk_")[0], "location": location, "text": text}
+
+
+def filler(label, sentences):
+    return " ".join(f"Filler {label}{i} talks about something else entirely." for i in range(sentences))
+
+
+def test_everything_fits():
+    chunks = [chunk("a.pdf_chunk_3", "Kinases phosphorylate proteins."), chunk("b.pdf_chunk_0", "p53 is a tumour suppressor.")]
+    context, used_indices, used = pack_context("kinase", chunks, budget=200)
+    assert used_indices == [0, 1]
+    assert context == ("Source: a.pdf, Paragraph 1:\nKinases phosphorylate proteins.\n"
+                       "\n---\nSource: b.pdf, Paragraph 1:\np53 is a tumour suppressor.\n")
+    assert used == sum(count_tokens(c["text"]) + count_tokens(f"Source: {c['source_file']}, {c['location']}:")
+                       for c in chunks)
+
+
+def test_budget_is_respected_with_excerpts():
+    relevant = "Telomerase keeps telomeres long in stem cells."
+    big = filler("x", 10) + " " + relevant + " " + filler("y", 10)
+    chunks = [chunk("a.pdf_chunk_0", filler("a", 6)), chunk("b.pdf_chunk_0", big), chunk("c.pdf_chunk_0", filler("c", 30))]
+    context, used_indices, used = pack_context("telomerase telomeres", chunks, budget=150)
+    assert used <= 150
+    assert used_indices == [0, 1] # c passt nicht und hat keine Sätze mit Query-Begriffen
+    assert f"… {relevant} …" in context
+    assert "Filler x0" not in context
+
+
+def test_small_remaining_budget_skips_excerpts():
+    chunks = [chunk("a.pdf_chunk_0", filler("a", 10)), chunk("b.pdf_chunk_0", "Telomerase. " + filler("b", 10))]
+    budget = count_tokens(chunks[0]["text"]) + count_tokens("Source: a.pdf, Paragraph 1:") + 20
+    _, used_indices, _ = pack_context("telomerase", chunks, budget=budget)
+    assert used_indices == [0]
+
+
+def test_best_sentences_keeps_document_order():
+    text = "Alpha talks kinase. Beta is filler. Gamma mentions kinase and ATP. Delta is filler."
+    excerpt, tokens = best_sentences("kinase ATP", text, budget=100)
+    assert excerpt == "Alpha talks kinase. … Gamma mentions kinase and ATP. …"
+    assert tokens == count_tokens("Alpha talks kinase.") + count_tokens("Gamma mentions kinase and ATP.")
+    assert best_sentences("unrelated", text, budget=100) == ("", 0)
+
+
+def test_duplicates_and_errors_are_skipped():
+    text = filler("a", 20)
+    # Ein Wort anders: Jaccard 25/27 >= dedupe_threshold
+    chunks = [chunk("a.pdf_chunk_0", text), chunk("a_copy.pdf_chunk_7", text.replace("a19", "z19")),
+              chunk("b.pdf_chunk_0", "Error: Chunk text not found."), chunk("c.pdf_chunk_0", "")]
+    context, used_indices, _ = pack_context("something", chunks, budget=1000)
+    assert used_indices == [0]
+    assert "a_copy.pdf" not in context and "Error:" not in context
+
+
+def test_adjacent_chunks_are_stitched_without_repeating_the_overlap():
+    overlap = "Shared sentence at the window border."
+    chunks = [
+        chunk("b.pdf_chunk_9", "Best hit from another paper."),
+        chunk("a.pdf_chunk_2", f"{overlap} Third window text."),
+        chunk("a.pdf_chunk_1", f"Second window text. {overlap}", location="Paragraph 4"),
+        chunk("a.pdf_chunk_5", "Distant window."),
+    ]
+    context, used_indices, _ = pack_context("window", chunks, budget=1000)
+    assert used_indices == [0, 1, 2, 3]
+    blocks = context.split("\n---\n")
+    assert blocks == [
+        "Source: b.pdf, Paragraph 1:\nBest hit from another paper.\n",
+        f"Source: a.pdf, Paragraph 4:\nSecond window text. {overlap} Third window text.\n",
+        "Source: a.pdf, Paragraph 1:\nDistant window.\n",
+    ]
+    assert context.count(overlap) == 1
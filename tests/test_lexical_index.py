@@ -0,0 +1,124 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import lexical_index
+from chunk_store import ChunkStore, make_chunk_id
+from lexical_index import LexicalIndex, build_index, tokenize
+
+# Zipf-verteiltes Vokabular: die ersten Wörter sind häufige Terms (> common_term_fraction), der Rest selten
+VOCABULARY = [f"w{i}" for i in range(300)]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    weights = 1.0 / np.arange(1, len(VOCABULARY) + 1)
+    weights /= weights.sum()
+    directory = tmp_path_factory.mktemp("lexical")
+    store = ChunkStore(str(directory / "chunk_store.sqlite"), readonly=False)
+    docs = {}
+    for paper in range(4):
+        chunks = []
+        for i in range(150):
+            words = rng.choice(VOCABULARY, size=int(rng.integers(5, 60)), p=weights)
+            metadata = {"source_file": f"paper{paper}.pdf", "chunk_type": "abstract" if i % 6 == 0 else "paragraph"}
+            chunks.append({"text": "The " + " ".join(words) + ".", "metadata": metadata})
+            docs[make_chunk_id(f"paper{paper}.pdf", i)] = (tokenize(chunks[-1]["text"]), metadata)
+        store.replace_document(f"paper{paper}.pdf", chunks)
+    store.close()
+    index_directory = str(directory / "index")
+    build_index(str(directory / "chunk_store.sqlite"), index_directory)
+    return LexicalIndex(index_directory), docs
+
+
+def brute_force(docs, query, allowed=None, k1=lexical_index.bm25_k1, b=lexical_index.bm25_b):
+    """ BM25 direkt nach Formel über alle (erlaubten) Dokumente. """
+    terms = set(tokenize(query))
+    avgdl = sum(len(tokens) for tokens, _ in docs.values()) / len(docs)
+    df = Counter(term for tokens, _ in docs.values() for term in set(tokens))
+    scores = {}
+    for chunk_id, (tokens, metadata) in docs.items():
+        if allowed is not None and not allowed(metadata):
+            continue
+        counts = Counter(tokens)
+        score = 0.0
+        for term in terms & counts.keys():
+            idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            tf = counts[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avgdl))
+        if score > 0:
+            scores[chunk_id] = score
+    return scores
+
+
+def assert_top_k(results, expected, k):
+    """ Gleiche Scores wie die Referenz und genau deren k besten Werte (Gleichstände in beliebiger Reihenfolge). """
+    assert [score for _, score in results] == pytest.approx(sorted(expected.values(), reverse=True)[:k], rel=1e-4)
+    for chunk_id, score in results:
+        assert expected[chunk_id] == pytest.approx(score, rel=1e-4)
+
+
+def document_frequency(docs, term):
+    return sum(term in tokens for tokens, _ in docs.values())
+
+
+def candidates_only(docs, expected, query):
+    """ Enthält die Anfrage seltene Terms, kommen nur Dokumente mit mindestens einem davon in Frage. """
+    max_df = lexical_index.common_term_fraction * len(docs)
+    rare = {term for term in tokenize(query) if 0 < document_frequency(docs, term) <= max_df}
+    if not rare:
+        return expected
+    return {chunk_id: score for chunk_id, score in expected.items() if rare & set(docs[chunk_id][0])}
+
+
+def test_vocabulary_has_common_and_rare_terms(corpus):
+    _, docs = corpus
+    max_df = lexical_index.common_term_fraction * len(docs)
+    assert document_frequency(docs, "w0") > max_df
+    assert 0 < document_frequency(docs, "w150") <= max_df
+
+
+@pytest.mark.parametrize("query", ["w120", "w120 w150 w200", "unknown w180"])
+def test_rare_terms_match_brute_force(corpus, query):
+    index, docs = corpus
+    assert_top_k(index.search(query, 10), brute_force(docs, query), 10)
+
+
+def test_common_only_query_matches_brute_force(corpus):
+    index, docs = corpus
+    assert_top_k(index.search("w0 w1 w2", 20), brute_force(docs, "w0 w1 w2"), 20)
+
+
+def test_common_terms_rescore_rare_candidates(corpus):
+    # Häufige Terms liefern keine eigenen Kandidaten, zählen aber für Dokumente mit seltenen Terms mit
+    index, docs = corpus
+    query = "w0 w1 w150 w160"
+    expected = brute_force(docs, query)
+    candidates = candidates_only(docs, expected, query)
+    assert len(candidates) < len(expected)
+    assert_top_k(index.search(query, 10), candidates, 10)
+
+
+@pytest.mark.parametrize("where", [
+    {"source_file": "paper2.pdf"},
+    {"$and": [{"source_file": {"$in": ["paper0.pdf", "paper3.pdf"]}}, {"chunk_type": "abstract"}]},
+])
+@pytest.mark.parametrize("query", ["w130 w170", "w0 w3", "w2 w140"])
+def test_where_masks_documents(corpus, where, query):
+    index, docs = corpus
+    fields = lexical_index.parse_where(where)
+    allowed = lambda metadata: all(metadata.get(field) in values for field, values in fields.items())
+    expected = candidates_only(docs, brute_force(docs, query, allowed), query)
+    results = index.search(query, 10, where)
+    assert results
+    assert all(allowed(docs[chunk_id][1]) for chunk_id, _ in results)
+    assert_top_k(results, expected, 10)
+
+
+def test_where_without_matches(corpus):
+    index, _ = corpus
+    assert index.search("w0 w150", 10, {"source_file": "missing.pdf"}) == []
+    assert index.allowed_docs(None) is None
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_backends
+from llm_backends import (BackendSaturated, ContentBlocked, FailoverBackend, GeminiBackend, LLMError,
+                          StubBackend, build_llm)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_backends, "llm_retry_base_delay", 0.001)
+
+
+def collect(backend, prompt="Frage"):
+    async def run():
+        return [text async for text in backend.stream(prompt)]
+    return "".join(asyncio.run(run()))
+
+
+class MidStreamFailure(StubBackend):
+    """ Liefert das erste Wort und bricht dann ab. """
+
+    async def _stream(self, prompt):
+        yield "Teil"
+        raise LLMError("Connection lost", retryable=True)
+
+
+class Blocked(StubBackend):
+    def _reply(self, prompt):
+        raise ContentBlocked("blocked")
+
+
+def test_retries_transient_errors():
+    backend = StubBackend(answer="ok", fail_times=2)
+    assert backend.generate("Frage") == "ok"
+    assert backend.counters["calls"] == 3 and backend.counters["retries"] == 2
+
+
+def test_gives_up_after_max_retries():
+    backend = StubBackend(fail_times=5, max_retries=2)
+    with pytest.raises(LLMError):
+        backend.generate("Frage")
+    assert backend.counters["calls"] == 3 and backend.counters["in_flight"] == 0
+
+
+def test_rate_limit_fails_over_and_cools_down():
+    primary = StubBackend(answer="primär", fail_times=1, rate_limited=True)
+    fallback = StubBackend(answer="lokal")
+    chain = FailoverBackend([primary, fallback])
+    assert chain.generate("Frage") == "lokal"
+    assert primary.counters["calls"] == 1 and not primary.available()
+    # Im Cooldown wird das erste Backend übersprungen
+    assert chain.generate("Frage") == "lokal"
+    assert primary.counters["calls"] == 1 and chain.failovers == 1
+
+
+def test_saturated_backend_fails_over_without_waiting():
+    slow = StubBackend(answer="langsam", delay=0.3, max_concurrency=1)
+    fast = StubBackend(answer="schnell")
+    chain = FailoverBackend([slow, fast])
+    busy = threading.Thread(target=slow.generate, args=("Frage",))
+    busy.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert chain.generate("Frage") == "schnell"
+    assert time.monotonic() - start < 0.2
+    assert slow.counters["rejected"] == 1
+    busy.join()
+
+
+def test_last_backend_waits_for_slot_then_rejects():
+    backend = StubBackend(delay=0.3, max_concurrency=1)
+    busy = threading.Thread(target=backend.generate, args=("Frage",))
+    busy.start()
+    time.sleep(0.05)
+    with pytest.raises(BackendSaturated):
+        backend.generate("Frage", wait=0.05)
+    busy.join()
+
+
+def test_content_blocked_does_not_fail_over():
+    fallback = StubBackend(answer="lokal")
+    with pytest.raises(ContentBlocked):
+        FailoverBackend([Blocked(), fallback]).generate("Frage")
+    assert fallback.counters["calls"] == 0
+
+
+def test_build_llm():
+    assert isinstance(build_llm(["stub"]), StubBackend)
+    chain = build_llm(["stub", "stub"], stub={"answer": "x"})
+    assert chain.name == "stub+stub" and chain.generate("Frage") == "x"
+    with pytest.raises(ValueError):
+        build_llm(["unbekannt"])
+
+
+def test_stream_retries_before_first_token():
+    backend = StubBackend(answer="a b c", fail_times=2)
+    assert collect(backend) == "a b c"
+    assert backend.counters["retries"] == 2
+
+
+def test_stream_fails_over_before_first_token():
+    chain = FailoverBackend([StubBackend(fail_times=5, max_retries=0), StubBackend(answer="vom Ersatz")])
+    assert collect(chain) == "vom Ersatz"
+    assert chain.failovers == 1
+
+
+def test_stream_does_not_fail_over_after_first_token():
+    fallback = StubBackend(answer="vom Ersatz")
+    chain = FailoverBackend([MidStreamFailure(max_retries=0), fallback])
+    parts = []
+
+    async def run():
+        async for text in chain.stream("Frage"):
+            parts.append(text)
+
+    with pytest.raises(LLMError):
+        asyncio.run(run())
+    assert parts == ["Teil"] and fallback.counters["calls"] == 0
+
+
+def test_stream_waits_for_slot_held_by_generate():
+    backend = StubBackend(answer="a b", delay=0.2, max_concurrency=1)
+    busy = threading.Thread(target=backend.generate, args=("Frage",))
+    busy.start()
+    time.sleep(0.05)
+    assert collect(backend) == "a b"
+    busy.join()
+    assert backend.counters["rejected"] == 0
+
+
+def test_cancelled_stream_releases_slot():
+    backend = StubBackend(answer="a", delay=0.2, max_concurrency=1)
+    busy = threading.Thread(target=backend.generate, args=("Frage",))
+    busy.start()
+    time.sleep(0.05)
+
+    async def cancel_while_waiting():
+        task = asyncio.ensure_future(collect_async(backend))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.3) # Der Executor-Thread bekommt den Slot und gibt ihn zurück
+
+    asyncio.run(cancel_while_waiting())
+    busy.join()
+    assert backend.generate("Frage", wait=0) == "a"
+
+
+async def collect_async(backend):
+    return [text async for text in backend.stream("Frage")]
+
+
+def _gemini_chunk(text=None, finish_reason="STOP", block_reason=0):
+    """ Antwort-Objekt wie vom Gemini-SDK: .text wirft ValueError, wenn der Chunk keinen Text hat. """
+    class Chunk:
+        prompt_feedback = SimpleNamespace(block_reason=block_reason)
+        candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name=finish_reason))]
+
+        @property
+        def text(self):
+            if text is None:
+                raise ValueError("no parts")
+            return text
+    return Chunk()
+
+
+def test_gemini_final_chunk_without_text_is_not_blocked():
+    assert GeminiBackend._text(_gemini_chunk("Hallo", finish_reason="FINISH_REASON_UNSPECIFIED")) == "Hallo"
+    assert GeminiBackend._text(_gemini_chunk(None, finish_reason="STOP")) == ""
+
+
+def test_gemini_safety_block_is_detected():
+    with pytest.raises(ContentBlocked):
+        GeminiBackend._text(_gemini_chunk(None, finish_reason="SAFETY"))
+    with pytest.raises(ContentBlocked):
+        GeminiBackend._text(_gemini_chunk(None, block_reason=SimpleNamespace(name="SAFETY")))
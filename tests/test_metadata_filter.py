@@ -0,0 +1,65 @@
+import pytest
+
+from metadata_filter import build_where, normalize_where, parse_where, scope_key, where_from_payload
+
+
+def test_build_where():
+    assert build_where() is None
+    assert build_where("a.pdf") == {"source_file": "a.pdf"}
+    assert build_where("b.pdf, a.pdf", ["abstract"]) == {
+        "$and": [{"source_file": {"$in": ["a.pdf", "b.pdf"]}}, {"chunk_type": "abstract"}]}
+
+
+def test_parse_where():
+    where = {"$and": [{"source_file": {"$in": ["a.pdf", "b.pdf"]}}, {"source_file": {"$eq": "b.pdf"}},
+                      {"chunk_type": "abstract"}]}
+    assert parse_where(where) == {"source_file": {"b.pdf"}, "chunk_type": {"abstract"}}
+
+
+@pytest.mark.parametrize("where", [
+    {"page": 3},
+    {"source_file": {"$ne": "a.pdf"}},
+    {"source_file": ["a.pdf"]},
+    {"$and": {"source_file": "a.pdf"}},
+    {"$or": [{"source_file": "a.pdf"}, {"source_file": "b.pdf"}]},
+    {"$and": []},
+    {"$and": [{}]},
+])
+def test_invalid_filters_raise(where):
+    with pytest.raises(ValueError):
+        normalize_where(where)
+
+
+def test_multiple_top_level_keys_are_wrapped_in_and():
+    assert normalize_where({"source_file": "a.pdf", "chunk_type": "abstract"}) == {
+        "$and": [{"source_file": "a.pdf"}, {"chunk_type": "abstract"}]}
+
+
+def test_single_clause_and_is_unwrapped():
+    assert normalize_where({"$and": [{"source_file": "a.pdf"}]}) == {"source_file": "a.pdf"}
+
+
+def test_nested_and_is_flattened():
+    where = {"$and": [{"source_file": {"$in": ["a.pdf"]}, "chunk_type": "abstract"}, {"$and": [{"title": "T"}]}]}
+    assert normalize_where(where) == {
+        "$and": [{"source_file": {"$in": ["a.pdf"]}}, {"chunk_type": "abstract"}, {"title": "T"}]}
+
+
+def test_valid_chroma_filters_are_unchanged():
+    where = {"$and": [{"source_file": {"$in": ["a.pdf", "b.pdf"]}}, {"chunk_type": "abstract"}]}
+    assert normalize_where(where) == where
+    assert normalize_where({"chunk_type": {"$eq": "abstract"}}) == {"chunk_type": {"$eq": "abstract"}}
+
+
+def test_where_from_payload():
+    assert where_from_payload({"where": {"source_file": "a.pdf", "chunk_type": "abstract"}}) == {
+        "$and": [{"source_file": "a.pdf"}, {"chunk_type": "abstract"}]}
+    assert where_from_payload({"source_files": "a.pdf"}) == {"source_file": "a.pdf"}
+    assert where_from_payload({}) is None
+    with pytest.raises(ValueError):
+        where_from_payload({"where": {"$and": []}})
+
+
+def test_scope_key_is_order_independent():
+    assert scope_key({"a": 1, "b": 2}) == scope_key({"b": 2, "a": 1})
+    assert scope_key(None) == ""
@@ -0,0 +1,68 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+class FakeEncoder:
+    """ Vektor = (Nummer im Text, Textlänge); langsam genug, dass sich Fragen stauen. """
+
+    def __init__(self, seconds=0.005):
+        self.seconds = seconds
+        self.batches = []
+        self.fail_next = False
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(self.seconds)
+        if self.fail_next:
+            self.fail_next = False
+            raise RuntimeError("encoder failed")
+        return np.array([[float(text.split()[-1]), float(len(text))] for text in texts], dtype=np.float32)
+
+
+def expected(text):
+    return np.array([float(text.split()[-1]), float(len(text))], dtype=np.float32)
+
+
+def test_each_caller_gets_its_own_row_under_concurrency():
+    encoder = FakeEncoder()
+    batcher = MicroBatcher(encoder, window_ms=5, max_batch=8)
+    texts = [f"query {'x' * (i % 7)} {i}" for i in range(200)]
+    start = threading.Barrier(32)
+
+    def ask(text):
+        if int(text.split()[-1]) < 32:
+            start.wait() # Die ersten Anfragen gleichzeitig losschicken
+        return batcher([text])[0]
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(ask, texts))
+    for text, vector in zip(texts, results):
+        np.testing.assert_array_equal(vector, expected(text))
+
+    sizes = [len(batch) for batch in encoder.batches]
+    assert sum(sizes) == len(texts) and max(sizes) > 1 and max(sizes) <= 8
+    assert sorted(text for batch in encoder.batches for text in batch) == sorted(texts)
+    stats = batcher.stats()
+    assert stats["requests"] == len(texts) and stats["batches"] == len(encoder.batches)
+
+
+def test_call_keeps_input_order():
+    batcher = MicroBatcher(FakeEncoder(0), window_ms=5, max_batch=4)
+    texts = [f"text {i}" for i in range(10)]
+    np.testing.assert_array_equal(batcher(texts), np.stack([expected(text) for text in texts]))
+
+
+def test_failed_batch_raises_for_its_callers_only():
+    encoder = FakeEncoder(0)
+    batcher = MicroBatcher(encoder, window_ms=5, max_batch=4)
+    encoder.fail_next = True
+    with pytest.raises(RuntimeError, match="encoder failed"):
+        batcher.submit("first 1").result(timeout=5)
+    np.testing.assert_array_equal(batcher.submit("second 2").result(timeout=5), expected("second 2"))
+    assert batcher.stats()["failed_batches"] == 1
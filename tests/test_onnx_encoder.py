@@ -0,0 +1,72 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+import onnx_encoder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Anderes Modell prüfen: ONNX_PARITY_MODEL=<Name oder Pfad> (vorher mit onnx_encoder.py exportieren)
+MODEL = os.getenv("ONNX_PARITY_MODEL", onnx_encoder.model_name)
+
+TEXTS = onnx_encoder._sample_texts(64, os.path.join(ROOT, "chunks_output")) + [
+    "p53",
+    "Does BRCA1 loss sensitize tumours to PARP inhibition?",
+    " ".join(["Long paragraph exceeding the maximum sequence length of the encoder."] * 60),
+]
+
+
+@pytest.fixture(scope="module")
+def torch_model():
+    pytest.importorskip("torch")
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    try:
+        return sentence_transformers.SentenceTransformer(MODEL, device="cpu")
+    except OSError as e:
+        pytest.skip(f"SentenceTransformer '{MODEL}' not available: {e}")
+
+
+@pytest.mark.parametrize("quantized", [True, False], ids=["int8", "fp32"])
+def test_onnx_matches_torch(torch_model, quantized):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    try:
+        encoder = onnx_encoder.OnnxEncoder(MODEL, os.path.join(ROOT, onnx_encoder.onnx_model_directory),
+                                           quantized=quantized)
+    except FileNotFoundError as e:
+        pytest.skip(str(e))
+    if encoder.quantized != quantized:
+        pytest.skip("int8 model not exported")
+    cosine = onnx_encoder.parity_cosines(encoder, torch_model, TEXTS)
+    assert cosine.min() >= onnx_encoder.parity_threshold, \
+        f"text {int(np.argmin(cosine))}: cosine {cosine.min():.4f} < {onnx_encoder.parity_threshold}"
+
+
+@pytest.fixture
+def fp32_export(tmp_path):
+    """ Export-Ordner wie nach `python onnx_encoder.py --no-quantize` (Modell selbst nur als Platzhalter). """
+    tokenizers = pytest.importorskip("tokenizers")
+    target = onnx_encoder.model_directory("tiny", str(tmp_path))
+    os.makedirs(target)
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel({"[PAD]": 0, "[UNK]": 1}, unk_token="[UNK]"))
+    tokenizer.save(os.path.join(target, "tokenizer.json"))
+    meta = {"model_name": "tiny", "dim": 4, "max_seq_length": 16, "pooling": "mean", "normalize": True,
+            "pad_token": "[PAD]", "pad_token_id": 0, "input_names": ["input_ids", "attention_mask"]}
+    with open(os.path.join(target, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    open(os.path.join(target, "model.onnx"), 'wb').close()
+    return target
+
+
+def test_falls_back_to_fp32_without_int8_export(fp32_export):
+    encoder = onnx_encoder.OnnxEncoder("tiny", os.path.dirname(fp32_export), quantized=True)
+    assert not encoder.quantized
+    assert encoder.model_path == os.path.join(fp32_export, "model.onnx")
+    assert encoder.cache_name == "tiny@onnx"
+
+
+def test_missing_model_raises(fp32_export):
+    os.remove(os.path.join(fp32_export, "model.onnx"))
+    with pytest.raises(FileNotFoundError):
+        onnx_encoder.OnnxEncoder("tiny", os.path.dirname(fp32_export))
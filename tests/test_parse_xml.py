@@ -0,0 +1,67 @@
+import pytest
+
+from chunker import Paragraph
+from parse_xml import extract_streaming, extract_tree
+
+# Kleines TEI-Dokument mit den Sonderfällen aus GROBID-Ausgaben: benachbarte <div> mit gleicher
+# Überschrift, <div> ohne <head>, verschachteltes <div>, <head> nach dem Paragraphen, <p> direkt
+# im <body>, <s>-Tags (vollständig und unvollständig) und Paragraphen außerhalb des <body>.
+SAMPLE = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+<teiHeader><fileDesc><titleStmt><title> A  Sample Paper </title></titleStmt></fileDesc>
+<profileDesc><abstract><p><s>Abstract one.</s> <s>Abstract two.</s></p></abstract></profileDesc></teiHeader>
+<text>
+<front><div><p>Front matter.</p></div></front>
+<body>
+<div><head>Methods</head><p><s>Alpha one.</s> <s>Alpha two.</s></p><p>Alpha three.</p></div>
+<div><head>Methods</head><p><s>Beta one.</s> Beta two.</p></div>
+<div><p>Gamma one.</p></div>
+<div><head>Results <hi>and</hi>
+  Discussion</head><p>Delta one.</p><div><head>Inner</head><p>Epsilon.</p></div><p>Zeta.</p></div>
+<div><p>Eta before head.</p><head>Late</head><p>Theta.</p></div>
+<p>Loose paragraph.</p>
+<figure><head>Figure 1</head><figDesc>Caption.</figDesc></figure>
+</body>
+<back><div><listBibl><biblStruct><note><p>Reference note.</p></note></biblStruct></listBibl></div></back>
+</text>
+</TEI>
+"""
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = tmp_path / "sample_grobid.xml"
+    path.write_text(SAMPLE, encoding="utf-8")
+    return str(path)
+
+
+def test_streaming_matches_tree(sample):
+    assert extract_streaming(sample) == extract_tree(sample)
+
+
+def test_extracted_paragraphs(sample):
+    title, abstract, paragraphs = extract_tree(sample)
+    assert title == "A  Sample Paper"
+    assert abstract == Paragraph(None, "Abstract one. Abstract two.", "Abstract", ["Abstract one.", "Abstract two."])
+    assert paragraphs == [
+        Paragraph(0, "Alpha one. Alpha two.", "Methods", ["Alpha one.", "Alpha two."], 0),
+        Paragraph(1, "Alpha three.", "Methods", [], 0),
+        # Gleiche Überschrift, aber eigener Abschnitt; Text außerhalb der <s>-Tags -> keine Sätze
+        Paragraph(2, "Beta one. Beta two.", "Methods", [], 1),
+        Paragraph(3, "Gamma one.", "", [], 2),
+        Paragraph(4, "Delta one.", "Results and Discussion", [], 3),
+        Paragraph(5, "Epsilon.", "Inner", [], 4),
+        Paragraph(6, "Zeta.", "Results and Discussion", [], 3),
+        Paragraph(7, "Eta before head.", "", [], 5),
+        Paragraph(8, "Theta.", "Late", [], 5),
+        Paragraph(9, "Loose paragraph.", "", [], None),
+    ]
+
+
+def test_missing_header(tmp_path):
+    path = tmp_path / "bare_grobid.xml"
+    path.write_text('<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body><div><p>Only.</p></div></body></text></TEI>',
+                    encoding="utf-8")
+    expected = ("Title not found", None, [Paragraph(0, "Only.", "", [], 0)])
+    assert extract_tree(str(path)) == expected
+    assert extract_streaming(str(path)) == expected
@@ -0,0 +1,110 @@
+import time
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import process_pdfs
+
+
+class StubGrobid(BaseHTTPRequestHandler):
+    """ Lokaler GROBID-Ersatz: antwortet nacheinander mit den Einträgen aus server.replies. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        status, headers, body, delay = self.server.replies.pop(0)
+        self.server.requests += 1
+        time.sleep(delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def grobid():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGrobid)
+    server.replies, server.requests = [], 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ Backoff-Wartezeiten aufzeichnen statt wirklich zu warten. """
+    delays = []
+    monkeypatch.setattr(process_pdfs, "time", SimpleNamespace(time=time.time, sleep=delays.append))
+    return delays
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    (tmp_path / "paper.pdf").write_bytes(b"%PDF-1.4 stub")
+    return tmp_path
+
+
+def _process(server, pdf):
+    session = process_pdfs.create_session(1)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    return process_pdfs.process_pdf(session, "paper.pdf", base_url, input_dir=str(pdf), output_dir=str(pdf))
+
+
+def test_retries_503_and_respects_retry_after(grobid, sleeps, pdf):
+    grobid.replies = [(503, {"Retry-After": "7"}, b"busy", 0), (200, {}, b"<TEI/>", 0)]
+    result = _process(grobid, pdf)
+    assert result["ok"] and result["attempts"] == 2
+    assert sleeps == [7.0]
+    assert (pdf / "paper_grobid.xml").read_text(encoding="utf-8") == "<TEI/>"
+
+
+def test_503_without_retry_after_uses_exponential_backoff(grobid, sleeps, pdf):
+    grobid.replies = [(503, {}, b"busy", 0), (503, {}, b"busy", 0), (200, {}, b"<TEI/>", 0)]
+    result = _process(grobid, pdf)
+    assert result["ok"] and result["attempts"] == 3
+    base = process_pdfs.retry_backoff_base
+    assert base <= sleeps[0] <= 2 * base
+    assert 2 * base <= sleeps[1] <= 3 * base
+
+
+def test_retries_timeout(grobid, sleeps, pdf, monkeypatch):
+    monkeypatch.setattr(process_pdfs, "request_timeout", 0.2)
+    grobid.replies = [(200, {}, b"late", 0.5), (200, {}, b"<TEI/>", 0)]
+    result = _process(grobid, pdf)
+    assert result["ok"] and result["attempts"] == 2
+    assert len(sleeps) == 1
+    assert (pdf / "paper_grobid.xml").read_text(encoding="utf-8") == "<TEI/>"
+
+
+def test_timeout_retries_are_capped(grobid, sleeps, pdf, monkeypatch):
+    monkeypatch.setattr(process_pdfs, "request_timeout", 0.2)
+    grobid.replies = [(200, {}, b"late", 0.5)] * 2 + [(200, {}, b"<TEI/>", 0)]
+    result = _process(grobid, pdf)
+    assert not result["ok"] and result["attempts"] == 2
+    assert "timed out" in result["error"]
+    assert len(sleeps) == 1
+
+
+def test_missing_pdf_is_a_failed_result(grobid, sleeps, pdf):
+    session = process_pdfs.create_session(1)
+    base_url = f"http://127.0.0.1:{grobid.server_port}"
+    result = process_pdfs.process_pdf(session, "gone.pdf", base_url, input_dir=str(pdf), output_dir=str(pdf))
+    assert not result["ok"] and result["bytes"] == 0
+    assert "Could not read PDF" in result["error"]
+    assert grobid.requests == 0
+
+
+def test_gives_up_after_max_retries(grobid, sleeps, pdf, monkeypatch):
+    monkeypatch.setattr(process_pdfs, "max_retries", 2)
+    grobid.replies = [(503, {}, b"busy", 0)] * 3
+    result = _process(grobid, pdf)
+    assert not result["ok"] and result["attempts"] == 3
+    assert len(sleeps) == 2 and grobid.requests == 3
@@ -0,0 +1,82 @@
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import reranker
+
+
+class FakeCrossEncoder:
+    """ Score = Länge des Texts; die ersten slow_calls Aufrufe sind sehr langsam (kalter Cache o.ä.). """
+    slow_calls = 2
+
+    def __init__(self, model_name):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.calls.append(len(pairs))
+        time.sleep((0.05 if len(self.calls) <= self.slow_calls else 0.0001) * len(pairs))
+        return [float(len(text)) for _, text in pairs]
+
+
+@pytest.fixture
+def make_reranker(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=FakeCrossEncoder))
+    monkeypatch.setattr(reranker, "warmup_pairs", 4)
+
+    def make(slow_calls=2):
+        monkeypatch.setattr(FakeCrossEncoder, "slow_calls", slow_calls)
+        return reranker.Reranker()
+    return make
+
+
+def candidates(count):
+    return [(f"chunk_{i}", "x" * (i + 1)) for i in range(count)]
+
+
+def test_full_rerank_within_budget(make_reranker):
+    model = make_reranker(slow_calls=0)
+    order = model.rerank("frage", candidates(10), k=3, budget_seconds=1.0)
+    assert [i for i, _ in order] == [9, 8, 7]
+    assert model.model.calls[-1] == 10
+
+
+def test_over_budget_reranks_prefix_that_fits(make_reranker):
+    model = make_reranker()
+    assert model.seconds_per_pair == pytest.approx(0.05, rel=0.5)
+    order = model.rerank("frage", candidates(50), k=50, budget_seconds=0.3)
+    scored = [i for i, score in order if score is not None]
+    assert 0 < len(scored) < 50
+    # Neu sortiert wird nur das Präfix, der Rest bleibt in der ursprünglichen Reihenfolge
+    assert scored == sorted(scored, reverse=True) and max(scored) == len(scored) - 1
+    assert [i for i, score in order if score is None] == list(range(len(scored), 50))
+
+
+def test_slow_first_measurement_recovers(make_reranker):
+    model = make_reranker()
+    assert 50 * model.seconds_per_pair > 0.3 # Erste Schätzung sprengt das Budget
+    for n in range(40):
+        order = model.rerank(f"frage {n}", candidates(50), k=5, budget_seconds=0.3)
+        if model.model.calls[-1] == 50:
+            break
+    else:
+        pytest.fail(f"still over budget after 40 queries ({model.seconds_per_pair * 1000:.2f} ms/pair)")
+    assert [i for i, _ in order] == [49, 48, 47, 46, 45]
+
+
+def test_probes_when_no_pair_fits(make_reranker, monkeypatch):
+    monkeypatch.setattr(reranker, "probe_every", 3)
+    model = make_reranker(slow_calls=0)
+    model.seconds_per_pair = 10.0
+    results = [model.rerank(f"frage {n}", candidates(5), k=2, budget_seconds=0.3) for n in range(3)]
+    assert results[:2] == [None, None]
+    assert results[2] is not None and model.seconds_per_pair < 10.0
+
+
+def test_cached_pairs_are_not_recomputed(make_reranker):
+    model = make_reranker(slow_calls=0)
+    model.rerank("frage", candidates(5), k=2)
+    calls = len(model.model.calls)
+    assert [i for i, _ in model.rerank("Frage ", candidates(5), k=2)] == [4, 3]
+    assert len(model.model.calls) == calls
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pytest
+
+import vector_index
+from vector_index import VectorIndex, build_index
+
+DIM = 32
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    """ Geclusterte Vektoren (wie Embeddings ähnlicher Chunks) in drei Dateipaaren. """
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, DIM))
+    vectors = (centers[rng.integers(0, len(centers), size=3000)] + 0.4 * rng.normal(size=(3000, DIM))).astype(np.float32)
+    directory = tmp_path_factory.mktemp("embeddings")
+    ids, metadatas = [], []
+    for paper, rows in enumerate(np.array_split(np.arange(len(vectors)), 3)):
+        metadata_list = [{"source_file": f"paper{paper}.pdf", "chunk_type": "abstract" if i % 5 == 0 else "paragraph"}
+                         for i in range(len(rows))]
+        np.save(directory / f"paper{paper}_embeddings.npy", vectors[rows])
+        with open(directory / f"paper{paper}_meta.json", 'w', encoding='utf-8') as f:
+            json.dump(metadata_list, f)
+        ids.extend(f"paper{paper}.pdf_chunk_{i}" for i in range(len(rows)))
+        metadatas.extend(metadata_list)
+    queries = (vectors[rng.choice(len(vectors), size=30, replace=False)]
+               + 0.2 * rng.normal(size=(30, DIM))).astype(np.float32)
+    return {"directory": directory, "vectors": vector_index._normalize(vectors), "ids": ids,
+            "metadatas": metadatas, "queries": queries}
+
+
+def build(corpus, tmp_path, **options):
+    directory = str(tmp_path / "index")
+    build_index(input_directory=str(corpus["directory"]), directory=directory, **options)
+    return directory
+
+
+def brute_force(corpus, query, k, rows=None):
+    rows = np.arange(len(corpus["ids"])) if rows is None else rows
+    scores = corpus["vectors"][rows] @ vector_index._normalize(query)
+    top = rows[np.argsort(-scores, kind='stable')[:k]]
+    return [corpus["ids"][i] for i in top], 1.0 - np.sort(scores)[::-1][:k]
+
+
+def recall(index, corpus, k=10):
+    found = index.query(corpus["queries"], n_results=k, include=[])['ids']
+    return np.mean([len(set(result) & set(brute_force(corpus, query, k)[0])) / k
+                    for result, query in zip(found, corpus["queries"])])
+
+
+def test_exact_search_matches_brute_force(corpus, tmp_path, monkeypatch):
+    # Kleine Blöcke: Top-k über Block- und Teilblockgrenzen hinweg zusammenführen
+    monkeypatch.setattr(vector_index, "query_block_rows", 500)
+    monkeypatch.setattr(vector_index, "score_block_rows", 64)
+    index = VectorIndex(build(corpus, tmp_path))
+    results = index.query(corpus["queries"], n_results=10)
+    for query, ids, distances in zip(corpus["queries"], results['ids'], results['distances']):
+        expected_ids, expected_distances = brute_force(corpus, query, 10)
+        assert ids == expected_ids
+        assert np.allclose(distances, expected_distances, atol=1e-5)
+
+
+def test_where_filter_matches_brute_force(corpus, tmp_path):
+    index = VectorIndex(build(corpus, tmp_path))
+    where = {"$and": [{"source_file": {"$in": ["paper0.pdf", "paper2.pdf"]}}, {"chunk_type": "abstract"}]}
+    rows = np.array([i for i, meta in enumerate(corpus["metadatas"])
+                     if meta["source_file"] in ("paper0.pdf", "paper2.pdf") and meta["chunk_type"] == "abstract"])
+    results = index.query(corpus["queries"][:5], n_results=10, where=where)
+    for query, ids in zip(corpus["queries"][:5], results['ids']):
+        assert ids == brute_force(corpus, query, 10, rows)[0]
+
+
+def test_ivf_with_all_lists_is_exact(corpus, tmp_path):
+    directory = build(corpus, tmp_path, num_lists=16)
+    assert recall(VectorIndex(directory, nprobe=16), corpus) == 1.0
+    assert recall(VectorIndex(directory, nprobe=4), corpus) >= 0.8
+
+
+def test_float16_vectors(corpus, tmp_path):
+    assert recall(VectorIndex(build(corpus, tmp_path, dtype="float16")), corpus) >= 0.99
+
+
+@pytest.mark.parametrize("mode, rescore, minimum", [("int8", 1, 0.9), ("int8", 4, 0.99), ("binary", 10, 0.9)])
+def test_quantized_recall_with_rescoring(corpus, tmp_path, monkeypatch, mode, rescore, minimum):
+    monkeypatch.setattr(vector_index, "score_block_rows", 100)
+    index = VectorIndex(build(corpus, tmp_path, quantization_mode=mode), rescore=rescore)
+    assert recall(index, corpus) >= minimum
+    # Nach dem Rescoring sind die Distanzen die exakten float-Distanzen
+    query = corpus["queries"][0]
+    result = index.query([query], n_results=5)
+    expected = dict(zip(*brute_force(corpus, query, len(corpus["ids"]))))
+    assert np.allclose(result['distances'][0], [expected[i] for i in result['ids'][0]], atol=1e-5)
+
+
+@pytest.mark.parametrize("mode", ["none", "int8", "binary"])
+def test_approx_scores_independent_of_block_size(corpus, tmp_path, monkeypatch, mode):
+    loaded = VectorIndex(build(corpus, tmp_path, quantization_mode=mode))._refresh()
+    queries = vector_index._normalize(corpus["queries"][:3])
+    rows = np.arange(5, 2900, 3)
+    reference = (loaded.approx_scores(queries, slice(10, 2990)), loaded.approx_scores(queries, rows))
+    monkeypatch.setattr(vector_index, "score_block_rows", 37)
+    assert np.allclose(loaded.approx_scores(queries, slice(10, 2990)), reference[0], atol=1e-6)
+    assert np.allclose(loaded.approx_scores(queries, rows), reference[1], atol=1e-6)
@@ -0,0 +1,524 @@
+import os
+import json
+import time
+import shutil
+import copy
+import argparse
+import threading
+import numpy as np
+from chunk_store import make_chunk_id
+from metadata_filter import filter_fields, parse_where
+
+# --- Konfiguration ---
+embeddings_input_directory = "embeddings_output" # Quelle: *_embeddings.npy + *_meta.json (wie index_data.py)
+vector_index_directory = "vector_index"
+vector_dtype = "float32" # "float16" halbiert Speicher und Lesebandbreite bei minimal anderer Rangfolge
+ivf_lists = 0 # >0: IVF-Modus mit so vielen Clustern (Faustregel: ~sqrt(Anzahl Chunks)); 0 = exakte Suche
+ivf_nprobe = 8 # Durchsuchte Cluster pro Anfrage im IVF-Modus
+query_block_rows = 262144 # Zeilen pro Matrix-Block bei der exakten Suche (begrenzt den Zwischenspeicher)
+# Zeilen pro Umwandlung von Codes/float16 nach float32 innerhalb eines Blocks (~25 MB bei 384 Dimensionen),
+# damit der Zwischenspeicher die Ersparnis der Quantisierung nicht wieder auffrisst
+score_block_rows = 16384
+# Quantisierte Codes für die erste Suchstufe: "none", "int8" (1 Byte/Dimension + Skala pro Vektor)
+# oder "binary" (1 Bit/Dimension). Die besten k * rescore_factor Kandidaten werden danach mit den
+# float-Vektoren neu bewertet; die float-Matrix wird dafür nur an diesen Zeilen gelesen.
+quantization = "none"
+rescore_factor = 10
+# --------------------
+
+# Alternative zu ChromaDB für den (fast) nur lesenden Korpus: alle Embeddings liegen
+# L2-normiert in einer einzigen Matrix (vectors.npy, per mmap geöffnet), dazu eine
+# ID-/Metadaten-Tabelle. Eine Anfrage ist ein Matrix-Vektor-Produkt plus argpartition.
+# Die Distanzen entsprechen der Chroma-Sammlung ("hnsw:space": "cosine"): 1 - cos.
+#
+# VectorIndex.query() hat dieselbe Signatur und dasselbe Ergebnisformat wie
+# collection.query() von Chroma, app.py und query_data.py können also per
+# Konfiguration zwischen beiden Backends wechseln.
+#
+# IVF-Modus: Die Vektoren werden mit (sphärischem) k-Means in ivf_lists Cluster
+# geteilt und nach Cluster sortiert gespeichert. Eine Anfrage vergleicht nur mit
+# den Vektoren der ivf_nprobe ähnlichsten Cluster (approximativ, deutlich schneller).
+#
+# Quantisierung: codes.npy (+ scales.npy bei int8) liegt neben vectors.npy. Die erste
+# Stufe liest nur die Codes (384 Dimensionen: 388 statt 1536 Bytes bei int8, 48 Bytes
+# bei binary), sodass vor allem diese im Arbeitsspeicher liegen müssen.
+# `python vector_index.py --recall-report` misst Recall@k und Latenz aller Varianten
+# gegen die float-Suche.
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors):
+    """ Symmetrische int8-Quantisierung mit einer Skala pro Vektor: x ≈ codes * scale. """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors):
+    """ Vorzeichen-Bits, gepackt und auf ganze uint64 aufgefüllt (schneller Popcount). """
+    bits = np.packbits(np.asarray(vectors) > 0, axis=1)
+    padding = (-bits.shape[1]) % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def quantize(vectors, mode, block_rows=query_block_rows):
+    """ Quantisiert blockweise. Gibt (codes, scales oder None) zurück. """
+    codes, scales = [], []
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        if mode == "int8":
+            block_codes, block_scales = quantize_int8(block)
+            scales.append(block_scales)
+        else:
+            block_codes = quantize_binary(block)
+        codes.append(block_codes)
+    if not codes:
+        return None, None
+    return np.concatenate(codes), (np.concatenate(scales) if scales else None)
+
+
+def _embedding_pairs(directory):
+    pairs = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith("_meta.json"):
+            continue
+        base_name = filename.replace("_meta.json", "")
+        embed_path = os.path.join(directory, f"{base_name}_embeddings.npy")
+        if os.path.exists(embed_path):
+            pairs.append((base_name, os.path.join(directory, filename), embed_path))
+    return pairs
+
+
+def _train_ivf(vectors, num_lists, iterations=10, sample_size=100000, seed=0):
+    """ Sphärisches k-Means auf einer Stichprobe. Gibt normierte Zentroiden zurück. """
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=num_lists) == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))] # Leere Cluster neu besetzen
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _assign_ivf(vectors, centroids, block_rows=query_block_rows):
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def build_index(input_directory=embeddings_input_directory, directory=vector_index_directory,
+                dtype=vector_dtype, num_lists=ivf_lists, quantization_mode=quantization):
+    """ Baut den Index aus allen Embedding-Dateien neu und ersetzt den alten. Gibt die Anzahl Vektoren zurück. """
+    start_time = time.time()
+    # 1. Durchlauf: Metadaten lesen und Dateipaare prüfen, damit die Matrix exakt angelegt werden kann
+    candidates = []
+    rows_per_dim = {}
+    for base_name, meta_path, embed_path in _embedding_pairs(input_directory):
+        shape = np.load(embed_path, mmap_mode='r').shape
+        if shape[0] == 0:
+            continue
+        with open(meta_path, 'r', encoding='utf-8') as f_meta:
+            metadata_list = json.load(f_meta)
+        if len(metadata_list) != shape[0]:
+            print(f"    -> Warning: Skipping '{base_name}': {len(metadata_list)} metadata entries, {shape[0]} embeddings")
+            continue
+        candidates.append((base_name, embed_path, metadata_list, shape[1]))
+        rows_per_dim[shape[1]] = rows_per_dim.get(shape[1], 0) + shape[0]
+    # Vektorlänge der Mehrheit (z.B. Reste eines früheren Modells werden übersprungen)
+    dim = max(rows_per_dim, key=rows_per_dim.get) if rows_per_dim else None
+    documents = []
+    for base_name, embed_path, metadata_list, file_dim in candidates:
+        if file_dim != dim:
+            print(f"    -> Warning: Skipping '{base_name}': embedding dim {file_dim}, index dim {dim}")
+            continue
+        documents.append((base_name, embed_path, metadata_list))
+    num_vectors = sum(len(metadata_list) for _, _, metadata_list in documents)
+
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    vectors_path = os.path.join(tmp_directory, "vectors.npy")
+    unsorted_path = os.path.join(tmp_directory, "vectors_unsorted.npy") if num_lists else vectors_path
+
+    # 2. Durchlauf: normierte Vektoren in eine gemeinsame Matrix schreiben
+    vectors = np.lib.format.open_memmap(unsorted_path, mode='w+', dtype=dtype, shape=(num_vectors, dim or 0))
+    ids, metadatas = [], []
+    for base_name, embed_path, metadata_list in documents:
+        vectors[len(ids):len(ids) + len(metadata_list)] = _normalize(np.load(embed_path, mmap_mode='r'))
+        ids.extend(make_chunk_id(meta.get('source_file', base_name + '.pdf'), i)
+                   for i, meta in enumerate(metadata_list))
+        metadatas.extend(metadata_list)
+    vectors.flush()
+
+    meta = {"num_vectors": num_vectors, "dim": dim or 0, "dtype": dtype, "ivf_lists": 0, "quantization": "none",
+            "built_at": time.time()}
+    if num_lists:
+        if num_vectors >= num_lists:
+            # IVF: Cluster trainieren und Vektoren nach Cluster sortiert ablegen (jede Liste ist ein Zeilenbereich)
+            centroids = _train_ivf(vectors, num_lists)
+            assignment = _assign_ivf(vectors, centroids)
+            order = np.argsort(assignment, kind='stable')
+            sorted_vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=dtype, shape=vectors.shape)
+            for start in range(0, num_vectors, query_block_rows):
+                rows = order[start:start + query_block_rows]
+                by_row = np.argsort(rows) # Aufsteigend lesen, dann an die Zielposition schreiben
+                block = np.empty((len(rows), vectors.shape[1]), dtype=dtype)
+                block[by_row] = vectors[rows[by_row]]
+                sorted_vectors[start:start + len(rows)] = block
+            sorted_vectors.flush()
+            del sorted_vectors
+            ids = [ids[i] for i in order]
+            metadatas = [metadatas[i] for i in order]
+            list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignment, minlength=num_lists), out=list_offsets[1:])
+            np.save(os.path.join(tmp_directory, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(tmp_directory, "ivf_offsets.npy"), list_offsets)
+            meta["ivf_lists"] = num_lists
+            del vectors
+            os.remove(unsorted_path)
+        else:
+            print(f"    -> Warning: Only {num_vectors} vectors for {num_lists} IVF lists, using exact search.")
+            del vectors
+            os.replace(unsorted_path, vectors_path)
+    else:
+        del vectors
+
+    if quantization_mode != "none" and num_vectors:
+        codes, scales = quantize(np.load(vectors_path, mmap_mode='r'), quantization_mode)
+        np.save(os.path.join(tmp_directory, "codes.npy"), codes)
+        if scales is not None:
+            np.save(os.path.join(tmp_directory, "scales.npy"), scales)
+        meta["quantization"] = quantization_mode
+
+    with open(os.path.join(tmp_directory, "ids.json"), 'w', encoding='utf-8') as f:
+        json.dump(ids, f, ensure_ascii=False)
+    with open(os.path.join(tmp_directory, "metadatas.json"), 'w', encoding='utf-8') as f:
+        json.dump(metadatas, f, ensure_ascii=False)
+    with open(os.path.join(tmp_directory, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    old_directory = f"{directory}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    mode = f"IVF with {meta['ivf_lists']} lists" if meta["ivf_lists"] else "exact"
+    if meta["quantization"] != "none":
+        mode += f", {meta['quantization']} codes"
+    print(f"Vector index: {num_vectors} vectors (dim {meta['dim']}, {dtype}, {mode}) "
+          f"built in {time.time() - start_time:.2f}s.")
+    return num_vectors
+
+
+class _LoadedIndex:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "ids.json"), 'r', encoding='utf-8') as f:
+            self.ids = json.load(f)
+        with open(os.path.join(directory, "metadatas.json"), 'r', encoding='utf-8') as f:
+            self.metadatas = json.load(f)
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode='r')
+        self.centroids = self.list_offsets = None
+        if self.meta.get("ivf_lists"):
+            self.centroids = np.load(os.path.join(directory, "ivf_centroids.npy"))
+            self.list_offsets = np.load(os.path.join(directory, "ivf_offsets.npy"))
+        self.quantization = self.meta.get("quantization", "none")
+        self.codes = self.scales = None
+        if self.quantization != "none":
+            self.codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode='r')
+            if self.quantization == "int8":
+                self.scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode='r')
+        # Sekundärindex für Filter: Feld -> Wert -> Zeilennummern (aufsteigend)
+        self.field_rows = {}
+        for field in filter_fields:
+            rows_by_value = {}
+            for row, metadata in enumerate(self.metadatas):
+                value = (metadata or {}).get(field)
+                if value is not None:
+                    rows_by_value.setdefault(str(value), []).append(row)
+            self.field_rows[field] = {value: np.array(rows, dtype=np.int64) for value, rows in rows_by_value.items()}
+
+    def rows_for(self, allowed):
+        """ Zeilen, deren Metadaten zu {Feld: erlaubte Werte} passen (siehe metadata_filter.parse_where). """
+        rows = np.arange(len(self.ids), dtype=np.int64)
+        for field, values in allowed.items():
+            parts = [self.field_rows[field][value] for value in values if value in self.field_rows[field]]
+            if not parts:
+                return np.zeros(0, dtype=np.int64)
+            field_rows = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+            rows = np.intersect1d(rows, field_rows, assume_unique=True)
+        return rows
+
+    def approx_scores(self, queries, rows):
+        """ Geschätzte Kosinus-Ähnlichkeit (Anfragen x Zeilen); rows ist ein slice oder ein Index-Array.
+
+        Gelesen und nach float32 umgewandelt wird in Teilblöcken von score_block_rows Zeilen.
+        """
+        if isinstance(rows, slice):
+            start, stop, _ = rows.indices(len(self.ids))
+            parts = [slice(part, min(part + score_block_rows, stop)) for part in range(start, stop, score_block_rows)]
+            num_rows = max(0, stop - start)
+        else:
+            parts = [rows[part:part + score_block_rows] for part in range(0, len(rows), score_block_rows)]
+            num_rows = len(rows)
+        query_codes = quantize_binary(queries) if self.quantization == "binary" else None
+        scores = np.empty((len(queries), num_rows), dtype=np.float32)
+        offset = 0
+        for part in parts:
+            if self.quantization == "binary":
+                codes = np.asarray(self.codes[part])
+                # Hamming-Distanz per XOR + Popcount, umgerechnet in eine Ähnlichkeit in [-1, 1]
+                block = np.stack([1.0 - 2.0 * np.bitwise_count(codes ^ query_code).sum(axis=1, dtype=np.int32)
+                                  / self.meta["dim"] for query_code in query_codes])
+            elif self.quantization in ("int8", "float16"): # float16 nur im Recall-Report (--recall-report)
+                block = queries @ np.asarray(self.codes[part], dtype=np.float32).T
+                if self.quantization == "int8":
+                    block *= np.asarray(self.scales[part], dtype=np.float32)
+            else:
+                block = queries @ np.asarray(self.vectors[part], dtype=np.float32).T
+            scores[:, offset:offset + block.shape[1]] = block
+            offset += block.shape[1]
+        return scores
+
+
+class VectorIndex:
+    """ In-Process-Vektorsuche mit der Abfrage-Schnittstelle einer Chroma-Sammlung. """
+
+    def __init__(self, directory=vector_index_directory, nprobe=ivf_nprobe, rescore=rescore_factor):
+        self.directory = directory
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._index = None
+        self._refresh()
+
+    def _refresh(self):
+        """ Lädt den Index neu, wenn er seit dem letzten Laden neu gebaut wurde. """
+        mtime = os.stat(os.path.join(self.directory, "meta.json")).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._index = _LoadedIndex(self.directory)
+                    self._mtime = mtime
+        return self._index
+
+    def count(self):
+        return self._refresh().meta["num_vectors"]
+
+    def query(self, query_embeddings, n_results=10, include=('metadatas', 'distances'), where=None):
+        """ Wie collection.query() von ChromaDB. where (siehe metadata_filter.py) beschränkt die Suche
+        exakt auf die passenden Zeilen; die übrigen Vektoren werden gar nicht gelesen. """
+        return self.query_loaded(self._refresh(), query_embeddings, n_results, include, where)
+
+    def query_loaded(self, index, query_embeddings, n_results=10, include=('metadatas', 'distances'), where=None):
+        """ Wie query(), aber auf einem bereits geladenen Index (für Benchmarks/Reports). """
+        queries = _normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        if index.ids and queries.shape[1] != index.meta["dim"]:
+            raise ValueError(f"Query embedding dim {queries.shape[1]} does not match index dim {index.meta['dim']}")
+        subset = index.rows_for(parse_where(where)) if where else None
+        total = len(index.ids) if subset is None else len(subset)
+        k = min(n_results, total)
+        # Mit Codes: mehr Kandidaten in der ersten Stufe, danach float-Rescoring
+        first_k = min(k * self.rescore, total) if index.codes is not None else k
+        if k == 0:
+            rows = [np.zeros(0, dtype=np.int64)] * len(queries)
+            similarities = [np.zeros(0, dtype=np.float32)] * len(queries)
+        elif subset is not None:
+            rows, similarities = self._search_exact(index, queries, first_k, subset)
+        elif index.centroids is not None and self.nprobe < len(index.centroids):
+            rows, similarities = zip(*(self._search_ivf(index, query, first_k) for query in queries))
+        else:
+            rows, similarities = self._search_exact(index, queries, first_k)
+        if index.codes is not None and k:
+            rows, similarities = zip(*(self._rescore(index, query, query_rows, k)
+                                       for query, query_rows in zip(queries, rows)))
+
+        results = {'ids': [[index.ids[i] for i in query_rows] for query_rows in rows]}
+        if 'metadatas' in include:
+            results['metadatas'] = [[index.metadatas[i] for i in query_rows] for query_rows in rows]
+        if 'distances' in include:
+            results['distances'] = [(1.0 - query_similarities).tolist() for query_similarities in similarities]
+        return results
+
+    def _search_exact(self, index, queries, k, subset=None):
+        """ Exakte Top-k-Suche über alle Vektoren (bzw. nur die Zeilen in subset), blockweise
+        (Matrix-Produkt + argpartition). """
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        total = len(index.ids) if subset is None else len(subset)
+        for start in range(0, total, query_block_rows):
+            block = slice(start, start + query_block_rows) if subset is None else subset[start:start + query_block_rows]
+            scores = index.approx_scores(queries, block) # (Anfragen x Blockzeilen)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_rows = np.concatenate([best_rows, top + start if subset is None else block[top]], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def _search_ivf(self, index, query, k):
+        """ Approximative Suche: nur die Zeilenbereiche der nprobe ähnlichsten Cluster vergleichen. """
+        probe = np.argpartition(-(index.centroids @ query), self.nprobe - 1)[:self.nprobe]
+        rows = np.concatenate([np.arange(index.list_offsets[c], index.list_offsets[c + 1]) for c in probe])
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows.sort() # Zusammenhängende Lesezugriffe auf die Memory-Map
+        scores = index.approx_scores(query[None, :], rows)[0]
+        return self._top_k(rows, scores, k)
+
+    def _rescore(self, index, query, rows, k):
+        """ Bewertet die Kandidaten der ersten Stufe mit den float-Vektoren neu. """
+        rows = np.sort(np.asarray(rows))
+        scores = np.asarray(index.vectors[rows], dtype=np.float32) @ query
+        return self._top_k(rows, scores, k)
+
+    @staticmethod
+    def _top_k(rows, scores, k):
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return rows[top], scores[top]
+
+
+def benchmark(num_queries=200, k=10, chroma_db_path="chroma_db", collection_name="scientific_papers"):
+    """ Vergleicht Latenz und Übereinstimmung (Recall@k ggü. exakter Suche) der Backends. """
+    index = VectorIndex()
+    loaded = index._refresh()
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(loaded.ids), size=min(num_queries, len(loaded.ids)), replace=False)
+    # Anfragen: gespeicherte Vektoren mit etwas Rauschen (realistischer als reine Zufallsvektoren)
+    queries = _normalize(np.asarray(loaded.vectors[np.sort(rows)], dtype=np.float32)
+                         + rng.normal(scale=0.05, size=(len(rows), loaded.meta["dim"])).astype(np.float32))
+
+    exact_index = VectorIndex(nprobe=len(loaded.centroids) if loaded.centroids is not None else ivf_nprobe)
+    backends = [("numpy exact", exact_index)]
+    if loaded.centroids is not None:
+        backends.append((f"numpy IVF (nprobe {index.nprobe})", index))
+    try:
+        import chromadb
+        backends.append(("chroma", chromadb.PersistentClient(path=chroma_db_path).get_collection(name=collection_name)))
+    except Exception as e:
+        print(f"Chroma not available for comparison: {e}")
+
+    reference = None
+    for name, backend in backends:
+        latencies, results = [], []
+        for query in queries:
+            start_time = time.perf_counter()
+            result = backend.query(query_embeddings=[query.tolist()], n_results=k, include=['metadatas', 'distances'])
+            latencies.append(time.perf_counter() - start_time)
+            results.append(set(result['ids'][0]))
+        if reference is None:
+            reference = results
+        recall = np.mean([len(found & expected) / max(len(expected), 1) for found, expected in zip(results, reference)])
+        latencies = np.array(latencies) * 1000
+        print(f"{name:28s} p50 {np.percentile(latencies, 50):7.2f} ms   p95 {np.percentile(latencies, 95):7.2f} ms"
+              f"   recall@{k} vs. exact {recall:.3f}")
+
+
+def recall_report(num_queries=200, k=10, factors=(1, 4, 10, 20)):
+    """ Recall@k der quantisierten Varianten (mit Rescoring) gegenüber der exakten float-Suche.
+
+    Die Codes werden aus dem bestehenden Index im Arbeitsspeicher berechnet, es muss also
+    nicht für jede Variante neu gebaut werden. IVF bleibt hier aus, um nur den Effekt der
+    Quantisierung zu messen.
+    """
+    loaded = VectorIndex()._refresh()
+    if not loaded.ids:
+        print("Vector index is empty.")
+        return
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(loaded.ids), size=min(num_queries, len(loaded.ids)), replace=False)
+    queries = _normalize(np.asarray(loaded.vectors[np.sort(rows)], dtype=np.float32)
+                         + rng.normal(scale=0.05, size=(len(rows), loaded.meta["dim"])).astype(np.float32))
+
+    def variant(mode):
+        index = copy.copy(loaded)
+        index.centroids = index.list_offsets = None
+        index.quantization, index.codes, index.scales = mode, None, None
+        if mode == "float16":
+            index.codes = np.asarray(loaded.vectors, dtype=np.float16)
+        elif mode != "none":
+            index.codes, index.scales = quantize(loaded.vectors, mode)
+        return index
+
+    def run(index, rescore):
+        searcher = VectorIndex(rescore=rescore)
+        latencies, results = [], []
+        for query in queries:
+            start_time = time.perf_counter()
+            result = searcher.query_loaded(index, [query], n_results=k, include=[])
+            latencies.append(time.perf_counter() - start_time)
+            results.append(set(result['ids'][0]))
+        return results, np.array(latencies) * 1000
+
+    reference, latencies = run(variant("none"), 1)
+    print(f"{len(loaded.ids)} vectors, dim {loaded.meta['dim']}, {len(queries)} queries, k={k}")
+    print(f"{'float32 (reference)':28s} {4 * loaded.meta['dim']:5d} B/vector   "
+          f"p50 {np.percentile(latencies, 50):7.2f} ms   recall@{k} 1.000")
+    for mode in ("float16", "int8", "binary"):
+        index = variant(mode)
+        code_bytes = (index.codes.nbytes + (index.scales.nbytes if index.scales is not None else 0)) // len(loaded.ids)
+        for factor in factors:
+            results, latencies = run(index, factor)
+            recall = np.mean([len(found & expected) / max(len(expected), 1)
+                              for found, expected in zip(results, reference)])
+            print(f"{mode + f' (rescore x{factor})':28s} {code_bytes:5d} B/vector   "
+                  f"p50 {np.percentile(latencies, 50):7.2f} ms   recall@{k} {recall:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Baut den In-Process-Vektorindex oder vergleicht die Backends.")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=vector_dtype)
+    parser.add_argument("--ivf-lists", type=int, default=ivf_lists, help="IVF-Cluster (0 = exakte Suche)")
+    parser.add_argument("--quantization", choices=["none", "int8", "binary"], default=quantization,
+                        help="Quantisierte Codes für die erste Suchstufe (float-Rescoring der Kandidaten)")
+    parser.add_argument("--benchmark", action="store_true", help="Latenz/Recall von numpy- und Chroma-Backend vergleichen")
+    parser.add_argument("--recall-report", action="store_true",
+                        help="Recall@k von float16/int8/binary (mit Rescoring) ggü. exakter float-Suche")
+    parser.add_argument("--queries", type=int, default=200, help="Anzahl Anfragen für --benchmark/--recall-report")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(num_queries=args.queries)
+        return
+    if args.recall_report:
+        recall_report(num_queries=args.queries)
+        return
+    if not os.path.exists(embeddings_input_directory):
+        print(f"Error: Embeddings input directory '{embeddings_input_directory}' not found.")
+        exit()
+    print(f"Building vector index '{vector_index_directory}' from '{embeddings_input_directory}'...")
+    build_index(dtype=args.dtype, num_lists=args.ivf_lists, quantization_mode=args.quantization)
+
+
+if __name__ == '__main__':
+    main()